@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 
 import os
 from pathlib import Path
+
 from decouple import config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -212,6 +213,77 @@ MAPBOX_DIRECTIONS_URL = config(
     "MAPBOX_DIRECTIONS_URL",
     default="https://api.mapbox.com/directions/v5/mapbox/driving",
 )
+# Keep-alive connections to Mapbox are pooled per host and process; 429/5xx responses are retried
+# with exponential backoff (or the server's Retry-After, capped).
+MAPBOX_HTTP_POOL_SIZE = config("MAPBOX_HTTP_POOL_SIZE", default=10, cast=int)
+MAPBOX_HTTP_CONNECT_TIMEOUT = config("MAPBOX_HTTP_CONNECT_TIMEOUT", default=5.0, cast=float)
+MAPBOX_HTTP_READ_TIMEOUT = config("MAPBOX_HTTP_READ_TIMEOUT", default=20.0, cast=float)
+MAPBOX_HTTP_MAX_RETRIES = config("MAPBOX_HTTP_MAX_RETRIES", default=3, cast=int)
+MAPBOX_HTTP_BACKOFF_SECONDS = config("MAPBOX_HTTP_BACKOFF_SECONDS", default=0.5, cast=float)
+MAPBOX_HTTP_MAX_RETRY_AFTER = config("MAPBOX_HTTP_MAX_RETRY_AFTER", default=10.0, cast=float)
+
+# Route Planner Configuration
+STATION_GRID_CELL_DEGREES = config("STATION_GRID_CELL_DEGREES", default=0.25, cast=float)
+# "auto" uses the NumPy geometry engine when NumPy is installed; "python" forces the scalar path.
+ROUTE_GEOMETRY_ENGINE = config("ROUTE_GEOMETRY_ENGINE", default="auto")
+# "projection" measures stations against route segments; "vertex" snaps to the nearest route point.
+ROUTE_STATION_MATCH_MODE = config("ROUTE_STATION_MATCH_MODE", default="projection")
+# "snapshot" matches against every station held in memory; "corridor" queries only the grid cells
+# (FuelStation.grid_cell) along each route from the database.
+ROUTE_STATION_SOURCE = config("ROUTE_STATION_SOURCE", default="snapshot")
+# Precomputed cell -> nearby stations table (corridors.py), rebuilt incrementally after each upload.
+# Routes matched within ROUTE_CORRIDOR_RADIUS_MILES read their candidates from it; changing the cell
+# size or radius takes a full `manage.py rebuild_station_corridors`.
+ROUTE_CORRIDOR_TABLE_ENABLED = config("ROUTE_CORRIDOR_TABLE_ENABLED", default=False, cast=bool)
+ROUTE_CORRIDOR_CELL_DEGREES = config("ROUTE_CORRIDOR_CELL_DEGREES", default=0.1, cast=float)
+ROUTE_CORRIDOR_RADIUS_MILES = config("ROUTE_CORRIDOR_RADIUS_MILES", default=10.0, cast=float)
+ROUTE_SIMPLIFY_MIN_MILES = config("ROUTE_SIMPLIFY_MIN_MILES", default=1.0, cast=float)
+# Directions are cached per endpoint pair rounded to this many decimal places (3 is about 110 m).
+ROUTE_CACHE_COORD_PRECISION = config("ROUTE_CACHE_COORD_PRECISION", default=3, cast=int)
+ROUTE_CACHE_TIMEOUT = config("ROUTE_CACHE_TIMEOUT", default=60 * 60 * 24, cast=int)
+# Tank resolution of the optimal planner. The step is coarsened when stations x tank levels x stop
+# limit would exceed ROUTE_OPTIMAL_MAX_STATES, which keeps a 1,000 station plan around 50 ms.
+ROUTE_OPTIMAL_FUEL_STEP_GALLONS = config("ROUTE_OPTIMAL_FUEL_STEP_GALLONS", default=0.25, cast=float)
+ROUTE_OPTIMAL_MAX_STATES = config("ROUTE_OPTIMAL_MAX_STATES", default=200_000, cast=int)
+
+# Rows upserted per bulk statement/transaction when importing fuel station CSVs.
+FUEL_STATION_IMPORT_BATCH_SIZE = config("FUEL_STATION_IMPORT_BATCH_SIZE", default=500, cast=int)
+# Uploads larger than this are split into line-aligned byte ranges imported by parallel Celery tasks.
+FUEL_STATION_IMPORT_CHUNK_BYTES = config("FUEL_STATION_IMPORT_CHUNK_BYTES", default=4 * 1024 * 1024, cast=int)
+# Parallel geocoding lookups during import, throttled to the Mapbox geocoding rate limit.
+FUEL_STATION_GEOCODE_CONCURRENCY = config("FUEL_STATION_GEOCODE_CONCURRENCY", default=8, cast=int)
+FUEL_STATION_GEOCODE_RATE_PER_SECOND = config("FUEL_STATION_GEOCODE_RATE_PER_SECOND", default=10.0, cast=float)
+
+# Process-local cache in front of Redis. Station-derived entries are keyed by the station
+# generation, which each worker re-reads at most every ROUTE_PLANNER_GENERATION_CHECK_SECONDS.
+ROUTE_PLANNER_L1_CACHE_MAX_ENTRIES = config("ROUTE_PLANNER_L1_CACHE_MAX_ENTRIES", default=1024, cast=int)
+ROUTE_PLANNER_L1_CACHE_TIMEOUT = config("ROUTE_PLANNER_L1_CACHE_TIMEOUT", default=300, cast=int)
+ROUTE_PLANNER_GENERATION_CHECK_SECONDS = config("ROUTE_PLANNER_GENERATION_CHECK_SECONDS", default=1.0, cast=float)
+# Concurrent misses for the same route plan or station snapshot are computed once: the others wait
+# up to SINGLE_FLIGHT_WAIT_SECONDS for the lock holder. Expired plans are served for up to
+# ROUTE_PLAN_STALE_SECONDS while one request refreshes them.
+SINGLE_FLIGHT_LOCK_TIMEOUT = config("SINGLE_FLIGHT_LOCK_TIMEOUT", default=30, cast=int)
+SINGLE_FLIGHT_WAIT_SECONDS = config("SINGLE_FLIGHT_WAIT_SECONDS", default=20.0, cast=float)
+SINGLE_FLIGHT_POLL_SECONDS = config("SINGLE_FLIGHT_POLL_SECONDS", default=0.05, cast=float)
+ROUTE_PLAN_STALE_SECONDS = config("ROUTE_PLAN_STALE_SECONDS", default=600, cast=int)
+# Batch planning: lanes per request, and concurrent Mapbox lookups (keep within MAPBOX_HTTP_POOL_SIZE).
+ROUTE_PLAN_BATCH_MAX_LANES = config("ROUTE_PLAN_BATCH_MAX_LANES", default=500, cast=int)
+ROUTE_PLAN_BATCH_WORKERS = config("ROUTE_PLAN_BATCH_WORKERS", default=8, cast=int)
+# Per-stage timings (Redis, Mapbox, station matching, planning) on route plan responses as a
+# Server-Timing header; requests slower than ROUTE_SLOW_REQUEST_MS are also logged with the breakdown.
+ROUTE_TIMING_ENABLED = config("ROUTE_TIMING_ENABLED", default=False, cast=bool)
+ROUTE_SLOW_REQUEST_MS = config("ROUTE_SLOW_REQUEST_MS", default=1000, cast=int)
+# Metrics are buffered per process and summed into one Redis hash, so /api/v1/metrics/ reports totals
+# across every gunicorn and Celery process. Set METRICS_TOKEN to require "Authorization: Bearer <token>".
+METRICS_ENABLED = config("METRICS_ENABLED", default=True, cast=bool)
+METRICS_FLUSH_SECONDS = config("METRICS_FLUSH_SECONDS", default=1.0, cast=float)
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+# Queued route plans. Point ROUTE_PLAN_JOB_QUEUE at a dedicated queue to size its workers apart from
+# CSV imports (celery -A core worker -Q route_plans); the status endpoint long-polls for at most
+# ROUTE_PLAN_JOB_MAX_WAIT_SECONDS.
+ROUTE_PLAN_JOB_QUEUE = config("ROUTE_PLAN_JOB_QUEUE", default="celery")
+ROUTE_PLAN_JOB_MAX_WAIT_SECONDS = config("ROUTE_PLAN_JOB_MAX_WAIT_SECONDS", default=25.0, cast=float)
+ROUTE_PLAN_JOB_POLL_SECONDS = config("ROUTE_PLAN_JOB_POLL_SECONDS", default=0.25, cast=float)
 
 # Cache Configuration
 CACHES = {
@@ -7,7 +7,7 @@ from django.shortcuts import redirect, render
 from django.urls import path
 
 from .forms import FuelStationUploadForm
-from .models import FuelStation, FuelStationUploadJob
+from .models import FuelStation, FuelStationUploadJob, GeocodedAddress, RoutePlanJob
 from .tasks import process_fuel_station_csv
 
 
@@ -44,6 +44,7 @@ class FuelStationAdmin(admin.ModelAdmin):
                 job = FuelStationUploadJob.objects.create(
                     file_path=saved_path,
                     original_filename=file_obj.name,
+                    mode=form.cleaned_data["mode"],
                 )
                 process_fuel_station_csv.delay(job.id)
                 messages.info(request, "Upload queued. Progress will appear on the status page.")
@@ -80,9 +81,24 @@ class FuelStationAdmin(admin.ModelAdmin):
                 "updated_count": job.updated_count,
                 "geocoded_count": job.geocoded_count,
                 "failed_count": job.failed_count,
+                "price_changed_count": job.price_changed_count,
+                "rows_per_second": job.rows_per_second,
                 "percent": percent,
                 "error_log": job.error_log,
                 "started_at": job.started_at.isoformat() if job.started_at else None,
                 "finished_at": job.finished_at.isoformat() if job.finished_at else None,
             }
         )
+
+
+@admin.register(GeocodedAddress)
+class GeocodedAddressAdmin(admin.ModelAdmin):
+    list_display = ("normalized_address", "latitude", "longitude", "created_at")
+    search_fields = ("normalized_address", "place_name")
+
+
+@admin.register(RoutePlanJob)
+class RoutePlanJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "status", "created_at", "finished_at")
+    list_filter = ("status",)
+    readonly_fields = ("request", "result", "error", "started_at", "finished_at")
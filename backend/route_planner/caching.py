@@ -0,0 +1,338 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from . import instrumentation
+
+STATION_GENERATION_KEY = "fuel_stations:version"
+
+_MISSING = object()
+
+T = TypeVar("T")
+
+
+class LocalLRUCache:
+    """Bounded, thread-safe, per-process LRU cache with per-entry expiry."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, timeout: float) -> None:
+        if timeout <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class TieredCache:
+    """Process-local LRU (L1) in front of the shared Django cache (L2).
+
+    L1 entries live for at most ``ROUTE_PLANNER_L1_CACHE_TIMEOUT`` seconds. Anything derived from
+    station data must put ``station_generation()`` in its key so a generation bump retires it in
+    every process without touching individual keys.
+    """
+
+    def __init__(self) -> None:
+        self.local = LocalLRUCache(getattr(settings, "ROUTE_PLANNER_L1_CACHE_MAX_ENTRIES", 1024))
+
+    @property
+    def local_timeout(self) -> float:
+        return getattr(settings, "ROUTE_PLANNER_L1_CACHE_TIMEOUT", 300)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        return self.get_shared(key, default)
+
+    def get_shared(self, key: str, default: Any = None) -> Any:
+        # Skip L1, e.g. to see whether another worker has already refreshed an entry.
+        with instrumentation.stage("redis"):
+            value = cache.get(key, _MISSING)
+        if value is _MISSING:
+            return default
+        self.local.set(key, value, self.local_timeout)
+        return value
+
+    def set(self, key: str, value: Any, timeout: Optional[float]) -> None:
+        with instrumentation.stage("redis"):
+            cache.set(key, value, timeout=timeout)
+        local_timeout = self.local_timeout if timeout is None else min(timeout, self.local_timeout)
+        self.local.set(key, value, local_timeout)
+
+    def delete(self, key: str) -> None:
+        cache.delete(key)
+        self.local.delete(key)
+
+
+class SingleFlight:
+    """Lets one caller compute a missing key while concurrent callers wait for its result.
+
+    Threads in a process queue on a per-key lock; processes coordinate through a Redis lock taken
+    with ``cache.add``. Waiters poll for the value and compute it themselves if the holder has not
+    published it within ``SINGLE_FLIGHT_WAIT_SECONDS``, so a crashed worker only delays them.
+    """
+
+    def __init__(self) -> None:
+        self._locks: Dict[str, List[Any]] = {}
+        self._guard = threading.Lock()
+
+    @staticmethod
+    def _lock_key(key: str) -> str:
+        return f"{key}:lock"
+
+    def acquire(self, key: str) -> Optional[str]:
+        token = uuid.uuid4().hex
+        timeout = getattr(settings, "SINGLE_FLIGHT_LOCK_TIMEOUT", 30)
+        return token if cache.add(self._lock_key(key), token, timeout=timeout) else None
+
+    def release(self, key: str, token: str) -> None:
+        # Only drop our own lock; after a timeout it may already belong to someone else.
+        if cache.get(self._lock_key(key)) == token:
+            cache.delete(self._lock_key(key))
+
+    def locked(self, key: str) -> bool:
+        return cache.get(self._lock_key(key)) is not None
+
+    @contextmanager
+    def _local_lock(self, key: str) -> Iterator[None]:
+        with self._guard:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    def run(self, key: str, load: Callable[[], Optional[T]], compute: Callable[[], T]) -> T:
+        """Return ``load()`` if it finds a value, otherwise ``compute()`` it at most once cluster-wide."""
+        value = load()
+        if value is not None:
+            return value
+        with self._local_lock(key):
+            value = load()
+            if value is not None:
+                return value
+            poll = getattr(settings, "SINGLE_FLIGHT_POLL_SECONDS", 0.05)
+            deadline = time.monotonic() + getattr(settings, "SINGLE_FLIGHT_WAIT_SECONDS", 20)
+            while True:
+                token = self.acquire(key)
+                if token is not None:
+                    try:
+                        return compute()
+                    finally:
+                        self.release(key, token)
+                time.sleep(poll)
+                value = load()
+                if value is not None:
+                    return value
+                if time.monotonic() >= deadline:
+                    return compute()
+
+
+class _Generation:
+    def __init__(self) -> None:
+        self._value: Optional[int] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self, fresh: bool = False) -> int:
+        interval = getattr(settings, "ROUTE_PLANNER_GENERATION_CHECK_SECONDS", 1.0)
+        now = time.monotonic()
+        with self._lock:
+            if not fresh and self._value is not None and now - self._checked_at < interval:
+                return self._value
+        value = cache.get(STATION_GENERATION_KEY)
+        if value is None:
+            cache.add(STATION_GENERATION_KEY, 1, timeout=None)
+            value = cache.get(STATION_GENERATION_KEY, 1)
+        self._store(value, now)
+        return value
+
+    def bump(self) -> int:
+        try:
+            value = cache.incr(STATION_GENERATION_KEY)
+        except ValueError:
+            cache.add(STATION_GENERATION_KEY, 1, timeout=None)
+            value = cache.get(STATION_GENERATION_KEY, 1)
+        self._store(value, time.monotonic())
+        return value
+
+    def reset(self) -> None:
+        with self._lock:
+            self._value = None
+
+    def _store(self, value: int, checked_at: float) -> None:
+        with self._lock:
+            self._value = value
+            self._checked_at = checked_at
+
+
+tiered_cache = TieredCache()
+single_flight = SingleFlight()
+_generation = _Generation()
+
+
+def station_generation(fresh: bool = False) -> int:
+    """Current station data generation, re-read from Redis at most every few seconds per process.
+
+    ``fresh`` always reads Redis, for writers that must build on the latest generation.
+    """
+    return _generation.current(fresh)
+
+
+def bump_station_generation() -> int:
+    return _generation.bump()
+
+
+def reset_local_caches() -> None:
+    tiered_cache.local.clear()
+    _generation.reset()
+
+
+def _load_entry(key: str, shared: bool = False) -> Optional[Dict[str, Any]]:
+    entry = tiered_cache.get_shared(key) if shared else tiered_cache.get(key)
+    return entry if isinstance(entry, dict) and "fresh_until" in entry else None
+
+
+def _store_entry(key: str, value: Any, timeout: float, stale_timeout: float) -> None:
+    tiered_cache.set(key, {"value": value, "fresh_until": time.time() + timeout}, timeout=timeout + stale_timeout)
+
+
+def _current_entry(key: str) -> Optional[Dict[str, Any]]:
+    entry = _load_entry(key)
+    if entry is not None and entry["fresh_until"] <= time.time():
+        # L1 may be behind; another worker could already have refreshed the shared entry.
+        entry = _load_entry(key, shared=True)
+    return entry
+
+
+def is_cached(key: str) -> bool:
+    """Whether ``get_or_compute`` would answer ``key`` from the cache, fresh or stale."""
+    return _current_entry(key) is not None
+
+
+def get_or_compute(key: str, compute: Callable[[], T], timeout: float, stale_timeout: float = 0) -> T:
+    """Cached ``compute()`` with single-flight misses and stale-while-revalidate.
+
+    Entries are fresh for ``timeout`` seconds and then served stale for up to ``stale_timeout`` more,
+    while the one caller that wins the refresh lock recomputes them.
+    """
+
+    def store() -> T:
+        value = compute()
+        _store_entry(key, value, timeout, stale_timeout)
+        return value
+
+    entry = _current_entry(key)
+    if entry is None:
+        return single_flight.run(key, lambda: (_load_entry(key) or {}).get("value"), store)
+    if entry["fresh_until"] > time.time():
+        return entry["value"]
+
+    token = single_flight.acquire(key)
+    if token is None:
+        return entry["value"]
+    try:
+        return store()
+    finally:
+        single_flight.release(key, token)
+
+
+async def aget_or_compute(
+    key: str,
+    compute: Callable[[], Awaitable[T]],
+    timeout: float,
+    stale_timeout: float = 0,
+    keep: Optional[Callable[[T], bool]] = None,
+) -> T:
+    """``get_or_compute`` for coroutines: waiting happens on the event loop, not in a thread.
+
+    Computed values for which ``keep`` returns False are returned without being stored.
+    """
+    entry = await sync_to_async(_current_entry, thread_sensitive=False)(key)
+    if entry is not None and entry["fresh_until"] > time.time():
+        return entry["value"]
+
+    async def store() -> T:
+        value = await compute()
+        if keep is None or keep(value):
+            await sync_to_async(_store_entry, thread_sensitive=False)(key, value, timeout, stale_timeout)
+        return value
+
+    acquire = sync_to_async(single_flight.acquire, thread_sensitive=False)
+    release = sync_to_async(single_flight.release, thread_sensitive=False)
+    if entry is not None:
+        token = await acquire(key)
+        if token is None:
+            return entry["value"]
+        try:
+            return await store()
+        finally:
+            await release(key, token)
+
+    poll = getattr(settings, "SINGLE_FLIGHT_POLL_SECONDS", 0.05)
+    deadline = time.monotonic() + getattr(settings, "SINGLE_FLIGHT_WAIT_SECONDS", 20)
+    while True:
+        token = await acquire(key)
+        if token is not None:
+            try:
+                return await store()
+            finally:
+                await release(key, token)
+        await asyncio.sleep(poll)
+        entry = await sync_to_async(_load_entry, thread_sensitive=False)(key)
+        if entry is not None:
+            return entry["value"]
+        if time.monotonic() >= deadline:
+            return await compute()
@@ -0,0 +1,214 @@
+import math
+from array import array
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from . import geometry
+from .models import FuelStation, StationCorridorCell
+from .snapshot import StationSnapshot
+from .spatial import (
+    MILES_PER_DEGREE,
+    cell_key,
+    corridor_cells,
+    degree_buffers,
+    grid_cell_key,
+    haversine_miles,
+    segment_cells,
+)
+
+# Cell keys per ``IN (...)`` statement, well under SQLite's bound parameter limit.
+QUERY_CHUNK = 500
+# Stations are listed for cells up to this much beyond the radius. It absorbs the difference between
+# the distance to a cell's nearest edge point and the matcher's projected distances.
+SLACK_MILES = 0.1
+
+_table: Optional["CorridorTable"] = None
+
+
+def table_settings() -> Tuple[float, float]:
+    """(cell degrees, radius miles) of the corridor table in use."""
+    return (
+        getattr(settings, "ROUTE_CORRIDOR_CELL_DEGREES", 0.1),
+        getattr(settings, "ROUTE_CORRIDOR_RADIUS_MILES", 10.0),
+    )
+
+
+def cells_near_station(lat: float, lon: float, cell_degrees: float, radius_miles: float) -> List[int]:
+    """Keys of the cells that have some point within ``radius_miles`` of the station."""
+    reach = radius_miles + SLACK_MILES
+    lat_buffer, lon_buffer = degree_buffers(lat, reach)
+    first_row, last_row = (math.floor((lat + offset + 90) / cell_degrees) for offset in (-lat_buffer, lat_buffer))
+    first_col, last_col = (math.floor((lon + offset + 180) / cell_degrees) for offset in (-lon_buffer, lon_buffer))
+    keys = []
+    for row in range(first_row, last_row + 1):
+        south = row * cell_degrees - 90
+        nearest_lat = min(max(lat, south), south + cell_degrees)
+        for column in range(first_col, last_col + 1):
+            west = column * cell_degrees - 180
+            if haversine_miles((lat, lon), (nearest_lat, min(max(lon, west), west + cell_degrees))) <= reach:
+                keys.append(cell_key(row, column, cell_degrees))
+    return keys
+
+
+def build_corridor_cells(
+    stations: Iterable[Tuple[int, float, float]], cell_degrees: float, radius_miles: float
+) -> Dict[int, List[int]]:
+    """Cell key -> ids of the stations within ``radius_miles`` of it, from (id, latitude, longitude) rows."""
+    cells: Dict[int, List[int]] = defaultdict(list)
+    for station_id, lat, lon in stations:
+        for key in cells_near_station(lat, lon, cell_degrees, radius_miles):
+            cells[key].append(station_id)
+    return cells
+
+
+class CorridorTable:
+    """Snapshot positions of the stations near each cell, for routes matched within ``radius_miles``.
+
+    Quacks like StationGridIndex for the pure-Python matchers: the candidates of a route segment are
+    the union of the lists of the cells it passes through, already limited to stations that can be in
+    range, so only exact distance checks remain.
+    """
+
+    def __init__(
+        self,
+        snapshot: StationSnapshot,
+        cells: Dict[int, Sequence[int]],
+        cell_degrees: float,
+        radius_miles: float,
+    ):
+        self.layout = (snapshot.details_version, snapshot.layout_hash)
+        self.latitudes = snapshot.latitudes
+        self.longitudes = snapshot.longitudes
+        self.cells = cells
+        self.cell_degrees = cell_degrees
+        self.radius_miles = radius_miles
+
+    def __len__(self) -> int:
+        return len(self.latitudes)
+
+    @classmethod
+    def from_snapshot(cls, snapshot: StationSnapshot, cell_degrees: float, radius_miles: float) -> "CorridorTable":
+        stations = zip(range(len(snapshot)), snapshot.latitudes, snapshot.longitudes)
+        cells = build_corridor_cells(stations, cell_degrees, radius_miles)
+        packed = {key: array("q", positions) for key, positions in cells.items()}
+        return cls(snapshot, packed, cell_degrees, radius_miles)
+
+    def covers(self, radius_miles: float) -> bool:
+        return radius_miles <= self.radius_miles
+
+    def query_radius(self, lat: float, lon: float, radius_miles: float) -> Sequence[int]:
+        return self.cells.get(grid_cell_key(lat, lon, self.cell_degrees), ())
+
+    def query_segment(
+        self, start: Tuple[float, float], end: Tuple[float, float], radius_miles: float
+    ) -> Iterable[int]:
+        keys = segment_cells(start, end, self.cell_degrees)
+        if len(keys) == 1:
+            return self.cells.get(keys[0], ())
+        return set().union(*(self.cells.get(key, ()) for key in keys))
+
+
+def located_stations(cells: Iterable[int], *fields: str) -> Iterator[Dict[str, Any]]:
+    """Rows of the stations whose ``grid_cell`` is one of ``cells``, with the given fields."""
+    cells = sorted(cells)
+    for start in range(0, len(cells), QUERY_CHUNK):
+        yield from FuelStation.objects.filter(grid_cell__in=cells[start : start + QUERY_CHUNK]).values(*fields)
+
+
+def _station_points(rows: Iterable[Dict[str, Any]]) -> Iterator[Tuple[int, float, float]]:
+    for row in rows:
+        yield row["id"], row["latitude"], row["longitude"]
+
+
+def refresh_station_corridors(station_ids: Optional[Iterable[int]] = None) -> int:
+    """Rebuild the stored corridor cells around ``station_ids``, or all of them; returns the cells written.
+
+    Cells are recomputed from every station near them, so created and re-geocoded stations are picked
+    up. A station that moved or was deleted still needs a full rebuild to leave its old cells. A full
+    rebuild also runs whenever no table exists yet for the current cell size and radius.
+    """
+    cell_degrees, radius_miles = table_settings()
+    current = StationCorridorCell.objects.filter(cell_degrees=cell_degrees, radius_miles=radius_miles)
+    if station_ids is None or not current.exists():
+        located = FuelStation.objects.exclude(latitude__isnull=True).exclude(longitude__isnull=True)
+        rows = located.values("id", "latitude", "longitude").order_by("id").iterator(chunk_size=2000)
+        cells = build_corridor_cells(_station_points(rows), cell_degrees, radius_miles)
+        with transaction.atomic():
+            # Tables built for other settings are dropped along with this one.
+            StationCorridorCell.objects.all().delete()
+            _write_cells(cells, cell_degrees, radius_miles)
+        return len(cells)
+
+    changed: Set[int] = set()
+    nearby: Set[int] = set()
+    # A station listed in an affected cell lies within the radius of it, so within two radii and a
+    # cell diagonal of the changed station that made the cell affected.
+    reach = 2 * (radius_miles + SLACK_MILES) + cell_degrees * MILES_PER_DEGREE * math.sqrt(2)
+    ids = sorted(set(station_ids))
+    for start in range(0, len(ids), QUERY_CHUNK):
+        rows = FuelStation.objects.filter(id__in=ids[start : start + QUERY_CHUNK], grid_cell__isnull=False)
+        for lat, lon in rows.values_list("latitude", "longitude"):
+            changed.update(cells_near_station(lat, lon, cell_degrees, radius_miles))
+            nearby.update(corridor_cells([(lat, lon)], reach))
+    if not changed:
+        return 0
+
+    rows = sorted(located_stations(nearby, "id", "latitude", "longitude"), key=lambda row: row["id"])
+    cells = build_corridor_cells(_station_points(rows), cell_degrees, radius_miles)
+    affected = sorted(changed)
+    with transaction.atomic():
+        for start in range(0, len(affected), QUERY_CHUNK):
+            current.filter(cell__in=affected[start : start + QUERY_CHUNK]).delete()
+        _write_cells({key: cells[key] for key in affected if cells.get(key)}, cell_degrees, radius_miles)
+    return len(affected)
+
+
+def _write_cells(cells: Dict[int, List[int]], cell_degrees: float, radius_miles: float) -> None:
+    StationCorridorCell.objects.bulk_create(
+        (
+            StationCorridorCell(
+                cell_degrees=cell_degrees,
+                radius_miles=radius_miles,
+                cell=key,
+                station_ids=array("q", sorted(ids)).tobytes(),
+            )
+            for key, ids in cells.items()
+        ),
+        batch_size=2000,
+    )
+
+
+def corridor_table(snapshot: StationSnapshot) -> Optional[CorridorTable]:
+    """The stored corridor table mapped onto ``snapshot``, or None when it is disabled or not built.
+
+    Each process loads it once per published station layout, like the snapshot itself; price-only
+    refreshes keep the layout and so keep the table. The layout hash is checked too, since positions
+    are only valid for the exact stations they were mapped onto. Only the pure-Python matchers use
+    it, so nothing is loaded while the NumPy engine is in use.
+    """
+    global _table
+    if not getattr(settings, "ROUTE_CORRIDOR_TABLE_ENABLED", False) or geometry.use_numpy():
+        return None
+    cell_degrees, radius_miles = table_settings()
+    table = _table
+    if (
+        table is not None
+        and table.layout == (snapshot.details_version, snapshot.layout_hash)
+        and (table.cell_degrees, table.radius_miles) == (cell_degrees, radius_miles)
+    ):
+        return table if table.cells else None
+
+    rows = StationCorridorCell.objects.filter(cell_degrees=cell_degrees, radius_miles=radius_miles)
+    cells: Dict[int, array] = {}
+    for key, blob in rows.values_list("cell", "station_ids").iterator(chunk_size=2000):
+        ids = array("q")
+        ids.frombytes(bytes(blob))
+        positions = [snapshot.position_of(station_id) for station_id in ids]
+        cells[key] = array("q", sorted(position for position in positions if position is not None))
+    # An empty table is kept too, so a process does not query for it again until the layout changes.
+    _table = CorridorTable(snapshot, cells, cell_degrees, radius_miles)
+    return _table if cells else None
+
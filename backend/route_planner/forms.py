@@ -1,5 +1,12 @@
 from django import forms
 
+from .models import FuelStationUploadJob
+
 
 class FuelStationUploadForm(forms.Form):
     csv_file = forms.FileField()
+    mode = forms.ChoiceField(
+        choices=FuelStationUploadJob.MODE_CHOICES,
+        initial=FuelStationUploadJob.MODE_FULL,
+        help_text="Price refresh only rewrites prices for stations that already exist.",
+    )
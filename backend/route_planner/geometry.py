@@ -0,0 +1,264 @@
+from itertools import chain
+from typing import Any, Dict, List, Sequence, Tuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .spatial import StationGridIndex, degree_buffers
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised only when the optional dependency is missing
+    np = None
+
+EARTH_RADIUS_MILES = 3958.7613
+
+ENGINE_AUTO = "auto"
+ENGINE_NUMPY = "numpy"
+ENGINE_PYTHON = "python"
+
+# Upper bound on station x marker cells held in memory at once by the distance matrix.
+MATRIX_CHUNK_ELEMENTS = 1_000_000
+
+
+def numpy_available() -> bool:
+    return np is not None
+
+
+def use_numpy() -> bool:
+    engine = getattr(settings, "ROUTE_GEOMETRY_ENGINE", ENGINE_AUTO)
+    if engine == ENGINE_PYTHON:
+        return False
+    if engine == ENGINE_NUMPY and np is None:
+        raise ImproperlyConfigured("ROUTE_GEOMETRY_ENGINE is 'numpy' but NumPy is not installed.")
+    return np is not None
+
+
+def haversine_miles_array(lat1: Any, lon1: Any, lat2: Any, lon2: Any) -> Any:
+    """Broadcasting counterpart of ``services.haversine_miles``; inputs are degrees."""
+    dlat = np.radians(lat2 - lat1)
+    dlon = np.radians(lon2 - lon1)
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    h = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(h))
+
+
+def as_arrays(points: Sequence[Tuple[float, float]]) -> Tuple[Any, Any]:
+    coords = np.fromiter(chain.from_iterable(points), dtype=np.float64, count=2 * len(points)).reshape(-1, 2)
+    return coords[:, 0], coords[:, 1]
+
+
+def cumulative_miles(lats: Any, lons: Any) -> Any:
+    miles = np.zeros(len(lats), dtype=np.float64)
+    if len(lats) > 1:
+        np.cumsum(haversine_miles_array(lats[:-1], lons[:-1], lats[1:], lons[1:]), out=miles[1:])
+    return miles
+
+
+def simplify_indices(lats: Any, lons: Any, min_miles: float, chunk_size: int = 16) -> List[int]:
+    """Indices kept by the distance-threshold simplification, measured from the last kept point."""
+    count = len(lats)
+    if count == 0:
+        return []
+    # Straight-line distance never exceeds distance along the polyline, so no point whose
+    # cumulative mileage is within ``min_miles`` of the anchor can qualify; skip straight past them.
+    # The slack absorbs rounding differences between the two sums.
+    along = cumulative_miles(lats, lons)
+    slack = min_miles * 1e-9 + 1e-9
+    cos_lats = np.cos(np.radians(lats))
+    kept = [0]
+    anchor = 0
+    start = 1
+    window = chunk_size
+    while start < count:
+        start = max(start, int(np.searchsorted(along, along[anchor] + min_miles - slack)))
+        if start >= count:
+            break
+        end = min(start + window, count)
+        # Same operation order as the scalar haversine, with the per-point cosines hoisted out.
+        half_dlat = np.radians(lats[start:end] - lats[anchor]) / 2
+        half_dlon = np.radians(lons[start:end] - lons[anchor]) / 2
+        h = np.sin(half_dlat) ** 2 + cos_lats[anchor] * cos_lats[start:end] * np.sin(half_dlon) ** 2
+        distances = 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(h))
+        hits = np.flatnonzero(distances >= min_miles)
+        if hits.size:
+            anchor = start + int(hits[0])
+            kept.append(anchor)
+            start = anchor + 1
+            window = chunk_size
+        else:
+            start = end
+            # Winding stretches grow the probe instead of looping in small steps.
+            window *= 2
+    last = count - 1
+    if lats[kept[-1]] != lats[last] or lons[kept[-1]] != lons[last]:
+        kept.append(last)
+    return kept
+
+
+def decode_polyline(polyline: str, precision: float = 1e6) -> Tuple[Any, Any]:
+    """Vectorized counterpart of ``services.decode_polyline6``; returns latitude and longitude arrays."""
+    chunks = np.frombuffer(polyline.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    ends = np.flatnonzero(chunks < 0x20)
+    if len(ends) % 2 or (len(chunks) and (not len(ends) or ends[-1] != len(chunks) - 1)):
+        raise ValueError("Malformed polyline.")
+    if not len(ends):
+        return np.empty(0), np.empty(0)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    # Each value is a run of 5-bit chunks, least significant first, the last one without the 0x20 flag.
+    shifts = 5 * (np.arange(len(chunks)) - np.repeat(starts, ends - starts + 1))
+    values = np.bitwise_or.reduceat((chunks & 0x1F) << shifts, starts)
+    deltas = (values >> 1) ^ -(values & 1)
+    coords = np.cumsum(deltas.reshape(-1, 2), axis=0) / precision
+    return coords[:, 0], coords[:, 1]
+
+
+def simplify_route_points(points: Sequence[Tuple[float, float]], min_miles: float = 1.0) -> List[Tuple[float, float]]:
+    if not points:
+        return []
+    lats, lons = as_arrays(points)
+    return [tuple(points[i]) for i in simplify_indices(lats, lons, min_miles)]
+
+
+def build_route_markers(points: Sequence[Tuple[float, float]]) -> List[Tuple[float, float, float]]:
+    lats, lons = as_arrays(points)
+    miles = cumulative_miles(lats, lons)
+    return list(zip(lats.tolist(), lons.tolist(), miles.tolist()))
+
+
+def nearest_markers(
+    station_lats: Any,
+    station_lons: Any,
+    marker_lats: Any,
+    marker_lons: Any,
+) -> Tuple[Any, Any]:
+    """Distance to, and index of, the nearest marker for each station.
+
+    The station x marker matrix is evaluated in row blocks bounded by ``MATRIX_CHUNK_ELEMENTS``.
+    ``argmin`` returns the first minimum, matching the scalar scan's tie-breaking.
+    """
+    station_count = len(station_lats)
+    min_distance = np.empty(station_count, dtype=np.float64)
+    nearest = np.empty(station_count, dtype=np.intp)
+    rows = max(1, MATRIX_CHUNK_ELEMENTS // max(len(marker_lats), 1))
+    for start in range(0, station_count, rows):
+        stop = min(start + rows, station_count)
+        matrix = haversine_miles_array(
+            station_lats[start:stop, None],
+            station_lons[start:stop, None],
+            marker_lats[None, :],
+            marker_lons[None, :],
+        )
+        nearest[start:stop] = matrix.argmin(axis=1)
+        min_distance[start:stop] = matrix[np.arange(stop - start), nearest[start:stop]]
+    return min_distance, nearest
+
+
+def match_stations_to_markers(
+    index: StationGridIndex,
+    markers: Sequence[Tuple[float, float, float]],
+    max_distance_miles: float,
+    window: int = 32,
+) -> Dict[int, Tuple[float, float]]:
+    """Vectorized counterpart of ``services._match_stations_to_markers``.
+
+    Markers are processed in route-order windows; each window only measures the stations the
+    grid index returns for its buffered bounding box, and a station's best marker is replaced only
+    by a strictly closer one so ties resolve to the earliest marker.
+    """
+    if not markers or not len(index):
+        return {}
+    station_lats = np.asarray(index.latitudes, dtype=np.float64)
+    station_lons = np.asarray(index.longitudes, dtype=np.float64)
+    marker_array = np.asarray(markers, dtype=np.float64).reshape(-1, 3)
+    best_distance = np.full(len(station_lats), np.inf)
+    best_miles = np.zeros(len(station_lats))
+
+    for start in range(0, len(marker_array), window):
+        block = marker_array[start : start + window]
+        min_lat, max_lat = float(block[:, 0].min()), float(block[:, 0].max())
+        min_lon, max_lon = float(block[:, 1].min()), float(block[:, 1].max())
+        lat_buffer, lon_buffer = degree_buffers(max(abs(min_lat), abs(max_lat)), max_distance_miles)
+        candidates = np.fromiter(
+            index.query_box(min_lat - lat_buffer, max_lat + lat_buffer, min_lon - lon_buffer, max_lon + lon_buffer),
+            dtype=np.intp,
+        )
+        if not candidates.size:
+            continue
+        distance, nearest = nearest_markers(
+            station_lats[candidates], station_lons[candidates], block[:, 0], block[:, 1]
+        )
+        improved = distance < best_distance[candidates]
+        best_distance[candidates[improved]] = distance[improved]
+        best_miles[candidates[improved]] = block[nearest[improved], 2]
+
+    matched = np.flatnonzero(best_distance <= max_distance_miles)
+    return {int(p): (float(best_distance[p]), float(best_miles[p])) for p in matched}
+
+
+def match_stations_to_segments(
+    index: StationGridIndex,
+    markers: Sequence[Tuple[float, float, float]],
+    max_distance_miles: float,
+    window: int = 32,
+) -> Dict[int, Tuple[float, float]]:
+    """Vectorized counterpart of ``services._match_stations_to_segments``."""
+    if len(markers) < 2 or not len(index):
+        return {}
+    station_lats = np.asarray(index.latitudes, dtype=np.float64)
+    station_lons = np.asarray(index.longitudes, dtype=np.float64)
+    marker_array = np.asarray(markers, dtype=np.float64).reshape(-1, 3)
+    best_distance = np.full(len(station_lats), np.inf)
+    best_miles = np.zeros(len(station_lats))
+
+    for start in range(0, len(marker_array) - 1, window):
+        a = marker_array[start : start + window]
+        b = marker_array[start + 1 : start + window + 1]
+        a = a[: len(b)]
+        lats = np.concatenate((a[:, 0], b[:, 0]))
+        lons = np.concatenate((a[:, 1], b[:, 1]))
+        min_lat, max_lat = float(lats.min()), float(lats.max())
+        lat_buffer, lon_buffer = degree_buffers(max(abs(min_lat), abs(max_lat)), max_distance_miles)
+        candidates = np.fromiter(
+            index.query_box(
+                min_lat - lat_buffer,
+                max_lat + lat_buffer,
+                float(lons.min()) - lon_buffer,
+                float(lons.max()) + lon_buffer,
+            ),
+            dtype=np.intp,
+        )
+        if not candidates.size:
+            continue
+
+        rows = max(1, MATRIX_CHUNK_ELEMENTS // len(a))
+        for chunk_start in range(0, len(candidates), rows):
+            chunk = candidates[chunk_start : chunk_start + rows]
+            lat = station_lats[chunk, None]
+            lon = station_lons[chunk, None]
+            # Same operation order as ``services.segment_fraction``.
+            scale = np.cos(np.radians(lat))
+            dx = (b[None, :, 1] - a[None, :, 1]) * scale
+            dy = b[None, :, 0] - a[None, :, 0]
+            length_sq = dx * dx + dy * dy
+            dot = (lon - a[None, :, 1]) * scale * dx + (lat - a[None, :, 0]) * dy
+            t = np.divide(dot, length_sq, out=np.zeros_like(dot), where=length_sq != 0)
+            np.clip(t, 0.0, 1.0, out=t)
+            closest_lat = a[None, :, 0] + t * (b[None, :, 0] - a[None, :, 0])
+            closest_lon = a[None, :, 1] + t * (b[None, :, 1] - a[None, :, 1])
+            matrix = haversine_miles_array(lat, lon, closest_lat, closest_lon)
+
+            nearest = matrix.argmin(axis=1)
+            row_index = np.arange(len(chunk))
+            distance = matrix[row_index, nearest]
+            fraction = t[row_index, nearest]
+            miles = a[nearest, 2] + fraction * (b[nearest, 2] - a[nearest, 2])
+            improved = distance < best_distance[chunk]
+            best_distance[chunk[improved]] = distance[improved]
+            best_miles[chunk[improved]] = miles[improved]
+
+    matched = np.flatnonzero(best_distance <= max_distance_miles)
+    return {int(p): (float(best_distance[p]), float(best_miles[p])) for p in matched}
@@ -0,0 +1,146 @@
+import gzip
+import http.client
+import json
+import os
+import queue
+import threading
+import time
+import urllib.parse
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+USER_AGENT = "spotter-route-planner"
+
+PoolKey = Tuple[str, str, int]
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, status: int, url: str):
+        super().__init__(f"HTTP {status} from {urllib.parse.urlsplit(url).netloc}")
+        self.status = status
+
+
+class PooledHTTPClient:
+    """Keep-alive connections pooled per host, shared by web requests, Celery tasks and threads.
+
+    Pools are dropped when the process id changes, so forked workers never share a socket with
+    their parent. Retries cover 429/5xx responses (honouring ``Retry-After``) and keep-alive
+    connections the server closed while idle.
+    """
+
+    def __init__(self) -> None:
+        self._pools: Dict[PoolKey, "queue.LifoQueue[http.client.HTTPConnection]"] = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    @property
+    def pool_size(self) -> int:
+        return getattr(settings, "MAPBOX_HTTP_POOL_SIZE", 10)
+
+    def get_json(self, url: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        return json.loads(self.get(url, timeout=timeout).decode("utf-8"))
+
+    def get(self, url: str, timeout: Optional[float] = None) -> bytes:
+        max_retries = getattr(settings, "MAPBOX_HTTP_MAX_RETRIES", 3)
+        backoff = getattr(settings, "MAPBOX_HTTP_BACKOFF_SECONDS", 0.5)
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+
+        attempt = 0
+        while True:
+            status, headers, body = self._request(parts, path, timeout)
+            if status < 400:
+                return body
+            if status not in RETRY_STATUSES or attempt >= max_retries:
+                raise HTTPStatusError(status, url)
+            time.sleep(self._retry_delay(headers.get("retry-after"), backoff * 2**attempt))
+            attempt += 1
+
+    def close(self) -> None:
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            while not pool.empty():
+                pool.get_nowait().close()
+
+    def _request(
+        self, parts: urllib.parse.SplitResult, path: str, timeout: Optional[float]
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        key = (parts.scheme, parts.hostname or "", parts.port or (443 if parts.scheme == "https" else 80))
+        headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "gzip", "Connection": "keep-alive"}
+        connection, reused = self._acquire(key, timeout)
+        try:
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                if not reused:
+                    raise
+                # The server dropped an idle keep-alive connection; one fresh attempt is safe for a GET.
+                connection.close()
+                connection = self._connect(key, timeout)
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+            body = response.read()
+            response_headers = {name.lower(): value for name, value in response.getheaders()}
+        except BaseException:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(key, connection)
+        if response_headers.get("content-encoding") == "gzip":
+            body = gzip.decompress(body)
+        return response.status, response_headers, body
+
+    def _pool(self, key: PoolKey) -> "queue.LifoQueue[http.client.HTTPConnection]":
+        with self._lock:
+            if self._pid != os.getpid():
+                # Inherited across a fork: the sockets belong to the parent.
+                self._pools = {}
+                self._pid = os.getpid()
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = self._pools[key] = queue.LifoQueue()
+            return pool
+
+    def _acquire(self, key: PoolKey, timeout: Optional[float]) -> Tuple[http.client.HTTPConnection, bool]:
+        try:
+            connection = self._pool(key).get_nowait()
+        except queue.Empty:
+            return self._connect(key, timeout), False
+        connection.sock.settimeout(timeout or getattr(settings, "MAPBOX_HTTP_READ_TIMEOUT", 20.0))
+        return connection, True
+
+    def _release(self, key: PoolKey, connection: http.client.HTTPConnection) -> None:
+        pool = self._pool(key)
+        if pool.qsize() >= self.pool_size:
+            connection.close()
+        else:
+            pool.put_nowait(connection)
+
+    def _connect(self, key: PoolKey, timeout: Optional[float]) -> http.client.HTTPConnection:
+        scheme, host, port = key
+        connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        connection = connection_class(host, port, timeout=getattr(settings, "MAPBOX_HTTP_CONNECT_TIMEOUT", 5.0))
+        connection.connect()
+        connection.sock.settimeout(timeout or getattr(settings, "MAPBOX_HTTP_READ_TIMEOUT", 20.0))
+        return connection
+
+    @staticmethod
+    def _retry_delay(retry_after: Optional[str], default: float) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), getattr(settings, "MAPBOX_HTTP_MAX_RETRY_AFTER", 10.0))
+            except ValueError:
+                pass
+        return default
+
+
+client = PooledHTTPClient()
@@ -0,0 +1,452 @@
+import csv
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import FuelStation, GeocodedAddress
+from .services import GeocodeResult
+from .spatial import station_cell
+
+Geocoder = Callable[[str], GeocodeResult]
+
+UNIQUE_FIELDS = ["opis_id", "truckstop_name", "address", "city", "state", "rack_id"]
+
+StationKey = Tuple[int, str, str, str, str, int]
+
+# Matches FuelStation.retail_price's decimal_places, so unchanged prices compare equal.
+PRICE_QUANTUM = Decimal("0.001")
+
+# Cache key prefix of the geocoding rate limit that every import process shares.
+GEOCODE_RATE_KEY = "fuel_stations:geocode_rate"
+
+_ADDRESS_NOISE = re.compile(r"[^\w\s#&/-]")
+
+
+def normalize_address(address: str, city: str, state: str) -> str:
+    """Case- and punctuation-insensitive key, so "I-40, Exit 7" and "I-40 EXIT 7" share a geocode."""
+    return " ".join(_ADDRESS_NOISE.sub(" ", f"{address} {city} {state}").upper().split())
+
+
+@dataclass
+class StationRow:
+    opis_id: int
+    truckstop_name: str
+    address: str
+    city: str
+    state: str
+    rack_id: int
+    retail_price: Decimal
+    line: int
+
+    @property
+    def key(self) -> StationKey:
+        return (self.opis_id, self.truckstop_name, self.address, self.city, self.state, self.rack_id)
+
+    @property
+    def geocode_query(self) -> str:
+        return f"{self.address}, {self.city}, {self.state}"
+
+    @property
+    def normalized_address(self) -> str:
+        return normalize_address(self.address, self.city, self.state)
+
+
+@dataclass
+class ImportStats:
+    processed: int = 0
+    created: int = 0
+    updated: int = 0
+    geocoded: int = 0
+    failed: int = 0
+    price_changed: int = 0
+    errors: List[str] = field(default_factory=list)
+    row_label: str = "Row"
+
+    COUNTERS = ("processed", "created", "updated", "geocoded", "failed", "price_changed")
+
+    def fail(self, line: int, message: str) -> None:
+        self.failed += 1
+        self.errors.append(f"{self.row_label} {line}: {message}")
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {**{name: getattr(self, name) for name in self.COUNTERS}, "errors": list(self.errors)}
+
+    def merge(self, other: Dict[str, Any]) -> None:
+        for name in self.COUNTERS:
+            setattr(self, name, getattr(self, name) + other.get(name, 0))
+        self.errors.extend(other.get("errors", []))
+
+
+def plan_byte_ranges(file_obj: IO[bytes], size: int, chunk_bytes: int) -> Tuple[bytes, List[Tuple[int, int]]]:
+    """Split a CSV file into line-aligned ``[start, end)`` byte ranges after its header row.
+
+    Assumes quoted fields never contain line breaks, which holds for the OPIS price files.
+    """
+    file_obj.seek(0)
+    header = file_obj.readline()
+    ranges: List[Tuple[int, int]] = []
+    start = len(header)
+    while start < size:
+        boundary = start + max(chunk_bytes, 1)
+        if boundary >= size:
+            end = size
+        else:
+            file_obj.seek(boundary - 1)
+            # Reading from the byte before the boundary keeps a range from starting mid-line.
+            end = boundary - 1 + len(file_obj.readline())
+        ranges.append((start, end))
+        start = end
+    return header, ranges
+
+
+def iter_csv_range(file_obj: IO[bytes], header: bytes, start: int, end: int) -> Iterator[str]:
+    """Yield the header followed by every line in ``[start, end)``, decoded as UTF-8."""
+    yield header.decode("utf-8-sig")
+    file_obj.seek(start)
+    position = start
+    while position < end:
+        line = file_obj.readline()
+        if not line:
+            break
+        position += len(line)
+        yield line.decode("utf-8")
+
+
+def parse_station_row(row: Dict[str, str], line: int) -> StationRow:
+    return StationRow(
+        opis_id=int(row["OPIS Truckstop ID"].strip()),
+        truckstop_name=row["Truckstop Name"].strip(),
+        address=row["Address"].strip(),
+        city=row["City"].strip(),
+        state=row["State"].strip(),
+        rack_id=int(row["Rack ID"].strip()),
+        retail_price=Decimal(row["Retail Price"].strip()),
+        line=line,
+    )
+
+
+def iter_station_batches(
+    lines: Iterable[str],
+    stats: ImportStats,
+    batch_size: Optional[int] = None,
+) -> Iterator[Dict[StationKey, StationRow]]:
+    """Parse CSV rows in one pass and yield batches deduplicated on the ``unique_fuel_station`` key.
+
+    When a key repeats inside a batch the later row wins, matching what sequential upserts did.
+    Rows that fail to parse are recorded on ``stats`` and skipped.
+    """
+    batch_size = batch_size or getattr(settings, "FUEL_STATION_IMPORT_BATCH_SIZE", 500)
+    batch: Dict[StationKey, StationRow] = {}
+    for line, row in enumerate(csv.DictReader(lines), start=1):
+        stats.processed += 1
+        try:
+            station_row = parse_station_row(row, line)
+        except Exception as exc:
+            stats.fail(line, str(exc))
+            continue
+        if station_row.key in batch:
+            stats.updated += 1
+        batch[station_row.key] = station_row
+        if len(batch) >= batch_size:
+            yield batch
+            batch = {}
+    if batch:
+        yield batch
+
+
+class ExistingStation(NamedTuple):
+    id: int
+    latitude: Optional[float]
+    retail_price: Decimal
+
+
+def _existing_keys(keys: Iterable[StationKey]) -> Dict[StationKey, ExistingStation]:
+    keys = set(keys)
+    opis_ids = {key[0] for key in keys}
+    rows = FuelStation.objects.filter(opis_id__in=opis_ids).values_list(
+        "id", "latitude", "retail_price", *UNIQUE_FIELDS
+    )
+    return {tuple(row[3:]): ExistingStation(*row[:3]) for row in rows if tuple(row[3:]) in keys}
+
+
+def _upsert_rows_individually(batch: Dict[StationKey, StationRow], stats: ImportStats) -> None:
+    for station_row in batch.values():
+        try:
+            with transaction.atomic():
+                _, was_created = FuelStation.objects.update_or_create(
+                    **dict(zip(UNIQUE_FIELDS, station_row.key)),
+                    defaults={"retail_price": station_row.retail_price},
+                )
+        except Exception as exc:
+            stats.fail(station_row.line, str(exc))
+        else:
+            if was_created:
+                stats.created += 1
+            else:
+                stats.updated += 1
+
+
+def upsert_station_batch(batch: Dict[StationKey, StationRow], stats: ImportStats) -> None:
+    """Insert new stations and update prices of existing ones with a single bulk statement.
+
+    Rows are written in key order so concurrent chunk workers lock conflicting rows in the same order.
+    """
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            existing = _existing_keys(batch)
+            FuelStation.objects.bulk_create(
+                [
+                    FuelStation(
+                        **dict(zip(UNIQUE_FIELDS, key)),
+                        retail_price=station_row.retail_price,
+                        created_at=now,
+                        updated_at=now,
+                    )
+                    for key, station_row in sorted(batch.items())
+                ],
+                update_conflicts=True,
+                unique_fields=UNIQUE_FIELDS,
+                update_fields=["retail_price", "updated_at"],
+            )
+    except Exception:
+        # One bad row fails the whole statement; retry row by row so only that row is reported.
+        _upsert_rows_individually(batch, stats)
+        return
+
+    stats.created += len(batch) - len(existing)
+    stats.updated += len(existing)
+
+
+def refresh_station_prices(batch: Dict[StationKey, StationRow], stats: ImportStats) -> Dict[StationKey, StationRow]:
+    """Write only the prices that differ from the database and return rows for unknown stations.
+
+    Unknown stations are left for the caller to upsert normally.
+    """
+    existing = _existing_keys(batch)
+    now = timezone.now()
+    changed = [
+        FuelStation(id=station.id, retail_price=batch[key].retail_price, updated_at=now)
+        for key, station in existing.items()
+        if station.retail_price != batch[key].retail_price.quantize(PRICE_QUANTUM)
+    ]
+    if changed:
+        FuelStation.objects.bulk_update(changed, ["retail_price", "updated_at"])
+    stats.updated += len(existing)
+    stats.price_changed += len(changed)
+    return {key: station_row for key, station_row in batch.items() if key not in existing}
+
+
+class TokenBucket:
+    """Thread-safe token bucket; ``acquire`` blocks until a token is available."""
+
+    def __init__(
+        self,
+        rate_per_second: float,
+        capacity: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.rate = rate_per_second
+        self.capacity = capacity if capacity is not None else max(rate_per_second, 1.0)
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+
+class SharedTokenBucket:
+    """Token bucket shared by every process through the cache; ``acquire`` blocks until a token is available.
+
+    Tokens are handed out per window of at least a second and counted with an atomic ``cache.incr``,
+    so import chunks running on any number of workers stay within one rate together.
+    """
+
+    def __init__(
+        self,
+        rate_per_second: float,
+        key: str = GEOCODE_RATE_KEY,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.rate = rate_per_second
+        self.key = key
+        self.window = max(1.0, 1.0 / rate_per_second) if rate_per_second > 0 else 1.0
+        self.allowance = max(1, round(rate_per_second * self.window))
+        # Wall-clock time, so processes on different hosts agree on the window.
+        self._clock = clock
+        self._sleep = sleep
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            now = self._clock()
+            window = int(now // self.window)
+            key = f"{self.key}:{window}"
+            cache.add(key, 0, timeout=int(self.window) + 2)
+            try:
+                taken = cache.incr(key)
+            except ValueError:
+                # Expired between add and incr; start over in the current window.
+                continue
+            if taken <= self.allowance:
+                return
+            self._sleep((window + 1) * self.window - now)
+
+
+class GeocodingStage:
+    """Geocodes stations on a bounded thread pool while the importer keeps upserting.
+
+    Stations are grouped by normalized address: addresses already in ``GeocodedAddress`` are
+    resolved without any external call, and each remaining address is looked up once no matter
+    how many stations share it. Lookups are throttled by a token bucket shared by the lookup
+    threads, or by every process when ``shared_rate`` is set. Results are persisted and written
+    back in bulk on ``flush``; only the importer thread touches the database and ``stats``.
+    """
+
+    def __init__(
+        self,
+        geocode: Geocoder,
+        stats: ImportStats,
+        concurrency: Optional[int] = None,
+        rate_per_second: Optional[float] = None,
+        shared_rate: bool = False,
+    ):
+        concurrency = concurrency or getattr(settings, "FUEL_STATION_GEOCODE_CONCURRENCY", 8)
+        if rate_per_second is None:
+            rate_per_second = getattr(settings, "FUEL_STATION_GEOCODE_RATE_PER_SECOND", 10.0)
+        self.stats = stats
+        self._geocode = geocode
+        self._bucket = (
+            SharedTokenBucket(rate_per_second) if shared_rate else TokenBucket(rate_per_second, capacity=concurrency)
+        )
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="geocode")
+        self._max_pending = concurrency * 4
+        # normalized address -> (lookup, stations waiting for it)
+        self._pending: Dict[str, Tuple[Future, List[Tuple[int, StationRow]]]] = {}
+
+    def __enter__(self) -> "GeocodingStage":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _lookup(self, query: str) -> GeocodeResult:
+        self._bucket.acquire()
+        return self._geocode(query)
+
+    def submit_missing(self, batch: Dict[StationKey, StationRow]) -> None:
+        waiting: Dict[str, List[Tuple[int, StationRow]]] = {}
+        for key, existing in _existing_keys(batch).items():
+            if existing.latitude is None:
+                station_row = batch[key]
+                waiting.setdefault(station_row.normalized_address, []).append((existing.id, station_row))
+        if not waiting:
+            return
+
+        known = {
+            entry.normalized_address: entry
+            for entry in GeocodedAddress.objects.filter(normalized_address__in=list(waiting))
+        }
+        located: List[FuelStation] = []
+        for address, stations in waiting.items():
+            entry = known.get(address)
+            if entry is not None:
+                located.extend(
+                    FuelStation(id=station_id, latitude=entry.latitude, longitude=entry.longitude)
+                    for station_id, _ in stations
+                )
+            elif address in self._pending:
+                self._pending[address][1].extend(stations)
+            else:
+                self._submit(address, stations)
+        self._save_locations(located)
+
+    def _submit(self, address: str, stations: List[Tuple[int, StationRow]]) -> None:
+        if len(self._pending) >= self._max_pending:
+            # Backpressure: block until at least one lookup finishes before queueing more.
+            wait([future for future, _ in self._pending.values()], return_when=FIRST_COMPLETED)
+            self.flush()
+        future = self._executor.submit(self._lookup, stations[0][1].geocode_query)
+        self._pending[address] = (future, stations)
+
+    def flush(self, block: bool = False) -> None:
+        located: List[FuelStation] = []
+        resolved: List[GeocodedAddress] = []
+        for address, (future, stations) in list(self._pending.items()):
+            if not block and not future.done():
+                continue
+            del self._pending[address]
+            try:
+                result = future.result()
+            except Exception as exc:
+                for _, station_row in stations:
+                    self.stats.fail(station_row.line, f"geocoding failed: {exc}")
+                continue
+            resolved.append(
+                GeocodedAddress(
+                    normalized_address=address,
+                    latitude=result.latitude,
+                    longitude=result.longitude,
+                    place_name=result.place_name[:255],
+                )
+            )
+            located.extend(
+                FuelStation(id=station_id, latitude=result.latitude, longitude=result.longitude)
+                for station_id, _ in stations
+            )
+
+        if resolved:
+            GeocodedAddress.objects.bulk_create(resolved, ignore_conflicts=True)
+        self._save_locations(located)
+
+    def _save_locations(self, located: List[FuelStation]) -> None:
+        if located:
+            now = timezone.now()
+            for station in located:
+                station.grid_cell = station_cell(station.latitude, station.longitude)
+                station.updated_at = now
+            FuelStation.objects.bulk_update(located, ["latitude", "longitude", "grid_cell", "updated_at"])
+            self.stats.geocoded += len(located)
+
+    def close(self) -> None:
+        try:
+            self.flush(block=True)
+        finally:
+            self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,98 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTimings:
+    """Milliseconds spent per stage, plus cache hit/miss flags, for one request.
+
+    Stages may nest (a Redis read inside station matching counts towards both).
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.flags: Dict[str, str] = {}
+
+    def add(self, name: str, elapsed_ms: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + elapsed_ms
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    @property
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self) -> str:
+        metrics = [f"{name};dur={elapsed:.1f}" for name, elapsed in self.stages.items()]
+        metrics += [f'{name};desc="{value}"' for name, value in self.flags.items()]
+        metrics.append(f"total;dur={self.total_ms:.1f}")
+        return ", ".join(metrics)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "total_ms": round(self.total_ms, 1),
+            "stages_ms": {name: round(elapsed, 1) for name, elapsed in self.stages.items()},
+            "calls": dict(self.counts),
+            "cache": dict(self.flags),
+        }
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("route_planner_timings", default=None)
+
+
+def enabled() -> bool:
+    return getattr(settings, "ROUTE_TIMING_ENABLED", False)
+
+
+@contextmanager
+def collect() -> Iterator[Optional[RequestTimings]]:
+    """Collect stage timings for the code run inside; yields None when timing is disabled."""
+    if not enabled():
+        yield None
+        return
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    # Without an active collector this costs one context variable lookup.
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, (time.perf_counter() - started) * 1000)
+
+
+def mark(name: str, value: str) -> None:
+    # Repeated marks are kept in order, e.g. "hit,miss" for the two geocodes of a plan.
+    timings = _current.get()
+    if timings is not None:
+        timings.flags[name] = f"{timings.flags[name]},{value}" if name in timings.flags else value
+
+
+def finish(timings: Optional[RequestTimings], response: Any, path: str) -> Any:
+    """Attach the ``Server-Timing`` header and log the breakdown when the request was slow."""
+    if timings is None:
+        return response
+    response["Server-Timing"] = timings.server_timing()
+    if timings.total_ms >= getattr(settings, "ROUTE_SLOW_REQUEST_MS", 1000):
+        record = {"event": "slow_request", "path": path, "status": response.status_code, **timings.as_dict()}
+        logger.warning(json.dumps(record))
+    return response
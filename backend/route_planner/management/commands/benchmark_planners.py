@@ -0,0 +1,81 @@
+import random
+import time
+from typing import Callable, List, Tuple
+
+from django.core.management.base import BaseCommand
+
+from route_planner.services import (
+    RoutePlannerError,
+    StationOnRoute,
+    plan_fuel_stops,
+    plan_fuel_stops_optimal,
+)
+
+
+def synthetic_corridor(rng: random.Random, station_count: int, total_miles: float) -> List[StationOnRoute]:
+    markers = sorted(rng.uniform(0.0, total_miles) for _ in range(station_count))
+    return [
+        StationOnRoute(
+            station_data={"opis_id": index},
+            price=round(rng.uniform(2.9, 4.3), 3),
+            mile_marker=mile,
+            distance_to_route=rng.uniform(0.0, 6.0),
+            latitude=0.0,
+            longitude=0.0,
+        )
+        for index, mile in enumerate(markers)
+    ]
+
+
+def _timed(func: Callable[[], Tuple], repeat: int) -> Tuple[Tuple, float]:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - started) / repeat * 1000
+
+
+class Command(BaseCommand):
+    help = "Compare cost and runtime of the greedy and optimal fuel planners on synthetic routes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stations", type=int, nargs="+", default=[100, 500, 1000])
+        parser.add_argument("--miles", type=float, default=2800.0)
+        parser.add_argument("--mpg", type=float, default=6.5)
+        parser.add_argument("--range", type=float, default=500.0, dest="max_range_miles")
+        parser.add_argument("--stop-penalty", type=float, default=0.0)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        mpg = options["mpg"]
+        self.stdout.write(
+            f"{'stations':>8} {'greedy $':>10} {'+detour $':>10} {'greedy ms':>10} "
+            f"{'optimal $':>10} {'optimal ms':>11} {'saving':>7}"
+        )
+        for station_count in options["stations"]:
+            stations = synthetic_corridor(rng, station_count, options["miles"])
+            start = StationOnRoute(None, stations[0].price, 0.0, 0.0, 0.0, 0.0, virtual=True)
+            args = (stations, options["miles"], mpg, options["max_range_miles"], start)
+            try:
+                (greedy_stops, greedy_cost, _), greedy_ms = _timed(lambda: plan_fuel_stops(*args), options["repeat"])
+                (_, optimal_cost, _), optimal_ms = _timed(
+                    lambda: plan_fuel_stops_optimal(*args, stop_penalty=options["stop_penalty"]), options["repeat"]
+                )
+            except RoutePlannerError as exc:
+                self.stdout.write(f"{station_count:>8} infeasible: {exc}")
+                continue
+
+            # The greedy plan ignores the drive to each station; charge it here so the costs compare.
+            by_id = {station.station_data["opis_id"]: station for station in stations}
+            detour_cost = sum(
+                2 * by_id[stop["station"]["opis_id"]].distance_to_route / mpg * stop["price_per_gallon"]
+                for stop in greedy_stops
+                if not stop["virtual"]
+            )
+            greedy_total = greedy_cost + detour_cost
+            saving = (greedy_total - optimal_cost) / greedy_total * 100 if greedy_total else 0.0
+            self.stdout.write(
+                f"{station_count:>8} {greedy_cost:>10.2f} {greedy_total:>10.2f} {greedy_ms:>10.2f} "
+                f"{optimal_cost:>10.2f} {optimal_ms:>11.2f} {saving:>6.1f}%"
+            )
@@ -0,0 +1,375 @@
+import csv
+import json
+import math
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from route_planner import corridors, geometry, services
+from route_planner.caching import reset_local_caches
+from route_planner.services import (
+    GeocodeResult,
+    RouteResult,
+    build_route_markers,
+    choose_start_price,
+    compute_route_plan,
+    decode_polyline6,
+    find_stations_on_route,
+    haversine_miles,
+    match_stations_to_route,
+    plan_fuel_stops,
+    plan_fuel_stops_optimal,
+    simplify_route_points,
+)
+from route_planner.snapshot import StationSnapshot
+
+# Rough (south, west, north, east) boxes used to scatter the CSV stations, which carry no coordinates.
+STATE_BOUNDS: Dict[str, Tuple[float, float, float, float]] = {
+    "AL": (30.2, -88.5, 35.0, -84.9),
+    "AR": (33.0, -94.6, 36.5, -89.6),
+    "AZ": (31.3, -114.8, 37.0, -109.0),
+    "CA": (32.5, -124.4, 42.0, -114.1),
+    "CO": (37.0, -109.1, 41.0, -102.0),
+    "CT": (41.0, -73.7, 42.1, -71.8),
+    "DE": (38.4, -75.8, 39.8, -75.0),
+    "FL": (24.5, -87.6, 31.0, -80.0),
+    "GA": (30.4, -85.6, 35.0, -80.8),
+    "IA": (40.4, -96.6, 43.5, -90.1),
+    "ID": (42.0, -117.2, 49.0, -111.0),
+    "IL": (37.0, -91.5, 42.5, -87.5),
+    "IN": (37.8, -88.1, 41.8, -84.8),
+    "KS": (37.0, -102.1, 40.0, -94.6),
+    "KY": (36.5, -89.6, 39.1, -82.0),
+    "LA": (29.0, -94.0, 33.0, -89.0),
+    "MA": (41.2, -73.5, 42.9, -69.9),
+    "MD": (37.9, -79.5, 39.7, -75.0),
+    "ME": (43.1, -71.1, 47.5, -66.9),
+    "MI": (41.7, -90.4, 48.3, -82.4),
+    "MN": (43.5, -97.2, 49.4, -89.5),
+    "MO": (36.0, -95.8, 40.6, -89.1),
+    "MS": (30.2, -91.7, 35.0, -88.1),
+    "MT": (44.4, -116.1, 49.0, -104.0),
+    "NC": (33.8, -84.3, 36.6, -75.5),
+    "ND": (45.9, -104.1, 49.0, -96.6),
+    "NE": (40.0, -104.1, 43.0, -95.3),
+    "NH": (42.7, -72.6, 45.3, -70.6),
+    "NJ": (38.9, -75.6, 41.4, -73.9),
+    "NM": (31.3, -109.1, 37.0, -103.0),
+    "NV": (35.0, -120.0, 42.0, -114.0),
+    "NY": (40.5, -79.8, 45.0, -71.9),
+    "OH": (38.4, -84.8, 42.0, -80.5),
+    "OK": (33.6, -103.0, 37.0, -94.4),
+    "OR": (42.0, -124.6, 46.3, -116.5),
+    "PA": (39.7, -80.5, 42.3, -74.7),
+    "RI": (41.1, -71.9, 42.0, -71.1),
+    "SC": (32.0, -83.4, 35.2, -78.5),
+    "SD": (42.5, -104.1, 45.9, -96.4),
+    "TN": (35.0, -90.3, 36.7, -81.6),
+    "TX": (25.8, -106.6, 36.5, -93.5),
+    "UT": (37.0, -114.1, 42.0, -109.0),
+    "VA": (36.5, -83.7, 39.5, -75.2),
+    "VT": (42.7, -73.4, 45.0, -71.5),
+    "WA": (45.5, -124.8, 49.0, -116.9),
+    "WI": (42.5, -92.9, 47.1, -86.8),
+    "WV": (37.2, -82.6, 40.6, -77.7),
+    "WY": (41.0, -111.1, 45.0, -104.1),
+    "AB": (49.0, -120.0, 60.0, -110.0),
+    "BC": (48.3, -139.1, 60.0, -114.0),
+    "MB": (49.0, -102.0, 60.0, -89.0),
+    "NB": (45.0, -69.1, 48.1, -63.8),
+    "NS": (43.4, -66.4, 47.0, -59.7),
+    "ON": (41.7, -95.2, 56.9, -74.3),
+    "QC": (45.0, -79.8, 62.6, -57.1),
+    "SK": (49.0, -110.0, 60.0, -101.4),
+    "YT": (60.0, -141.0, 69.6, -123.8),
+}
+
+CORRIDORS: Dict[str, Tuple[Tuple[float, float], Tuple[float, float]]] = {
+    "metro": ((32.7767, -96.7970), (32.7555, -97.3308)),  # Dallas -> Fort Worth
+    "regional": ((32.7767, -96.7970), (35.1495, -90.0490)),  # Dallas -> Memphis
+    "transcontinental": ((40.7128, -74.0060), (34.0522, -118.2437)),  # New York -> Los Angeles
+}
+
+
+def load_station_rows(csv_path: Path, scale: float, rng: random.Random) -> List[Dict[str, Any]]:
+    """CSV stations scattered within their state, copied (each copy re-scattered) up to ``scale`` times the file.
+
+    Some of them are then moved along each benchmark corridor, which a state-wide scatter rarely hits.
+    """
+    with open(csv_path, newline="", encoding="utf-8") as file_obj:
+        source = [row for row in csv.DictReader(file_obj) if row["State"] in STATE_BOUNDS]
+    rows: List[Dict[str, Any]] = []
+    target = int(len(source) * scale)
+    while len(rows) < target:
+        for row in source[: target - len(rows)]:
+            south, west, north, east = STATE_BOUNDS[row["State"]]
+            rows.append(
+                {
+                    "id": len(rows) + 1,
+                    "opis_id": int(row["OPIS Truckstop ID"]),
+                    "truckstop_name": row["Truckstop Name"],
+                    "address": row["Address"],
+                    "city": row["City"],
+                    "state": row["State"],
+                    "rack_id": int(row["Rack ID"]),
+                    "retail_price": float(row["Retail Price"]),
+                    "latitude": rng.uniform(south, north),
+                    "longitude": rng.uniform(west, east),
+                }
+            )
+    seed_corridor_stations(rows, rng)
+    return rows
+
+
+def seed_corridor_stations(
+    rows: List[Dict[str, Any]], rng: random.Random, spacing_miles: float = 20.0, offset_miles: float = 2.0
+) -> None:
+    """Move about one station per ``spacing_miles`` (at least five) to within ``offset_miles`` of each corridor."""
+    wanted = [
+        (start, end, max(int(haversine_miles(start, end) / spacing_miles), 5)) for start, end in CORRIDORS.values()
+    ]
+    picked = iter(rng.sample(range(len(rows)), min(sum(count for *_, count in wanted), len(rows))))
+    for start, end, count in wanted:
+        for index in [next(picked, None) for _ in range(count)]:
+            if index is None:
+                return
+            t = rng.random()
+            rows[index]["latitude"] = start[0] + (end[0] - start[0]) * t + rng.uniform(-1, 1) * offset_miles / 69.0
+            rows[index]["longitude"] = start[1] + (end[1] - start[1]) * t + rng.uniform(-1, 1) * offset_miles / 69.0
+
+
+def synthetic_route(
+    start: Tuple[float, float], end: Tuple[float, float], rng: random.Random, spacing_miles: float = 0.05
+) -> List[Tuple[float, float]]:
+    """A winding path between two points, sampled about as densely as a full Mapbox overview."""
+    straight = haversine_miles(start, end)
+    count = max(int(straight * 1.15 / spacing_miles), 2)
+    bends = max(1, int(straight / 120))
+    amplitude = min(0.02 * straight / bends, 0.6) / 69.0
+    phase = rng.uniform(0, math.pi)
+    d_lat, d_lon = end[0] - start[0], end[1] - start[1]
+    length = math.hypot(d_lat, d_lon) or 1.0
+    normal = (-d_lon / length, d_lat / length)
+    points = []
+    for index in range(count):
+        t = index / (count - 1)
+        offset = amplitude * math.sin(bends * math.pi * t + phase) * math.sin(math.pi * t)
+        points.append((start[0] + d_lat * t + normal[0] * offset, start[1] + d_lon * t + normal[1] * offset))
+    return points
+
+
+def encode_polyline6(points: List[Tuple[float, float]]) -> str:
+    chunks = []
+    previous = (0, 0)
+    for lat, lon in points:
+        current = (round(lat * 1e6), round(lon * 1e6))
+        for delta in (current[0] - previous[0], current[1] - previous[1]):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+        previous = current
+    return "".join(chunks)
+
+
+def _measure(func: Callable[[], Any], repeat: int, memory: bool) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    result = {"median_ms": round(statistics.median(timings), 3), "min_ms": round(min(timings), 3)}
+    if memory:
+        # Separate run: tracing allocations slows everything down too much to time under it.
+        tracemalloc.start()
+        try:
+            func()
+            result["peak_kib"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the route planning stages on synthetic metro, regional and transcontinental routes against the "
+        "fuel price CSV and scaled copies of it, and compare with a stored baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--csv", default=str(Path(settings.BASE_DIR).parent / "fuel-prices-for-be-assessment.csv"))
+        parser.add_argument("--scales", type=float, nargs="+", default=[1.0, 4.0])
+        parser.add_argument("--routes", nargs="+", choices=sorted(CORRIDORS), default=list(CORRIDORS))
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--mpg", type=float, default=10.0)
+        parser.add_argument("--range", type=float, default=500.0, dest="max_range_miles")
+        parser.add_argument("--max-distance", type=float, default=10.0, dest="max_distance_miles")
+        parser.add_argument("--no-memory", action="store_false", dest="memory", help="Skip peak memory tracing.")
+        parser.add_argument("--baseline", default=str(Path(settings.BASE_DIR) / "benchmarks" / "route_planner.json"))
+        parser.add_argument("--save-baseline", action="store_true", help="Write these results as the new baseline.")
+        parser.add_argument(
+            "--tolerance", type=float, default=0.25, help="Allowed slowdown over the baseline median, as a fraction."
+        )
+        parser.add_argument(
+            "--min-delta-ms", type=float, default=0.5, help="Ignore slowdowns smaller than this, to skip timer noise."
+        )
+
+    def handle(self, *args, **options):
+        csv_path = Path(options["csv"])
+        if not csv_path.exists():
+            raise CommandError(f"Station CSV not found: {csv_path}")
+
+        # Mapbox is replaced by the synthetic routes and caches by a private in-memory one, so only our code
+        # is timed and the shared Redis is left alone.
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            results = self._run(csv_path, options)
+            reset_local_caches()
+
+        self._report(results, options)
+
+    def _run(self, csv_path: Path, options: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+        rng = random.Random(options["seed"])
+        repeat, memory = options["repeat"], options["memory"]
+        mpg, max_range, max_distance = options["mpg"], options["max_range_miles"], options["max_distance_miles"]
+        min_miles = getattr(settings, "ROUTE_SIMPLIFY_MIN_MILES", 1.0)
+        results: Dict[str, Dict[str, float]] = {}
+
+        for scale in options["scales"]:
+            rows = load_station_rows(csv_path, scale, rng)
+            snapshot = StationSnapshot.from_rows(1, rows)
+            snapshot.grid_index()
+            results[f"x{scale:g}/snapshot"] = _measure(
+                lambda: StationSnapshot.from_rows(1, rows).grid_index(), max(1, repeat // 2), memory
+            )
+            grid = snapshot.grid_index(getattr(settings, "STATION_GRID_CELL_DEGREES", 0.25))
+            cell_degrees, corridor_miles = corridors.table_settings()
+            table = corridors.CorridorTable.from_snapshot(snapshot, cell_degrees, corridor_miles)
+            results[f"x{scale:g}/corridor_table"] = _measure(
+                lambda: corridors.CorridorTable.from_snapshot(snapshot, cell_degrees, corridor_miles),
+                max(1, repeat // 2),
+                memory,
+            )
+            self.stdout.write(f"x{scale:g}: {len(rows)} stations, {len(table.cells)} corridor cells")
+
+            for name in options["routes"]:
+                start, end = CORRIDORS[name]
+                points = synthetic_route(start, end, rng)
+                polyline = encode_polyline6(points)
+                miles = sum(haversine_miles(a, b) for a, b in zip(points, points[1:]))
+                simplified = simplify_route_points(points, min_miles)
+                markers = build_route_markers(simplified)
+
+                def route(*_args, _polyline=polyline, _miles=miles):
+                    # A new result each call, so the lazily decoded geometry is not reused between runs.
+                    return RouteResult(_miles, _miles / 55 * 3600, _polyline, "polyline6")
+
+                def geocode(query, _start=start, _end=end):
+                    lat, lon = _start if query == "start" else _end
+                    return GeocodeResult(latitude=lat, longitude=lon, place_name=query, is_us=True)
+
+                def compute():
+                    return _attempt(lambda: compute_route_plan("start", "end", max_range, mpg, max_distance))
+
+                def cold():
+                    cache.clear()
+                    reset_local_caches()
+                    return compute()
+
+                with (
+                    mock.patch.object(services, "get_station_snapshot", lambda: snapshot),
+                    mock.patch.object(services, "geocode_location", geocode),
+                    mock.patch.object(services, "get_route", route),
+                ):
+                    stations = match_stations_to_route(markers, max_distance)
+                    start_price = _attempt(lambda: choose_start_price(stations, max_distance))
+                    plan_args = (stations, miles, mpg, max_range, start_price)
+                    stages: Dict[str, Callable[[], Any]] = {
+                        "decode": lambda: decode_polyline6(polyline),
+                        "simplify": lambda: simplify_route_points(points, min_miles),
+                        "markers": lambda: build_route_markers(simplified),
+                        "match": lambda: match_stations_to_route(markers, max_distance),
+                        # The pure-Python matcher fed by the grid index and by the corridor table.
+                        "match_grid_python": lambda: services._match_stations_to_segments(
+                            grid, markers, max_distance
+                        ),
+                        "match_corridor_table": lambda: services._match_stations_to_segments(
+                            table, markers, max_distance
+                        ),
+                        "find_stations": lambda: find_stations_on_route(points, max_distance),
+                        "plan_greedy": lambda: _attempt(lambda: plan_fuel_stops(*plan_args)),
+                        "plan_optimal": lambda: _attempt(lambda: plan_fuel_stops_optimal(*plan_args)),
+                        "compute_cold": cold,
+                        "compute_cached": compute,
+                    }
+                    if start_price is None:
+                        # No station near the route at all: there is nothing for the planners to do.
+                        del stages["plan_greedy"], stages["plan_optimal"]
+                    feasible = compute() is not None
+                    for stage, func in stages.items():
+                        results[f"x{scale:g}/{name}/{stage}"] = _measure(func, repeat, memory)
+                self.stdout.write(
+                    f"  {name}: {miles:.0f} miles, {len(points)} points, {len(stations)} stations"
+                    + ("" if feasible else " (no feasible fuel plan; planners stop at the first gap)")
+                )
+        return results
+
+    def _report(self, results: Dict[str, Dict[str, float]], options: Dict[str, Any]) -> None:
+        baseline_path = Path(options["baseline"])
+        baseline: Dict[str, Dict[str, float]] = {}
+        if baseline_path.exists() and not options["save_baseline"]:
+            baseline = json.loads(baseline_path.read_text())["results"]
+
+        regressions = []
+        self.stdout.write(
+            f"{'case':<40} {'median ms':>10} {'min ms':>10} {'peak KiB':>10} {'baseline':>10} {'change':>8}"
+        )
+        for case, result in results.items():
+            peak = f"{result['peak_kib']:.1f}" if "peak_kib" in result else "-"
+            line = f"{case:<40} {result['median_ms']:>10.3f} {result['min_ms']:>10.3f} {peak:>10}"
+            previous = baseline.get(case)
+            if previous:
+                change = result["median_ms"] / previous["median_ms"] - 1 if previous["median_ms"] else 0.0
+                line += f" {previous['median_ms']:>10.3f} {change * 100:>+7.1f}%"
+                if (
+                    change > options["tolerance"]
+                    and result["median_ms"] - previous["median_ms"] > options["min_delta_ms"]
+                ):
+                    regressions.append(case)
+                    line += "  REGRESSED"
+            self.stdout.write(line)
+
+        if options["save_baseline"]:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            meta = {
+                "python": platform.python_version(),
+                "numpy": geometry.use_numpy(),
+                "repeat": options["repeat"],
+                "seed": options["seed"],
+            }
+            baseline_path.write_text(json.dumps({"meta": meta, "results": results}, indent=2, sort_keys=True))
+            self.stdout.write(f"Baseline written to {baseline_path}")
+        elif not baseline:
+            self.stdout.write(f"No baseline at {baseline_path}; run with --save-baseline to record one.")
+
+        if regressions:
+            raise CommandError(f"{len(regressions)} case(s) slower than the baseline: {', '.join(regressions)}")
+
+
+def _attempt(func: Callable[[], Any]) -> Any:
+    # Sparse synthetic corridors can leave gaps longer than the range; time the failed plan all the same.
+    try:
+        return func()
+    except services.RoutePlannerError:
+        return None
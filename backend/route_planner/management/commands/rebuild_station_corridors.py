@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from route_planner.corridors import refresh_station_corridors, table_settings
+from route_planner.services import invalidate_station_cache
+
+
+class Command(BaseCommand):
+    help = "Rebuild the precomputed cell -> nearby stations corridor table from every located station."
+
+    def handle(self, *args, **options):
+        cell_degrees, radius_miles = table_settings()
+        started = time.perf_counter()
+        written = refresh_station_corridors()
+        # Workers reload the table when the station layout moves.
+        invalidate_station_cache()
+        self.stdout.write(
+            f"Wrote {written} cells ({cell_degrees:g} degrees, {radius_miles:g} miles) "
+            f"in {time.perf_counter() - started:.1f}s."
+        )
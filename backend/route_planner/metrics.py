@@ -0,0 +1,241 @@
+import atexit
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+from celery.signals import task_postrun
+from django.conf import settings
+from django.core.signals import request_finished
+from django_redis import get_redis_connection
+
+from . import instrumentation
+
+METRICS_KEY = "metrics:route_planner"
+
+_LE = re.compile(r',?le="([^"]*)"')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# name -> (type, help, histogram buckets)
+METRICS: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {
+    "route_planner_route_plan_seconds": ("histogram", "Route plan request latency.", LATENCY_BUCKETS),
+    "route_planner_mapbox_request_seconds": ("histogram", "Mapbox API call latency.", LATENCY_BUCKETS),
+    "route_planner_cache_requests_total": ("counter", "Cache lookups by layer and result.", ()),
+    "route_planner_station_count": ("gauge", "Stations in the latest station snapshot.", ()),
+    "route_planner_station_snapshot_timestamp_seconds": ("gauge", "When station prices were last published.", ()),
+    "route_planner_station_snapshot_age_seconds": ("gauge", "Seconds since station prices were last published.", ()),
+    "route_planner_import_rows_total": ("counter", "Rows handled by fuel station CSV imports, by result.", ()),
+    "route_planner_import_seconds_total": ("counter", "Time spent in fuel station CSV imports.", ()),
+    "route_planner_import_jobs_total": ("counter", "Finished fuel station CSV imports, by status.", ()),
+    "route_planner_import_rows_per_second": ("gauge", "Throughput of the last fuel station CSV import.", ()),
+}
+
+
+def _sample(name: str, labels: Dict[str, str]) -> str:
+    if not labels:
+        return name
+    pairs = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in sorted(labels.items())
+    )
+    return f"{name}{{{pairs}}}"
+
+
+class MetricsBuffer:
+    """Per-process increments, flushed into one Redis hash that every web and Celery process shares.
+
+    Counter and histogram samples are summed with HINCRBYFLOAT, so the hash always holds the
+    cluster-wide totals; gauges are last-write-wins. Flushing at most every ``METRICS_FLUSH_SECONDS``,
+    checked as metrics are recorded and as requests finish, keeps Redis traffic independent of
+    request volume. Tasks flush when they finish, since Celery pool processes exit without atexit.
+    """
+
+    def __init__(self) -> None:
+        self._increments: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._flushed = time.monotonic()
+
+    def increment(self, sample: str, value: float = 1.0) -> None:
+        with self._lock:
+            self._check_fork()
+            self._increments[sample] = self._increments.get(sample, 0.0) + value
+        self._maybe_flush()
+
+    def observe(self, name: str, labels: Dict[str, str], value: float) -> None:
+        buckets = METRICS[name][2]
+        with self._lock:
+            self._check_fork()
+            # Buckets are stored cumulatively, as exposed.
+            for bound in buckets:
+                if value <= bound:
+                    sample = _sample(f"{name}_bucket", {**labels, "le": repr(bound)})
+                    self._increments[sample] = self._increments.get(sample, 0.0) + 1
+            for sample, amount in (
+                (_sample(f"{name}_bucket", {**labels, "le": "+Inf"}), 1.0),
+                (_sample(f"{name}_count", labels), 1.0),
+                (_sample(f"{name}_sum", labels), value),
+            ):
+                self._increments[sample] = self._increments.get(sample, 0.0) + amount
+        self._maybe_flush()
+
+    def set_gauge(self, sample: str, value: float) -> None:
+        with self._lock:
+            self._check_fork()
+            self._gauges[sample] = value
+        self._maybe_flush()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._increments, self._gauges = {}, {}
+
+    def flush(self) -> None:
+        with self._lock:
+            self._check_fork()
+            increments, self._increments = self._increments, {}
+            gauges, self._gauges = self._gauges, {}
+            self._flushed = time.monotonic()
+        if not increments and not gauges:
+            return
+        try:
+            pipeline = _redis().pipeline(transaction=False)
+            for sample, amount in increments.items():
+                pipeline.hincrbyfloat(METRICS_KEY, sample, amount)
+            if gauges:
+                pipeline.hset(METRICS_KEY, mapping=gauges)
+            pipeline.execute()
+        except Exception:
+            # Metrics must never fail the request that recorded them; this interval is lost.
+            pass
+
+    def _maybe_flush(self) -> None:
+        if time.monotonic() - self._flushed >= getattr(settings, "METRICS_FLUSH_SECONDS", 1.0):
+            self.flush()
+
+    def _check_fork(self) -> None:
+        # A forked worker must not flush the increments its parent still holds.
+        if self._pid != os.getpid():
+            self._increments, self._gauges = {}, {}
+            self._pid = os.getpid()
+
+
+def _redis():
+    return get_redis_connection("default")
+
+
+def enabled() -> bool:
+    return getattr(settings, "METRICS_ENABLED", True)
+
+
+_buffer = MetricsBuffer()
+atexit.register(_buffer.flush)
+
+
+def _request_finished(**_kwargs) -> None:
+    _buffer._maybe_flush()
+
+
+def _task_finished(**_kwargs) -> None:
+    _buffer.flush()
+
+
+request_finished.connect(_request_finished, dispatch_uid="route_planner.metrics.request_finished")
+task_postrun.connect(_task_finished, dispatch_uid="route_planner.metrics.task_postrun")
+
+
+def inc(name: str, value: float = 1.0, **labels: str) -> None:
+    if enabled():
+        _buffer.increment(_sample(name, labels), value)
+
+
+def observe(name: str, value: float, **labels: str) -> None:
+    if enabled():
+        _buffer.observe(name, labels, value)
+
+
+def set_gauge(name: str, value: float, **labels: str) -> None:
+    if enabled():
+        _buffer.set_gauge(_sample(name, labels), value)
+
+
+@contextmanager
+def timer(name: str, **labels: str) -> Iterator[None]:
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        observe(name, time.perf_counter() - started, **labels, outcome=outcome)
+
+
+def cache_lookup(layer: str, hit: bool) -> None:
+    """Count a cache lookup and flag it on the current request's timings."""
+    result = "hit" if hit else "miss"
+    inc("route_planner_cache_requests_total", layer=layer, result=result)
+    instrumentation.mark(f"{layer}_cache", result)
+
+
+def flush() -> None:
+    _buffer.flush()
+
+
+def render() -> str:
+    """The shared totals in the Prometheus text exposition format."""
+    flush()
+    stored = {
+        (field.decode() if isinstance(field, bytes) else field): float(value)
+        for field, value in _redis().hgetall(METRICS_KEY).items()
+    }
+    published = stored.get("route_planner_station_snapshot_timestamp_seconds")
+    if published:
+        stored["route_planner_station_snapshot_age_seconds"] = max(time.time() - published, 0.0)
+    for sample in [sample for sample in stored if sample.split("{", 1)[0].endswith("_count")]:
+        name = sample.split("{", 1)[0][: -len("_count")]
+        if name in METRICS and METRICS[name][0] == "histogram":
+            # Buckets are cumulative, so one that never received an observation is simply zero.
+            labels = dict(_LABEL.findall(sample.partition("{")[2]))
+            for bound in METRICS[name][2]:
+                stored.setdefault(_sample(f"{name}_bucket", {**labels, "le": repr(bound)}), 0.0)
+
+    families: Dict[str, List[str]] = {name: [] for name in METRICS}
+    for sample in sorted(stored, key=_sort_key):
+        base = sample.split("{", 1)[0]
+        for suffix in ("_bucket", "_count", "_sum"):
+            if base.endswith(suffix) and base[: -len(suffix)] in METRICS:
+                base = base[: -len(suffix)]
+                break
+        if base in families:
+            families[base].append(f"{sample} {_format(stored[sample])}")
+
+    lines: List[str] = []
+    for name, (kind, description, _) in METRICS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(families[name])
+    return "\n".join(lines) + "\n"
+
+
+def _sort_key(sample: str) -> Tuple[str, str, float]:
+    # Series together, then _bucket/_count/_sum, with buckets in increasing ``le`` order.
+    name, _, labels = sample.partition("{")
+    match = _LE.search(labels)
+    return _LE.sub("", labels), name, float(match.group(1)) if match else 0.0
+
+
+def _format(value: float) -> str:
+    if math.isfinite(value) and value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def reset() -> None:
+    """Drop pending and stored metrics (tests and local debugging)."""
+    _buffer.clear()
+    _redis().delete(METRICS_KEY)
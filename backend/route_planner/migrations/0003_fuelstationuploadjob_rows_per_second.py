@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("route_planner", "0002_fuelstationuploadjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fuelstationuploadjob",
+            name="rows_per_second",
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("route_planner", "0004_geocodedaddress"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fuelstationuploadjob",
+            name="mode",
+            field=models.CharField(
+                choices=[("full", "Full import"), ("price_refresh", "Price refresh")],
+                default="full",
+                max_length=20,
+            ),
+        ),
+        migrations.AddField(
+            model_name="fuelstationuploadjob",
+            name="price_changed_count",
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,40 @@
+import math
+
+from django.db import migrations, models
+
+# Frozen copy of spatial.station_cell() at STATION_CELL_DEGREES = 0.25.
+CELL_DEGREES = 0.25
+CELL_COLUMNS = 1440
+
+
+def backfill_grid_cells(apps, schema_editor):
+    FuelStation = apps.get_model("route_planner", "FuelStation")
+    stations = FuelStation.objects.exclude(latitude__isnull=True).exclude(longitude__isnull=True).only(
+        "id", "latitude", "longitude"
+    )
+    batch = []
+    for station in stations.iterator(chunk_size=2000):
+        row = math.floor((station.latitude + 90) / CELL_DEGREES)
+        column = math.floor((station.longitude + 180) / CELL_DEGREES) % CELL_COLUMNS
+        station.grid_cell = row * CELL_COLUMNS + column
+        batch.append(station)
+        if len(batch) >= 2000:
+            FuelStation.objects.bulk_update(batch, ["grid_cell"])
+            batch = []
+    if batch:
+        FuelStation.objects.bulk_update(batch, ["grid_cell"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("route_planner", "0006_routeplanjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fuelstation",
+            name="grid_cell",
+            field=models.IntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_grid_cells, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("route_planner", "0007_fuelstation_grid_cell"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StationCorridorCell",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("cell_degrees", models.FloatField()),
+                ("radius_miles", models.FloatField()),
+                ("cell", models.BigIntegerField()),
+                ("station_ids", models.BinaryField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("cell_degrees", "radius_miles", "cell"), name="unique_corridor_cell"
+                    )
+                ],
+            },
+        ),
+    ]
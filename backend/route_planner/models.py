@@ -1,5 +1,8 @@
+import uuid
+
 from django.db import models
 
+from .spatial import station_cell
 
 
 class FuelStation(models.Model):
@@ -12,6 +15,8 @@ class FuelStation(models.Model):
     retail_price = models.DecimalField(max_digits=6, decimal_places=3)
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
+    # spatial.station_cell() of the coordinates, for corridor queries; bulk writers must set it themselves.
+    grid_cell = models.IntegerField(null=True, blank=True, db_index=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -34,10 +39,45 @@ class FuelStation(models.Model):
             models.Index(fields=["latitude", "longitude"]),
         ]
 
+    def save(self, *args, **kwargs):
+        located = self.latitude is not None and self.longitude is not None
+        self.grid_cell = station_cell(self.latitude, self.longitude) if located else None
+        super().save(*args, **kwargs)
+
     def __str__(self) -> str:
         return f"{self.truckstop_name} ({self.city}, {self.state})"
 
 
+class GeocodedAddress(models.Model):
+    normalized_address = models.CharField(max_length=512, unique=True)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    place_name = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return self.normalized_address
+
+
+class StationCorridorCell(models.Model):
+    """Ids of the stations within ``radius_miles`` of any point of one grid cell (see corridors.py)."""
+
+    cell_degrees = models.FloatField()
+    radius_miles = models.FloatField()
+    cell = models.BigIntegerField()
+    # array("q") of FuelStation ids, ascending.
+    station_ids = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["cell_degrees", "radius_miles", "cell"], name="unique_corridor_cell"),
+        ]
+
+    def __str__(self) -> str:
+        return f"Corridor cell {self.cell} ({self.cell_degrees} deg, {self.radius_miles} mi)"
+
+
 class FuelStationUploadJob(models.Model):
     STATUS_PENDING = "pending"
     STATUS_RUNNING = "running"
@@ -51,15 +91,26 @@ class FuelStationUploadJob(models.Model):
         (STATUS_FAILED, "Failed"),
     ]
 
+    MODE_FULL = "full"
+    MODE_PRICE_REFRESH = "price_refresh"
+
+    MODE_CHOICES = [
+        (MODE_FULL, "Full import"),
+        (MODE_PRICE_REFRESH, "Price refresh"),
+    ]
+
     file_path = models.CharField(max_length=500)
     original_filename = models.CharField(max_length=255)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES, default=MODE_FULL)
     total_rows = models.IntegerField(default=0)
     processed_rows = models.IntegerField(default=0)
     created_count = models.IntegerField(default=0)
     updated_count = models.IntegerField(default=0)
     geocoded_count = models.IntegerField(default=0)
     failed_count = models.IntegerField(default=0)
+    price_changed_count = models.IntegerField(default=0)
+    rows_per_second = models.FloatField(default=0)
     error_log = models.TextField(blank=True)
     started_at = models.DateTimeField(null=True, blank=True)
     finished_at = models.DateTimeField(null=True, blank=True)
@@ -68,3 +119,35 @@ class FuelStationUploadJob(models.Model):
 
     def __str__(self) -> str:
         return f"Upload {self.id} ({self.status})"
+
+
+class RoutePlanJob(models.Model):
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_COMPLETED = "completed"
+    STATUS_FAILED = "failed"
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_COMPLETED, "Completed"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    # Random ids: the status endpoint is public, so job ids must not be enumerable.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    request = models.JSONField()
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (self.STATUS_COMPLETED, self.STATUS_FAILED)
+
+    def __str__(self) -> str:
+        return f"Route plan {self.id} ({self.status})"
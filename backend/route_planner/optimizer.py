@@ -0,0 +1,300 @@
+import math
+from dataclasses import dataclass
+from typing import Any, List, Optional, Sequence, Tuple
+
+from . import geometry
+from .geometry import np
+
+INFINITY = float("inf")
+_EPSILON = 1e-9
+
+
+@dataclass
+class FuelPlan:
+    # (stop index, gallons pumped including the detour) in route order; index 0 is the start.
+    purchases: List[Tuple[int, float]]
+    fuel_cost: float
+    gallons: float
+
+
+@dataclass
+class _Relaxation:
+    # Source purchase level for each target level in [offset, offset + len(sources)); -1 means skipped.
+    offset: int
+    sources: List[Any]
+
+
+def step_for_budget(
+    capacity_gallons: float,
+    station_count: int,
+    stop_layers: int,
+    step_gallons: float,
+    max_states: int,
+) -> float:
+    """Coarsen the fuel step so stations x tank levels x stop layers stays within ``max_states``."""
+    states = capacity_gallons / step_gallons * max(station_count, 1) * stop_layers
+    if max_states > 0 and states > max_states:
+        return capacity_gallons * max(station_count, 1) * stop_layers / max_states
+    return step_gallons
+
+
+def solve_fuel_plan(
+    miles: Sequence[float],
+    prices: Sequence[float],
+    detour_gallons: Sequence[float],
+    total_miles: float,
+    mpg: float,
+    capacity_gallons: float,
+    step_gallons: float,
+    stop_penalty: float = 0.0,
+    max_stops: Optional[int] = None,
+    min_purchase_gallons: float = 0.0,
+) -> Optional[FuelPlan]:
+    """Cheapest fuel plan over (stop, discretized fuel) states, or None when no plan is feasible.
+
+    Stop 0 is the start (mile 0, no detour, no penalty and not counted against ``max_stops``); the
+    rest are candidate stations in mile order. ``detour_gallons`` is the round trip off the route.
+
+    The state is the cumulative fuel bought net of detours, in ``step_gallons`` levels. The tank on
+    the route at mile ``x`` is then ``level * step - x / mpg``, so rounding never accumulates along
+    the route. A stop needs enough fuel to drive out to the pump, pays for the detour fuel at the
+    pump price, and cannot overfill the tank while parked there.
+    """
+    q = step_gallons
+    layers = max_stops + 1 if max_stops is not None else 1
+    size = int(math.floor((total_miles / mpg + capacity_gallons) / q + _EPSILON)) + 2
+    engine = _NumpyEngine(layers, size) if geometry.use_numpy() else _PythonEngine(layers, size)
+
+    engine.start(int(math.floor(capacity_gallons / q + _EPSILON)), q * prices[0])
+    relaxations: List[List[Optional[_Relaxation]]] = []
+    for index in range(1, len(miles)):
+        need = miles[index] / mpg
+        detour = detour_gallons[index]
+        price = prices[index]
+        engine.unreachable_below(int(math.ceil(need / q - _EPSILON)))
+        low = int(math.ceil((need + detour / 2) / q - _EPSILON))
+        high = int(math.floor((capacity_gallons + need - detour / 2) / q + _EPSILON))
+        min_step = max(1, int(math.ceil((min_purchase_gallons - detour) / q - _EPSILON)))
+        relaxations.append(
+            engine.relax(low, min(high, size - 1), min_step, q * price, detour * price + stop_penalty, max_stops)
+        )
+
+    layer, level, _ = engine.best(int(math.ceil(total_miles / mpg / q - _EPSILON)))
+    if layer is None:
+        return None
+
+    purchases: List[Tuple[int, float]] = []
+    for index in range(len(miles) - 1, 0, -1):
+        relaxation = relaxations[index - 1][layer]
+        if relaxation is None or not relaxation.offset <= level < relaxation.offset + len(relaxation.sources):
+            continue
+        source = int(relaxation.sources[level - relaxation.offset])
+        if source < 0:
+            continue
+        purchases.append((index, (level - source) * q + detour_gallons[index]))
+        level = source
+        if max_stops is not None:
+            layer -= 1
+    if level > 0:
+        purchases.append((0, level * q))
+    purchases.reverse()
+
+    # Levels overshoot the destination by up to one step; leave the surplus in the last pump.
+    surplus = sum(gallons - detour_gallons[index] for index, gallons in purchases) - total_miles / mpg
+    if purchases and surplus > 0:
+        index, gallons = purchases[-1]
+        floor_gallons = max(detour_gallons[index], min_purchase_gallons) if index else 0.0
+        trimmed = max(gallons - surplus, floor_gallons)
+        purchases[-1] = (index, trimmed)
+        if trimmed <= 0:
+            purchases.pop()
+
+    # The levels round every purchase to a step, which can cost up to a step per stop against buying
+    # exact amounts. Re-buy exact gallons over the chosen stops, and over every stop (the greedy
+    # next-cheaper plan), and keep whichever is cheapest and still within the stop constraints.
+    best = purchases
+    best_cost = _plan_cost(purchases, prices, stop_penalty)
+    for indices in ([0] + [index for index, _ in purchases if index], range(len(miles))):
+        candidate = _exact_purchases(indices, miles, prices, detour_gallons, total_miles, mpg, capacity_gallons)
+        if candidate is None:
+            continue
+        en_route = [gallons for index, gallons in candidate if index]
+        if max_stops is not None and len(en_route) > max_stops:
+            continue
+        if any(gallons < min_purchase_gallons - _EPSILON for gallons in en_route):
+            continue
+        cost = _plan_cost(candidate, prices, stop_penalty)
+        if cost < best_cost - _EPSILON:
+            best, best_cost = candidate, cost
+
+    return FuelPlan(
+        purchases=best,
+        fuel_cost=sum(gallons * prices[index] for index, gallons in best),
+        gallons=sum(gallons for _, gallons in best),
+    )
+
+
+def _plan_cost(purchases: List[Tuple[int, float]], prices: Sequence[float], stop_penalty: float) -> float:
+    return sum(gallons * prices[index] + (stop_penalty if index else 0.0) for index, gallons in purchases)
+
+
+def _exact_purchases(
+    indices: Sequence[int],
+    miles: Sequence[float],
+    prices: Sequence[float],
+    detour_gallons: Sequence[float],
+    total_miles: float,
+    mpg: float,
+    capacity_gallons: float,
+) -> Optional[List[Tuple[int, float]]]:
+    """Next-cheaper purchases restricted to ``indices``, in exact gallons; None when they run dry.
+
+    At each stop buy just enough to reach the first cheaper stop in range, or else the destination,
+    or else fill up. A stop that already has that much fuel is skipped, detour and all.
+    """
+    purchases: List[Tuple[int, float]] = []
+    fuel = 0.0  # in the tank on the route, before any detour
+    for position, index in enumerate(indices):
+        detour = detour_gallons[index]
+        room = capacity_gallons - detour / 2
+        target = None
+        for later in indices[position + 1 :]:
+            drive = (miles[later] - miles[index]) / mpg
+            if drive > room + _EPSILON:
+                break
+            if prices[later] < prices[index] and drive + detour_gallons[later] / 2 <= room + _EPSILON:
+                target = drive + detour_gallons[later] / 2
+                break
+        if target is None:
+            target = min((total_miles - miles[index]) / mpg, room)
+        if target > fuel + _EPSILON:
+            if fuel < detour / 2 - _EPSILON:
+                return None
+            purchases.append((index, target - fuel + detour))
+            fuel = target
+        following = miles[indices[position + 1]] if position + 1 < len(indices) else total_miles
+        fuel -= (min(following, total_miles) - miles[index]) / mpg
+        if fuel < -_EPSILON:
+            return None
+    return purchases
+
+
+class _PythonEngine:
+    def __init__(self, layers: int, size: int):
+        self.costs = [[INFINITY] * size for _ in range(layers)]
+        self._cleared = 0
+
+    def start(self, high: int, level_price: float) -> None:
+        row = self.costs[0]
+        for level in range(min(high, len(row) - 1) + 1):
+            row[level] = level * level_price
+
+    def unreachable_below(self, level: int) -> None:
+        # Stations come in mile order, so only levels above the previous cut need clearing.
+        level = min(level, len(self.costs[0]))
+        if level > self._cleared:
+            for row in self.costs:
+                row[self._cleared : level] = [INFINITY] * (level - self._cleared)
+            self._cleared = level
+
+    def relax(
+        self,
+        low: int,
+        high: int,
+        min_step: int,
+        level_price: float,
+        fixed_cost: float,
+        max_stops: Optional[int],
+    ) -> List[Optional[_Relaxation]]:
+        layers = len(self.costs)
+        result: List[Optional[_Relaxation]] = [None] * layers
+        if high - min_step < low:
+            return result
+        # Targets in the top layer read the layer below, so work downwards on a snapshot of the sources.
+        sources_by_layer = [row[low : high - min_step + 1] for row in self.costs]
+        for layer in range(layers):
+            source_layer = layer - 1 if max_stops is not None else layer
+            if source_layer < 0:
+                continue
+            sources = sources_by_layer[source_layer]
+            row = self.costs[layer]
+            choices = [-1] * (high - low - min_step + 1)
+            best = INFINITY
+            best_level = -1
+            for offset, target in enumerate(range(low + min_step, high + 1)):
+                source = low + offset
+                value = sources[offset] - source * level_price
+                if value <= best:
+                    best, best_level = value, source
+                candidate = target * level_price + fixed_cost + best
+                if candidate < row[target]:
+                    row[target] = candidate
+                    choices[offset] = best_level
+            result[layer] = _Relaxation(low + min_step, choices)
+        return result
+
+    def best(self, low: int) -> Tuple[Optional[int], int, float]:
+        best: Tuple[Optional[int], int, float] = (None, 0, INFINITY)
+        for layer, row in enumerate(self.costs):
+            for level in range(max(low, 0), len(row)):
+                if row[level] < best[2]:
+                    best = (layer, level, row[level])
+        return best
+
+
+class _NumpyEngine:
+    def __init__(self, layers: int, size: int):
+        self.costs = np.full((layers, size), INFINITY)
+        self._levels = np.arange(size)
+
+    def start(self, high: int, level_price: float) -> None:
+        levels = min(high, self.costs.shape[1] - 1) + 1
+        self.costs[0, :levels] = np.arange(levels) * level_price
+
+    def unreachable_below(self, level: int) -> None:
+        self.costs[:, : max(level, 0)] = INFINITY
+
+    def relax(
+        self,
+        low: int,
+        high: int,
+        min_step: int,
+        level_price: float,
+        fixed_cost: float,
+        max_stops: Optional[int],
+    ) -> List[Optional[_Relaxation]]:
+        layers = self.costs.shape[0]
+        result: List[Optional[_Relaxation]] = [None] * layers
+        width = high - low - min_step + 1
+        if width <= 0:
+            return result
+        if max_stops is not None:
+            if layers == 1:
+                return result
+            source_rows, target_rows = slice(0, layers - 1), slice(1, layers)
+        else:
+            source_rows = target_rows = slice(0, 1)
+
+        source_levels = self._levels[low : low + width]
+        level_costs = source_levels * level_price
+        values = self.costs[source_rows, low : low + width] - level_costs
+        best = np.minimum.accumulate(values, axis=1)
+        # Last source level reaching the running minimum, matching the scalar engine's tie-break.
+        best_levels = np.maximum.accumulate(np.where(values == best, source_levels, -1), axis=1)
+        best += level_costs + (min_step * level_price + fixed_cost)
+        targets = self.costs[target_rows, low + min_step : high + 1]
+        improved = best < targets
+        np.copyto(targets, best, where=improved)
+        choices = np.where(improved, best_levels, -1)
+
+        first = target_rows.start
+        for row, layer in enumerate(range(first, first + choices.shape[0])):
+            result[layer] = _Relaxation(low + min_step, choices[row])
+        return result
+
+    def best(self, low: int) -> Tuple[Optional[int], int, float]:
+        tail = self.costs[:, max(low, 0) :]
+        if tail.size == 0 or not np.isfinite(tail).any():
+            return None, 0, INFINITY
+        layer, level = np.unravel_index(int(np.argmin(tail)), tail.shape)
+        return int(layer), int(level) + max(low, 0), float(tail[layer, level])
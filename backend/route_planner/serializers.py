@@ -1,5 +1,8 @@
+from django.conf import settings
 from rest_framework import serializers
 
+from .services import PLANNER_GREEDY, PLANNER_OPTIMAL
+
 
 class RoutePlanRequestSerializer(serializers.Serializer):
     start_location = serializers.CharField()
@@ -7,3 +10,18 @@ class RoutePlanRequestSerializer(serializers.Serializer):
     max_range_miles = serializers.IntegerField(min_value=1, default=500)
     mpg = serializers.FloatField(min_value=0.1, default=10.0)
     max_station_distance_miles = serializers.FloatField(min_value=0.1, default=10.0)
+    planner = serializers.ChoiceField(choices=[PLANNER_GREEDY, PLANNER_OPTIMAL], default=PLANNER_GREEDY)
+    # Only used by the optimal planner.
+    stop_penalty = serializers.FloatField(min_value=0.0, default=0.0)
+    max_stops = serializers.IntegerField(min_value=0, required=False, allow_null=True)
+    min_purchase_gallons = serializers.FloatField(min_value=0.0, default=0.0)
+
+
+class RoutePlanBatchRequestSerializer(serializers.Serializer):
+    lanes = RoutePlanRequestSerializer(many=True, allow_empty=False)
+
+    def validate_lanes(self, lanes):
+        max_lanes = getattr(settings, "ROUTE_PLAN_BATCH_MAX_LANES", 500)
+        if len(lanes) > max_lanes:
+            raise serializers.ValidationError(f"At most {max_lanes} lanes per batch.")
+        return lanes
@@ -1,15 +1,59 @@
+import asyncio
 import hashlib
 import json
+import logging
 import math
+import struct
+import time
 import urllib.parse
-import urllib.request
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+from functools import cached_property
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.core.cache import cache
 
+from . import corridors, geometry, http_client, instrumentation, metrics, optimizer
+from .caching import (
+    aget_or_compute,
+    bump_station_generation,
+    get_or_compute,
+    is_cached,
+    single_flight,
+    station_generation,
+    tiered_cache,
+)
 from .models import FuelStation
+from .snapshot import DETAIL_FIELDS, StationSnapshot, pack_columns, unpack_columns
+from .spatial import StationGridIndex, corridor_cells, haversine_miles
+
+logger = logging.getLogger(__name__)
+
+MATCH_MODE_PROJECTION = "projection"
+MATCH_MODE_VERTEX = "vertex"
+
+STATION_SOURCE_SNAPSHOT = "snapshot"
+STATION_SOURCE_CORRIDOR = "corridor"
+
+PLANNER_GREEDY = "greedy"
+PLANNER_OPTIMAL = "optimal"
+
+STATION_SNAPSHOT_KEY_PREFIX = "fuel_stations:snapshot"
+STATION_DETAILS_KEY_PREFIX = "fuel_stations:details"
+STATION_PRICE_PATCH_KEY_PREFIX = "fuel_stations:price_patch"
+STATION_CACHE_TIMEOUT = 60 * 60 * 24
+ROUTE_PLAN_CACHE_TIMEOUT = 60 * 60
+ROUTE_CACHE_KEY_PREFIX = "directions"
+ROUTE_MATCH_KEY_PREFIX = "route_stations"
+
+# magic, marker count, distance miles, duration seconds
+_ROUTE_HEADER = struct.Struct("<4sIdd")
+_ROUTE_MAGIC = b"RTE1"
+
+_station_snapshot: Optional[StationSnapshot] = None
 
 
 @dataclass
@@ -26,7 +70,38 @@ class RouteResult:
     duration_seconds: float
     geometry: Any
     geometry_format: str
-    coordinates: List[Tuple[float, float]]
+
+    @cached_property
+    def coordinates(self) -> List[Tuple[float, float]]:
+        # Decoded on first use, so callers that only need the geometry string never pay for it.
+        return decode_polyline6(self.geometry)
+
+    @cached_property
+    def geometry_hash(self) -> str:
+        return hashlib.blake2b(self.geometry.encode("utf-8"), digest_size=16).hexdigest()
+
+    @cached_property
+    def markers(self) -> List[Tuple[float, float, float]]:
+        # Simplified route points with cumulative miles; what station matching actually consumes.
+        simplified = simplify_route_points(self.coordinates, getattr(settings, "ROUTE_SIMPLIFY_MIN_MILES", 1.0))
+        return build_route_markers(simplified)
+
+    def to_bytes(self) -> bytes:
+        columns = [array("d", (marker[axis] for marker in self.markers)) for axis in range(3)]
+        header = _ROUTE_HEADER.pack(_ROUTE_MAGIC, len(self.markers), self.distance_miles, self.duration_seconds)
+        return header + pack_columns(columns) + self.geometry.encode("utf-8")
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> "RouteResult":
+        if len(blob) < _ROUTE_HEADER.size:
+            raise ValueError("Not a cached route.")
+        magic, count, distance_miles, duration_seconds = _ROUTE_HEADER.unpack_from(blob)
+        if magic != _ROUTE_MAGIC:
+            raise ValueError("Not a cached route.")
+        columns, view = unpack_columns(memoryview(blob)[_ROUTE_HEADER.size :], "ddd", count)
+        route = cls(distance_miles, duration_seconds, bytes(view).decode("utf-8"), "polyline6")
+        route.markers = list(zip(*columns))
+        return route
 
 
 @dataclass
@@ -44,17 +119,14 @@ class RoutePlannerError(Exception):
     pass
 
 
-def _fetch_json(url: str, timeout: int = 20) -> Dict[str, Any]:
+def _fetch_json(url: str, timeout: Optional[float] = None) -> Dict[str, Any]:
     # nosec: URL is constructed from static settings (MAPBOX_*) and validated below
     # Validate URL scheme to prevent file:// or other unsafe schemes
     parsed = urllib.parse.urlparse(url)
     if parsed.scheme not in ("http", "https"):
         raise RoutePlannerError("Invalid URL scheme. Only http/https are allowed.")
 
-    request = urllib.request.Request(url, headers={"User-Agent": "spotter-route-planner"})
-    with urllib.request.urlopen(request, timeout=timeout) as response:
-        payload = response.read().decode("utf-8")
-    return json.loads(payload)
+    return http_client.client.get_json(url, timeout=timeout)
 
 
 def _is_us_context(feature: Dict[str, Any]) -> bool:
@@ -67,7 +139,8 @@ def _is_us_context(feature: Dict[str, Any]) -> bool:
 
 def geocode_location(query: str) -> GeocodeResult:
     cache_key = f"geocode:{query.strip().lower()}"
-    cached = cache.get(cache_key)
+    cached = tiered_cache.get(cache_key)
+    metrics.cache_lookup("geocode", bool(cached))
     if cached:
         return GeocodeResult(**cached)
 
@@ -77,7 +150,8 @@ def geocode_location(query: str) -> GeocodeResult:
         f"{base_url}/{encoded_query}.json?access_token={settings.MAPBOX_ACCESS_TOKEN}"
         "&limit=1&country=us&autocomplete=false"
     )
-    data = _fetch_json(url)
+    with instrumentation.stage("geocode"), metrics.timer("route_planner_mapbox_request_seconds", endpoint="geocode"):
+        data = _fetch_json(url)
     features = data.get("features", [])
     if not features:
         raise RoutePlannerError("No geocoding result found.")
@@ -93,17 +167,44 @@ def geocode_location(query: str) -> GeocodeResult:
         place_name=feature.get("place_name", query),
         is_us=_is_us_context(feature),
     )
-    cache.set(cache_key, result.__dict__, timeout=60 * 60 * 24 * 7)
+    tiered_cache.set(cache_key, result.__dict__, timeout=60 * 60 * 24 * 7)
     return result
 
 
+def _route_cache_key(start: Tuple[float, float], end: Tuple[float, float]) -> str:
+    precision = getattr(settings, "ROUTE_CACHE_COORD_PRECISION", 3)
+    coords = ";".join(f"{lat:.{precision}f},{lon:.{precision}f}" for lat, lon in (start, end))
+    simplify = getattr(settings, "ROUTE_SIMPLIFY_MIN_MILES", 1.0)
+    return f"{ROUTE_CACHE_KEY_PREFIX}:{simplify}:{coords}"
+
+
 def get_route(start: Tuple[float, float], end: Tuple[float, float]) -> RouteResult:
+    # Endpoints a few hundred feet apart share a route, whatever text they were geocoded from.
+    cache_key = _route_cache_key(start, end)
+    blob = tiered_cache.get(cache_key)
+    metrics.cache_lookup("directions", blob is not None)
+    if blob is not None:
+        try:
+            return RouteResult.from_bytes(blob)
+        except ValueError:
+            pass
+
+    route = _fetch_route(start, end)
+    tiered_cache.set(cache_key, route.to_bytes(), timeout=getattr(settings, "ROUTE_CACHE_TIMEOUT", 60 * 60 * 24))
+    return route
+
+
+def _fetch_route(start: Tuple[float, float], end: Tuple[float, float]) -> RouteResult:
     base_url = getattr(settings, "MAPBOX_DIRECTIONS_URL", "https://api.mapbox.com/directions/v5/mapbox/driving")
     url = (
         f"{base_url}/{start[1]},{start[0]};{end[1]},{end[0]}"
         f"?geometries=polyline6&overview=full&access_token={settings.MAPBOX_ACCESS_TOKEN}"
     )
-    data = _fetch_json(url)
+    with (
+        instrumentation.stage("directions"),
+        metrics.timer("route_planner_mapbox_request_seconds", endpoint="directions"),
+    ):
+        data = _fetch_json(url)
     routes = data.get("routes", [])
     if not routes:
         raise RoutePlannerError("No route found.")
@@ -113,7 +214,6 @@ def get_route(start: Tuple[float, float], end: Tuple[float, float]) -> RouteResu
     if not geometry:
         raise RoutePlannerError("Route geometry missing.")
 
-    coordinates = decode_polyline6(geometry)
     distance_miles = route.get("distance", 0.0) / 1609.344
     duration_seconds = float(route.get("duration", 0.0))
 
@@ -122,59 +222,52 @@ def get_route(start: Tuple[float, float], end: Tuple[float, float]) -> RouteResu
         duration_seconds=duration_seconds,
         geometry=geometry,
         geometry_format="polyline6",
-        coordinates=coordinates,
     )
 
 
 def decode_polyline6(polyline: str) -> List[Tuple[float, float]]:
-    index = 0
+    if geometry.use_numpy():
+        lats, lons = geometry.decode_polyline(polyline)
+        return list(zip(lats.tolist(), lons.tolist()))
+    lats, lons = decode_polyline6_arrays(polyline)
+    return list(zip(lats, lons))
+
+
+def decode_polyline6_arrays(polyline: str) -> Tuple[array, array]:
+    # One pass over the encoded bytes; values alternate latitude/longitude deltas.
+    lats = array("d")
+    lons = array("d")
     lat = 0
     lng = 0
-    coordinates: List[Tuple[float, float]] = []
-    while index < len(polyline):
-        shift = 0
-        result = 0
-        while True:
-            b = ord(polyline[index]) - 63
-            index += 1
-            result |= (b & 0x1F) << shift
+    result = 0
+    shift = 0
+    is_lat = True
+    for b in polyline.encode("ascii"):
+        b -= 63
+        result |= (b & 0x1F) << shift
+        if b >= 0x20:
             shift += 5
-            if b < 0x20:
-                break
-        delta_lat = ~(result >> 1) if (result & 1) else (result >> 1)
-        lat += delta_lat
-
-        shift = 0
+            continue
+        delta = ~(result >> 1) if (result & 1) else (result >> 1)
+        if is_lat:
+            lat += delta
+            lats.append(lat / 1e6)
+        else:
+            lng += delta
+            lons.append(lng / 1e6)
+        is_lat = not is_lat
         result = 0
-        while True:
-            b = ord(polyline[index]) - 63
-            index += 1
-            result |= (b & 0x1F) << shift
-            shift += 5
-            if b < 0x20:
-                break
-        delta_lng = ~(result >> 1) if (result & 1) else (result >> 1)
-        lng += delta_lng
-
-        coordinates.append((lat / 1e6, lng / 1e6))
-    return coordinates
-
-
-def haversine_miles(a: Tuple[float, float], b: Tuple[float, float]) -> float:
-    lat1, lon1 = a
-    lat2, lon2 = b
-    rad = math.radians
-    dlat = rad(lat2 - lat1)
-    dlon = rad(lon2 - lon1)
-    lat1 = rad(lat1)
-    lat2 = rad(lat2)
-    h = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
-    return 2 * 3958.7613 * math.asin(math.sqrt(h))
+        shift = 0
+    if shift or len(lats) != len(lons):
+        raise ValueError("Malformed polyline.")
+    return lats, lons
 
 
 def simplify_route_points(points: List[Tuple[float, float]], min_miles: float = 1.0) -> List[Tuple[float, float]]:
     if not points:
         return []
+    if geometry.use_numpy():
+        return geometry.simplify_route_points(points, min_miles)
     simplified = [points[0]]
     last = points[0]
     for point in points[1:]:
@@ -187,6 +280,8 @@ def simplify_route_points(points: List[Tuple[float, float]], min_miles: float =
 
 
 def build_route_markers(points: List[Tuple[float, float]]) -> List[Tuple[float, float, float]]:
+    if geometry.use_numpy():
+        return geometry.build_route_markers(points)
     markers = []
     total = 0.0
     prev = points[0]
@@ -198,92 +293,317 @@ def build_route_markers(points: List[Tuple[float, float]]) -> List[Tuple[float,
     return markers
 
 
-def _bounding_box(points: List[Tuple[float, float]], buffer_miles: float) -> Tuple[float, float, float, float]:
-    lats = [p[0] for p in points]
-    lons = [p[1] for p in points]
-    min_lat, max_lat = min(lats), max(lats)
-    min_lon, max_lon = min(lons), max(lons)
-    lat_buffer = buffer_miles / 69.0
-    mid_lat = (min_lat + max_lat) / 2
-    lon_buffer = buffer_miles / (69.0 * max(math.cos(math.radians(mid_lat)), 0.01))
-    return (
-        min_lat - lat_buffer,
-        max_lat + lat_buffer,
-        min_lon - lon_buffer,
-        max_lon + lon_buffer,
-    )
+def _snapshot_key(version: int) -> str:
+    return f"{STATION_SNAPSHOT_KEY_PREFIX}:{version}"
 
 
-def get_cached_stations() -> List[Dict[str, Any]]:
-    cache_key = "fuel_stations:all"
-    cached = cache.get(cache_key)
-    if cached:
-        return cached
+def _details_key(version: int) -> str:
+    return f"{STATION_DETAILS_KEY_PREFIX}:{version}"
+
+
+def _price_patch_key(version: int) -> str:
+    return f"{STATION_PRICE_PATCH_KEY_PREFIX}:{version}"
+
+
+def _load_station_details(snapshot: StationSnapshot) -> List[Tuple[Any, ...]]:
+    details = cache.get(_details_key(snapshot.details_version))
+    if details is not None and len(details) == len(snapshot):
+        return details
 
-    stations = list(
+    rows = FuelStation.objects.exclude(latitude__isnull=True).values_list("id", *DETAIL_FIELDS)
+    by_id = {row[0]: row[1:] for row in rows.iterator(chunk_size=2000)}
+    empty = (None,) * len(DETAIL_FIELDS)
+    return [by_id.get(station_id, empty) for station_id in snapshot.ids]
+
+
+def build_station_snapshot(version: int) -> StationSnapshot:
+    rows = (
         FuelStation.objects.exclude(latitude__isnull=True)
         .exclude(longitude__isnull=True)
-        .values(
-            "id",
-            "opis_id",
-            "truckstop_name",
-            "address",
-            "city",
-            "state",
-            "rack_id",
-            "retail_price",
-            "latitude",
-            "longitude",
-        )
+        .order_by("id")
+        .values("id", *DETAIL_FIELDS, "retail_price", "latitude", "longitude")
     )
+    snapshot = StationSnapshot.from_rows(version, rows.iterator(chunk_size=2000))
+    cache.set(_snapshot_key(version), snapshot.to_bytes(), timeout=STATION_CACHE_TIMEOUT)
+    cache.set(_details_key(version), list(snapshot.details()), timeout=STATION_CACHE_TIMEOUT)
+    metrics.set_gauge("route_planner_station_count", len(snapshot.ids))
+    metrics.set_gauge("route_planner_station_snapshot_timestamp_seconds", time.time())
+    return snapshot
+
+
+def get_station_snapshot() -> StationSnapshot:
+    # Each process keeps its own copy and only goes back to Redis when the generation moves.
+    global _station_snapshot
+    version = station_generation()
+    if _station_snapshot is not None and _station_snapshot.version == version:
+        return _station_snapshot
+
+    current = _station_snapshot
+    if current is not None:
+        # A price-only refresh publishes the changed prices; apply them to our copy in place of a reload.
+        patch = cache.get(_price_patch_key(version))
+        if patch is not None and patch["base"] == current.version:
+            _station_snapshot = current.with_prices(version, patch["prices"])
+            metrics.cache_lookup("station_snapshot", True)
+            return _station_snapshot
+
+    with instrumentation.stage("snapshot"):
+        snapshot = _load_station_snapshot(version)
+        # A miss means this worker, or one it waits for, rebuilds the snapshot from the database.
+        metrics.cache_lookup("station_snapshot", snapshot is not None)
+        if snapshot is None:
+            key = _snapshot_key(version)
+            if current is not None and single_flight.locked(key):
+                # Another worker is rebuilding; keep answering from the previous stations until it publishes.
+                return current
+            snapshot = single_flight.run(
+                key, lambda: _load_station_snapshot(version), lambda: build_station_snapshot(version)
+            )
+    _station_snapshot = snapshot
+    return snapshot
+
 
-    for station in stations:
-        station["retail_price"] = float(station["retail_price"])
+def _load_station_snapshot(version: int) -> Optional[StationSnapshot]:
+    blob = cache.get(_snapshot_key(version))
+    try:
+        return StationSnapshot.from_bytes(version, blob, details_loader=_load_station_details) if blob else None
+    except ValueError:
+        return None
 
-    cache.set(cache_key, stations, timeout=60 * 60 * 24)
-    return stations
+
+def _station_source() -> str:
+    source = getattr(settings, "ROUTE_STATION_SOURCE", STATION_SOURCE_SNAPSHOT)
+    if source not in (STATION_SOURCE_SNAPSHOT, STATION_SOURCE_CORRIDOR):
+        raise RoutePlannerError(f"Unknown station source: {source}.")
+    return source
+
+
+def corridor_snapshot(markers: List[Tuple[float, float, float]], max_distance_miles: float) -> StationSnapshot:
+    """Only the stations in the grid cells within ``max_distance_miles`` of the route, read from the database.
+
+    Matching against it gives the same stations as the full snapshot, since every station in range
+    lies in one of those cells; the cost scales with the corridor instead of the whole network.
+    """
+    cells = corridor_cells(markers, max_distance_miles)
+    with instrumentation.stage("corridor"):
+        rows = list(
+            corridors.located_stations(cells, "id", *DETAIL_FIELDS, "retail_price", "latitude", "longitude")
+        )
+    # Same order as the full snapshot, so ties on the route resolve identically.
+    rows.sort(key=lambda row: row["id"])
+    return StationSnapshot.from_rows(station_generation(), rows)
+
+
+def patch_station_prices(prices: Dict[int, float]) -> None:
+    """Publish new prices for existing stations without rebuilding the station snapshot.
+
+    The generation still moves, so cached route plans are retired, but workers holding the previous
+    snapshot patch their copy instead of reloading it, and the grid index is reused. Patches run one
+    at a time across workers, each on the snapshot of the latest generation; when that snapshot is
+    not published, the cache is invalidated instead so the next rebuild reads every change.
+    """
+    single_flight.run(STATION_PRICE_PATCH_KEY_PREFIX, lambda: None, lambda: _publish_price_patch(prices))
+
+
+def _publish_price_patch(prices: Dict[int, float]) -> None:
+    current = station_generation(fresh=True)
+    base = _station_snapshot
+    if base is None or base.version != current:
+        base = _load_station_snapshot(current)
+    if base is None:
+        invalidate_station_cache()
+        return
+    version = bump_station_generation()
+    if version != current + 1:
+        # Another change landed in between; workers rebuild at the new generation rather than miss it.
+        return
+    patched = base.with_prices(version, prices)
+    cache.set(_price_patch_key(version), {"base": base.version, "prices": prices}, timeout=STATION_CACHE_TIMEOUT)
+    cache.set(_snapshot_key(version), patched.to_bytes(), timeout=STATION_CACHE_TIMEOUT)
+    # Keep the shared details alive as long as the snapshots that point at them.
+    cache.touch(_details_key(patched.details_version), timeout=STATION_CACHE_TIMEOUT)
+    metrics.set_gauge("route_planner_station_snapshot_timestamp_seconds", time.time())
+
+
+def _match_stations_to_markers(
+    index: StationGridIndex,
+    markers: List[Tuple[float, float, float]],
+    max_distance_miles: float,
+) -> Dict[int, Tuple[float, float]]:
+    # Only stations in grid cells around each marker are measured. Markers are visited in route
+    # order with a strict comparison so ties keep the earliest marker, exactly like a full scan.
+    nearest: Dict[int, Tuple[float, float]] = {}
+    for p_lat, p_lon, miles in markers:
+        for position in index.query_radius(p_lat, p_lon, max_distance_miles):
+            distance = haversine_miles((index.latitudes[position], index.longitudes[position]), (p_lat, p_lon))
+            current = nearest.get(position)
+            if current is None or distance < current[0]:
+                nearest[position] = (distance, miles)
+    return nearest
+
+
+def segment_fraction(
+    point: Tuple[float, float],
+    start: Tuple[float, float],
+    end: Tuple[float, float],
+) -> float:
+    # Planar projection with longitude scaled by cos(latitude); accurate at station-to-route distances.
+    scale = math.cos(math.radians(point[0]))
+    dx = (end[1] - start[1]) * scale
+    dy = end[0] - start[0]
+    length_sq = dx * dx + dy * dy
+    if length_sq == 0:
+        return 0.0
+    t = ((point[1] - start[1]) * scale * dx + (point[0] - start[0]) * dy) / length_sq
+    return min(max(t, 0.0), 1.0)
+
+
+def _match_stations_to_segments(
+    index: StationGridIndex,
+    markers: List[Tuple[float, float, float]],
+    max_distance_miles: float,
+) -> Dict[int, Tuple[float, float]]:
+    # Each station is measured against the closest point of every segment whose buffered bounding
+    # box contains it, and its mile marker is interpolated along that segment.
+    nearest: Dict[int, Tuple[float, float]] = {}
+    for (a_lat, a_lon, a_miles), (b_lat, b_lon, b_miles) in zip(markers, markers[1:]):
+        for position in index.query_segment((a_lat, a_lon), (b_lat, b_lon), max_distance_miles):
+            point = (index.latitudes[position], index.longitudes[position])
+            t = segment_fraction(point, (a_lat, a_lon), (b_lat, b_lon))
+            closest = (a_lat + t * (b_lat - a_lat), a_lon + t * (b_lon - a_lon))
+            distance = haversine_miles(point, closest)
+            current = nearest.get(position)
+            if current is None or distance < current[0]:
+                nearest[position] = (distance, a_miles + t * (b_miles - a_miles))
+    return nearest
 
 
 def find_stations_on_route(
     route_points: List[Tuple[float, float]],
     max_distance_miles: float,
+    mode: Optional[str] = None,
 ) -> List[StationOnRoute]:
     if not route_points:
         return []
 
-    simplified = simplify_route_points(route_points)
-    markers = build_route_markers(simplified)
-    min_lat, max_lat, min_lon, max_lon = _bounding_box(simplified, max_distance_miles)
+    simplified = simplify_route_points(route_points, getattr(settings, "ROUTE_SIMPLIFY_MIN_MILES", 1.0))
+    return match_stations_to_route(build_route_markers(simplified), max_distance_miles, mode)
 
-    stations = []
-    for station in get_cached_stations():
-        lat = station["latitude"]
-        lon = station["longitude"]
-        if lat < min_lat or lat > max_lat or lon < min_lon or lon > max_lon:
-            continue
 
-        min_distance = None
-        mile_marker = 0.0
-        for p_lat, p_lon, miles in markers:
-            distance = haversine_miles((lat, lon), (p_lat, p_lon))
-            if min_distance is None or distance < min_distance:
-                min_distance = distance
-                mile_marker = miles
-        if min_distance is None or min_distance > max_distance_miles:
-            continue
+def _match_mode(mode: Optional[str]) -> str:
+    mode = mode or getattr(settings, "ROUTE_STATION_MATCH_MODE", MATCH_MODE_PROJECTION)
+    if mode not in (MATCH_MODE_PROJECTION, MATCH_MODE_VERTEX):
+        raise RoutePlannerError(f"Unknown station match mode: {mode}.")
+    return mode
 
-        stations.append(
-            StationOnRoute(
-                station_data=station,
-                price=float(station["retail_price"]),
-                mile_marker=mile_marker,
-                distance_to_route=float(min_distance),
-                latitude=lat,
-                longitude=lon,
-                virtual=False,
-            )
+
+def _route_matches(
+    snapshot: StationSnapshot,
+    markers: List[Tuple[float, float, float]],
+    max_distance_miles: float,
+    mode: str,
+    table: Optional[corridors.CorridorTable] = None,
+) -> Tuple[array, array, array]:
+    """Snapshot positions, mile markers and distances of the matched stations, in mile order.
+
+    Without NumPy, a corridor ``table`` for the snapshot that covers the distance replaces the grid
+    index: candidates come from the cells each segment passes through. The vectorized matchers
+    already outrun the table's per-segment lookups, so they keep the grid index.
+    """
+    if not markers:
+        return array("q"), array("d"), array("d")
+    use_numpy = geometry.use_numpy()
+    if table is not None and not use_numpy and table.covers(max_distance_miles):
+        index = table
+    else:
+        index = snapshot.grid_index(getattr(settings, "STATION_GRID_CELL_DEGREES", 0.25))
+
+    if mode == MATCH_MODE_PROJECTION and len(markers) > 1:
+        if use_numpy:
+            nearest = geometry.match_stations_to_segments(index, markers, max_distance_miles)
+        else:
+            nearest = _match_stations_to_segments(index, markers, max_distance_miles)
+    elif use_numpy:
+        nearest = geometry.match_stations_to_markers(index, markers, max_distance_miles)
+    else:
+        nearest = _match_stations_to_markers(index, markers, max_distance_miles)
+
+    # Stable sort over ascending positions, so stations at the same mile keep snapshot order.
+    matched = [position for position in sorted(nearest) if nearest[position][0] <= max_distance_miles]
+    matched.sort(key=lambda position: nearest[position][1])
+    return (
+        array("q", matched),
+        array("d", (nearest[position][1] for position in matched)),
+        array("d", (float(nearest[position][0]) for position in matched)),
+    )
+
+
+def _stations_from_matches(
+    snapshot: StationSnapshot, positions: array, miles: array, distances: array
+) -> List[StationOnRoute]:
+    return [
+        StationOnRoute(
+            station_data=snapshot.station_data(position),
+            price=snapshot.prices[position],
+            mile_marker=mile_marker,
+            distance_to_route=distance,
+            latitude=snapshot.latitudes[position],
+            longitude=snapshot.longitudes[position],
+            virtual=False,
         )
-    return sorted(stations, key=lambda s: s.mile_marker)
+        for position, mile_marker, distance in zip(positions, miles, distances)
+    ]
+
+
+def match_stations_to_route(
+    markers: List[Tuple[float, float, float]],
+    max_distance_miles: float,
+    mode: Optional[str] = None,
+) -> List[StationOnRoute]:
+    if not markers:
+        return []
+    mode = _match_mode(mode)
+    if _station_source() == STATION_SOURCE_CORRIDOR:
+        snapshot, table = corridor_snapshot(markers, max_distance_miles), None
+    else:
+        snapshot = get_station_snapshot()
+        table = corridors.corridor_table(snapshot)
+    return _stations_from_matches(snapshot, *_route_matches(snapshot, markers, max_distance_miles, mode, table))
+
+
+def stations_on_route(
+    route: RouteResult, max_distance_miles: float, snapshot: Optional[StationSnapshot] = None
+) -> List[StationOnRoute]:
+    """Stations along ``route``, with the matching itself cached apart from the fuel plan.
+
+    The entry is keyed on a hash of the station layout rather than the generation: price-only
+    refreshes keep positions and coordinates, so prices are simply read from the current snapshot,
+    while a layout rebuilt under the same version never reuses positions from the old one.
+    With ``ROUTE_STATION_SOURCE = "corridor"`` only the route's corridor is read from the database
+    and matched, uncached, since positions then refer to a snapshot private to this route.
+    """
+    mode = _match_mode(None)
+    if snapshot is None and _station_source() == STATION_SOURCE_CORRIDOR:
+        snapshot = corridor_snapshot(route.markers, max_distance_miles)
+        with instrumentation.stage("match"):
+            columns = _route_matches(snapshot, route.markers, max_distance_miles, mode)
+        return _stations_from_matches(snapshot, *columns)
+    snapshot = snapshot or get_station_snapshot()
+    simplify = getattr(settings, "ROUTE_SIMPLIFY_MIN_MILES", 1.0)
+    cache_key = (
+        f"{ROUTE_MATCH_KEY_PREFIX}:{snapshot.layout_hash}:{mode}:{max_distance_miles}:{simplify}:"
+        f"{route.geometry_hash}"
+    )
+    blob = tiered_cache.get(cache_key)
+    metrics.cache_lookup("station_match", blob is not None)
+    if blob is not None:
+        columns, _ = unpack_columns(memoryview(blob), "qdd", len(blob) // 24)
+    else:
+        table = corridors.corridor_table(snapshot)
+        with instrumentation.stage("match"):
+            columns = _route_matches(snapshot, route.markers, max_distance_miles, mode, table)
+        tiered_cache.set(cache_key, pack_columns(columns), timeout=STATION_CACHE_TIMEOUT)
+    return _stations_from_matches(snapshot, *columns)
 
 
 def choose_start_price(
@@ -309,6 +629,55 @@ def choose_start_price(
     )
 
 
+def next_cheaper_within_range(stops: List[StationOnRoute], max_range_miles: float) -> List[Optional[int]]:
+    """Index of the first later stop that is strictly cheaper and within range, for every stop.
+
+    Expects stations in mile order with the destination last; the destination may sit before the
+    furthest stations when marker miles overshoot the route distance. Linear, via a monotonic stack.
+    """
+    count = len(stops)
+    result: List[Optional[int]] = [None] * count
+    stack: List[int] = []
+    for index in range(count - 1, -1, -1):
+        price = stops[index].price
+        while stack and stops[stack[-1]].price >= price:
+            stack.pop()
+        if stack:
+            candidate = stack[-1]
+            max_reach = stops[index].mile_marker + max_range_miles
+            # Every stop between the two is passed on the way, so none of them may be out of range
+            # either. Stations are sorted, so the furthest of them is the one just before the candidate.
+            if stops[candidate].mile_marker <= max_reach and (
+                candidate == index + 1 or stops[candidate - 1].mile_marker <= max_reach
+            ):
+                result[index] = candidate
+        stack.append(index)
+    return result
+
+
+def _fuel_stop_payload(stop: StationOnRoute, gallons: float, cost: float) -> Dict[str, Any]:
+    station_payload = None
+    if stop.station_data:
+        station_payload = {
+            "opis_id": stop.station_data.get("opis_id"),
+            "truckstop_name": stop.station_data.get("truckstop_name"),
+            "address": stop.station_data.get("address"),
+            "city": stop.station_data.get("city"),
+            "state": stop.station_data.get("state"),
+            "rack_id": stop.station_data.get("rack_id"),
+        }
+    return {
+        "mile_marker": round(stop.mile_marker, 2),
+        "price_per_gallon": round(stop.price, 3),
+        "gallons": round(gallons, 3),
+        "cost": round(cost, 2),
+        "latitude": stop.latitude,
+        "longitude": stop.longitude,
+        "virtual": stop.virtual,
+        "station": station_payload,
+    }
+
+
 def plan_fuel_stops(
     stations: List[StationOnRoute],
     total_miles: float,
@@ -334,15 +703,10 @@ def plan_fuel_stops(
     total_gallons = 0.0
     planned_stops: List[Dict[str, Any]] = []
 
+    next_cheaper_indices = next_cheaper_within_range(stops, max_range_miles)
+
     for index, stop in enumerate(stops[:-1]):
-        max_reach = stop.mile_marker + max_range_miles
-        next_cheaper = None
-        for later in stops[index + 1 :]:
-            if later.mile_marker > max_reach:
-                break
-            if later.price < stop.price:
-                next_cheaper = later
-                break
+        next_cheaper = stops[next_cheaper_indices[index]] if next_cheaper_indices[index] is not None else None
         if next_cheaper:
             target_miles = next_cheaper.mile_marker - stop.mile_marker
         else:
@@ -359,28 +723,7 @@ def plan_fuel_stops(
             total_cost += cost
             total_gallons += purchase
             if not stop.virtual or stop.mile_marker == 0:
-                station_payload = None
-                if stop.station_data:
-                    station_payload = {
-                        "opis_id": stop.station_data.get("opis_id"),
-                        "truckstop_name": stop.station_data.get("truckstop_name"),
-                        "address": stop.station_data.get("address"),
-                        "city": stop.station_data.get("city"),
-                        "state": stop.station_data.get("state"),
-                        "rack_id": stop.station_data.get("rack_id"),
-                    }
-                planned_stops.append(
-                    {
-                        "mile_marker": round(stop.mile_marker, 2),
-                        "price_per_gallon": round(stop.price, 3),
-                        "gallons": round(purchase, 3),
-                        "cost": round(cost, 2),
-                        "latitude": stop.latitude,
-                        "longitude": stop.longitude,
-                        "virtual": stop.virtual,
-                        "station": station_payload,
-                    }
-                )
+                planned_stops.append(_fuel_stop_payload(stop, purchase, cost))
 
         next_stop = stops[index + 1]
         travel_miles = next_stop.mile_marker - stop.mile_marker
@@ -391,49 +734,129 @@ def plan_fuel_stops(
     return planned_stops, round(total_cost, 2), round(total_gallons, 3)
 
 
+def plan_fuel_stops_optimal(
+    stations: List[StationOnRoute],
+    total_miles: float,
+    mpg: float,
+    max_range_miles: float,
+    start_price: StationOnRoute,
+    stop_penalty: float = 0.0,
+    max_stops: Optional[int] = None,
+    min_purchase_gallons: float = 0.0,
+) -> Tuple[List[Dict[str, Any]], float, float]:
+    """Cheapest plan including the fuel burnt driving to and from each station.
+
+    ``stop_penalty`` is charged per stop (the dollar value of the time it takes) when choosing stops
+    but is not part of the reported cost. Gallons include detour fuel.
+    """
+    capacity_gallons = max_range_miles / mpg
+    stops = [start_price] + [s for s in stations if 0 < s.mile_marker < total_miles]
+    layers = max_stops + 1 if max_stops is not None else 1
+    step = optimizer.step_for_budget(
+        capacity_gallons,
+        len(stops),
+        layers,
+        getattr(settings, "ROUTE_OPTIMAL_FUEL_STEP_GALLONS", 0.25),
+        getattr(settings, "ROUTE_OPTIMAL_MAX_STATES", 200_000),
+    )
+    plan = optimizer.solve_fuel_plan(
+        [s.mile_marker for s in stops],
+        [s.price for s in stops],
+        [0.0] + [2 * s.distance_to_route / mpg for s in stops[1:]],
+        total_miles,
+        mpg,
+        capacity_gallons,
+        step,
+        stop_penalty=stop_penalty,
+        max_stops=max_stops,
+        min_purchase_gallons=min_purchase_gallons,
+    )
+    if plan is None:
+        if max_stops is not None or min_purchase_gallons:
+            raise RoutePlannerError("No fuel plan satisfies the stop limit and minimum purchase.")
+        raise RoutePlannerError("Route segment exceeds vehicle range.")
+
+    planned_stops = []
+    for index, gallons in plan.purchases:
+        stop = stops[index]
+        payload = _fuel_stop_payload(stop, gallons, gallons * stop.price)
+        payload["detour_miles"] = round(2 * stop.distance_to_route, 2) if index else 0.0
+        planned_stops.append(payload)
+    return planned_stops, round(plan.fuel_cost, 2), round(plan.gallons, 3)
+
+
 def route_plan_cache_key(payload: Dict[str, Any]) -> str:
     payload_bytes = json.dumps(payload, sort_keys=True).encode("utf-8")
     return f"route_plan:{hashlib.sha256(payload_bytes).hexdigest()}"
 
 
-def compute_route_plan(
-    start_location: str,
-    end_location: str,
-    max_range_miles: int,
-    mpg: float,
-    max_station_distance_miles: float,
-) -> Dict[str, Any]:
-    cache_key = route_plan_cache_key(
+def _plan_generation() -> int:
+    # Plans are keyed on the stations they are built from. While another worker rebuilds the snapshot
+    # this process keeps planning on the previous one, so those plans must not take the new key.
+    if _station_source() == STATION_SOURCE_CORRIDOR:
+        return station_generation()
+    return get_station_snapshot().version
+
+
+def _route_plan_key(
+    start_location: str, end_location: str, options: Dict[str, Any], generation: Optional[int] = None
+) -> str:
+    return route_plan_cache_key(
         {
             "start": start_location,
             "end": end_location,
-            "max_range_miles": max_range_miles,
-            "mpg": mpg,
-            "max_station_distance_miles": max_station_distance_miles,
+            **options,
+            "station_generation": _plan_generation() if generation is None else generation,
         }
     )
-    cached = cache.get(cache_key)
-    if cached:
-        return cached
 
-    start_geo = geocode_location(start_location)
-    end_geo = geocode_location(end_location)
+
+def _ensure_us(start_geo: GeocodeResult, end_geo: GeocodeResult) -> None:
     if not start_geo.is_us or not end_geo.is_us:
         raise RoutePlannerError("Start and end locations must be within the USA.")
 
-    route = get_route((start_geo.latitude, start_geo.longitude), (end_geo.latitude, end_geo.longitude))
-    stations_on_route = find_stations_on_route(route.coordinates, max_station_distance_miles)
-    start_price = choose_start_price(stations_on_route, max_station_distance_miles)
 
-    fuel_stops, total_cost, total_gallons = plan_fuel_stops(
-        stations_on_route,
-        route.distance_miles,
-        mpg,
-        max_range_miles,
-        start_price,
-    )
+def _build_route_plan(
+    start_location: str,
+    end_location: str,
+    start_geo: GeocodeResult,
+    end_geo: GeocodeResult,
+    route: RouteResult,
+    options: Dict[str, Any],
+    snapshot: Optional[StationSnapshot] = None,
+) -> Dict[str, Any]:
+    max_range_miles = options["max_range_miles"]
+    mpg = options["mpg"]
+    max_station_distance_miles = options["max_station_distance_miles"]
+    planner = options["planner"]
+
+    stations = stations_on_route(route, max_station_distance_miles, snapshot)
+    start_price = choose_start_price(stations, max_station_distance_miles)
+
+    with instrumentation.stage("plan"):
+        if planner == PLANNER_OPTIMAL:
+            fuel_stops, total_cost, total_gallons = plan_fuel_stops_optimal(
+                stations,
+                route.distance_miles,
+                mpg,
+                max_range_miles,
+                start_price,
+                stop_penalty=options["stop_penalty"],
+                max_stops=options["max_stops"],
+                min_purchase_gallons=options["min_purchase_gallons"],
+            )
+            cost_assumption = "Fuel stops minimize total cost, including fuel burned driving to and from each station."
+        else:
+            fuel_stops, total_cost, total_gallons = plan_fuel_stops(
+                stations,
+                route.distance_miles,
+                mpg,
+                max_range_miles,
+                start_price,
+            )
+            cost_assumption = "Fuel stops are optimized for cost under the configured range constraint."
 
-    response = {
+    return {
         "start": {
             "query": start_location,
             "place_name": start_geo.place_name,
@@ -455,19 +878,250 @@ def compute_route_plan(
         "fueling": {
             "max_range_miles": max_range_miles,
             "mpg": mpg,
+            "planner": planner,
             "total_cost": total_cost,
             "total_gallons": total_gallons,
             "fuel_stops": fuel_stops,
         },
         "assumptions": [
             "Fuel price at the start uses the nearest station along the route.",
-            "Fuel stops are optimized for cost under the configured range constraint.",
+            cost_assumption,
         ],
     }
 
-    cache.set(cache_key, response, timeout=60 * 60)
-    return response
+
+def compute_route_plan(
+    start_location: str,
+    end_location: str,
+    max_range_miles: int,
+    mpg: float,
+    max_station_distance_miles: float,
+    planner: str = PLANNER_GREEDY,
+    stop_penalty: float = 0.0,
+    max_stops: Optional[int] = None,
+    min_purchase_gallons: float = 0.0,
+) -> Dict[str, Any]:
+    options = {
+        "max_range_miles": max_range_miles,
+        "mpg": mpg,
+        "max_station_distance_miles": max_station_distance_miles,
+        "planner": planner,
+        "stop_penalty": stop_penalty,
+        "max_stops": max_stops,
+        "min_purchase_gallons": min_purchase_gallons,
+    }
+    return _cached_plan(
+        _route_plan_key(start_location, end_location, options),
+        lambda: _plan_route(start_location, end_location, options),
+    )
+
+
+def _cached_plan(cache_key: str, compute: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    computed = []
+
+    def compute_plan() -> Dict[str, Any]:
+        computed.append(True)
+        return compute()
+
+    # Concurrent identical requests share one computation; expired plans are served while one refreshes.
+    plan = get_or_compute(
+        cache_key,
+        compute_plan,
+        timeout=ROUTE_PLAN_CACHE_TIMEOUT,
+        stale_timeout=getattr(settings, "ROUTE_PLAN_STALE_SECONDS", 600),
+    )
+    metrics.cache_lookup("route_plan", not computed)
+    return plan
+
+
+def _plan_route(start_location: str, end_location: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    start_geo = geocode_location(start_location)
+    end_geo = geocode_location(end_location)
+    _ensure_us(start_geo, end_geo)
+
+    route = get_route((start_geo.latitude, start_geo.longitude), (end_geo.latitude, end_geo.longitude))
+    return _build_route_plan(start_location, end_location, start_geo, end_geo, route, options)
+
+
+async def acompute_route_plan(
+    start_location: str,
+    end_location: str,
+    max_range_miles: int,
+    mpg: float,
+    max_station_distance_miles: float,
+    planner: str = PLANNER_GREEDY,
+    stop_penalty: float = 0.0,
+    max_stops: Optional[int] = None,
+    min_purchase_gallons: float = 0.0,
+) -> Dict[str, Any]:
+    """Async counterpart of ``compute_route_plan``.
+
+    Both endpoints are geocoded at once, then the directions call overlaps loading the station
+    snapshot. Blocking work runs in threads; database access stays on the thread-sensitive executor.
+    """
+    options = {
+        "max_range_miles": max_range_miles,
+        "mpg": mpg,
+        "max_station_distance_miles": max_station_distance_miles,
+        "planner": planner,
+        "stop_penalty": stop_penalty,
+        "max_stops": max_stops,
+        "min_purchase_gallons": min_purchase_gallons,
+    }
+    computed = []
+    stale = []
+
+    async def compute_plan() -> Dict[str, Any]:
+        computed.append(True)
+        plan, version = await _aplan_route(start_location, end_location, options)
+        if version is not None and version != generation:
+            stale.append(True)
+        return plan
+
+    # Keyed on the generation so the snapshot can load alongside the lookups. A plan built from an
+    # older snapshot (another worker is still rebuilding the new one) is answered but not stored.
+    generation = await sync_to_async(station_generation, thread_sensitive=False)()
+    cache_key = _route_plan_key(start_location, end_location, options, generation)
+    plan = await aget_or_compute(
+        cache_key,
+        compute_plan,
+        timeout=ROUTE_PLAN_CACHE_TIMEOUT,
+        stale_timeout=getattr(settings, "ROUTE_PLAN_STALE_SECONDS", 600),
+        keep=lambda _plan: not stale,
+    )
+    metrics.cache_lookup("route_plan", not computed)
+    return plan
+
+
+async def _aplan_route(
+    start_location: str, end_location: str, options: Dict[str, Any]
+) -> Tuple[Dict[str, Any], Optional[int]]:
+    """The plan and the version of the station snapshot it was built from (None in corridor mode)."""
+    geocode = sync_to_async(geocode_location, thread_sensitive=False)
+    start_geo, end_geo = await asyncio.gather(geocode(start_location), geocode(end_location))
+    _ensure_us(start_geo, end_geo)
+
+    fetch_route = sync_to_async(get_route, thread_sensitive=False)(
+        (start_geo.latitude, start_geo.longitude), (end_geo.latitude, end_geo.longitude)
+    )
+    if _station_source() == STATION_SOURCE_CORRIDOR:
+        # The corridor query needs the route, so there is nothing to overlap it with.
+        route, snapshot = await fetch_route, None
+    else:
+        route, snapshot = await asyncio.gather(fetch_route, sync_to_async(get_station_snapshot)())
+    plan = await sync_to_async(_build_route_plan)(
+        start_location, end_location, start_geo, end_geo, route, options, snapshot
+    )
+    return plan, snapshot.version if snapshot is not None else None
+
+
+@dataclass
+class LanePlan:
+    index: int
+    plan: Optional[Dict[str, Any]] = None
+    detail: Optional[str] = None
+
+
+def _plan_options(lane: Dict[str, Any]) -> Dict[str, Any]:
+    # ``compute_route_plan`` keyword arguments, minus the locations, with its defaults filled in.
+    return {
+        "max_range_miles": lane["max_range_miles"],
+        "mpg": lane["mpg"],
+        "max_station_distance_miles": lane["max_station_distance_miles"],
+        "planner": lane.get("planner", PLANNER_GREEDY),
+        "stop_penalty": lane.get("stop_penalty", 0.0),
+        "max_stops": lane.get("max_stops"),
+        "min_purchase_gallons": lane.get("min_purchase_gallons", 0.0),
+    }
+
+
+def is_route_plan_cached(request: Dict[str, Any]) -> bool:
+    """Whether ``compute_route_plan(**request)`` would be answered from the cache."""
+    return is_cached(_route_plan_key(request["start_location"], request["end_location"], _plan_options(request)))
+
+
+def _lane_error(index: int, exc: Exception) -> LanePlan:
+    if isinstance(exc, RoutePlannerError):
+        return LanePlan(index, detail=str(exc))
+    if isinstance(exc, (http_client.HTTPStatusError, OSError)):
+        return LanePlan(index, detail="Mapbox request failed.")
+    # The stream is already under way, so a bug in one lane must not cut off the others.
+    logger.error("Route plan batch lane %s failed", index, exc_info=exc)
+    return LanePlan(index, detail="Route planning failed.")
+
+
+def plan_route_batch(lanes: List[Dict[str, Any]]) -> Iterator[LanePlan]:
+    """Plan many lanes, yielding each one as soon as it is ready (not in request order).
+
+    Cached plans come back first. Every distinct location is geocoded once and every distinct
+    route fetched once, concurrently; lanes are then planned on this thread against one station
+    snapshot, so lanes sharing a route and station distance also share the station matching.
+    A failing lane yields its ``detail`` instead of ending the batch.
+    """
+    # In corridor mode each lane reads its own corridor instead of sharing one snapshot.
+    snapshot = get_station_snapshot() if _station_source() == STATION_SOURCE_SNAPSHOT else None
+    # Lanes are keyed on the stations they are planned against, even if the generation moves meanwhile.
+    generation = snapshot.version if snapshot is not None else station_generation()
+    pending = []
+    for index, lane in enumerate(lanes):
+        start_location, end_location, options = lane["start_location"], lane["end_location"], _plan_options(lane)
+        cache_key = _route_plan_key(start_location, end_location, options, generation)
+        if not is_cached(cache_key):
+            pending.append((index, start_location, end_location, options, cache_key))
+            continue
+        try:
+            plan = _cached_plan(cache_key, lambda: _plan_route(start_location, end_location, options))
+        except Exception as exc:
+            yield _lane_error(index, exc)
+        else:
+            yield LanePlan(index, plan=plan)
+    if not pending:
+        return
+
+    with ThreadPoolExecutor(max_workers=getattr(settings, "ROUTE_PLAN_BATCH_WORKERS", 8)) as executor:
+        geocodes: Dict[str, Future] = {}
+        for _, start_location, end_location, _, _ in pending:
+            for query in (start_location, end_location):
+                if query.strip().lower() not in geocodes:
+                    geocodes[query.strip().lower()] = executor.submit(geocode_location, query)
+        wait(geocodes.values())
+
+        routes: Dict[str, Future] = {}
+        lanes_by_route: Dict[str, List[Tuple[Any, ...]]] = {}
+        for index, start_location, end_location, options, cache_key in pending:
+            try:
+                start_geo = geocodes[start_location.strip().lower()].result()
+                end_geo = geocodes[end_location.strip().lower()].result()
+                _ensure_us(start_geo, end_geo)
+            except Exception as exc:
+                yield _lane_error(index, exc)
+                continue
+            start, end = (start_geo.latitude, start_geo.longitude), (end_geo.latitude, end_geo.longitude)
+            route_key = _route_cache_key(start, end)
+            if route_key not in routes:
+                routes[route_key] = executor.submit(get_route, start, end)
+            lanes_by_route.setdefault(route_key, []).append(
+                (index, start_location, end_location, options, cache_key, start_geo, end_geo)
+            )
+
+        route_keys = {future: key for key, future in routes.items()}
+        for future in as_completed(route_keys):
+            for lane in lanes_by_route[route_keys[future]]:
+                index, start_location, end_location, options, cache_key, start_geo, end_geo = lane
+                try:
+                    route = future.result()
+                    plan = _cached_plan(
+                        cache_key,
+                        lambda: _build_route_plan(
+                            start_location, end_location, start_geo, end_geo, route, options, snapshot
+                        ),
+                    )
+                except Exception as exc:
+                    yield _lane_error(index, exc)
+                else:
+                    yield LanePlan(index, plan=plan)
 
 
 def invalidate_station_cache() -> None:
-    cache.delete("fuel_stations:all")
+    # Snapshots and route plans are keyed by generation, so bumping it retires them in every worker.
+    bump_station_generation()
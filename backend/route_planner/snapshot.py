@@ -0,0 +1,170 @@
+import hashlib
+import struct
+import sys
+from array import array
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .spatial import StationGridIndex
+
+DETAIL_FIELDS = ("opis_id", "truckstop_name", "address", "city", "state", "rack_id")
+
+# magic, station count, details version
+_HEADER = struct.Struct("<4sIQ")
+_MAGIC = b"FSS2"
+
+DetailRow = Tuple[Any, ...]
+
+
+def pack_columns(columns: Sequence[array]) -> bytes:
+    """Concatenate typed arrays as little-endian bytes."""
+    if sys.byteorder != "little":
+        columns = [array(column.typecode, column) for column in columns]
+        for column in columns:
+            column.byteswap()
+    return b"".join(column.tobytes() for column in columns)
+
+
+def unpack_columns(view: memoryview, typecodes: str, count: int) -> Tuple[List[array], memoryview]:
+    """Read ``count`` items per typecode written by ``pack_columns``; returns the columns and the rest."""
+    columns = []
+    for typecode in typecodes:
+        column = array(typecode)
+        size = count * column.itemsize
+        column.frombytes(view[:size])
+        if sys.byteorder != "little":
+            column.byteswap()
+        columns.append(column)
+        view = view[size:]
+    return columns, view
+
+
+class StationSnapshot:
+    """Columnar, read-only view of every geocoded station.
+
+    Coordinates, prices and ids live in parallel typed arrays so the snapshot serializes to a single
+    compact blob. Text fields are kept apart and only fetched through ``details_loader`` the first
+    time a station's details are needed. ``details_version`` is the generation the station layout
+    (ids, coordinates, text) was built at; price patches keep it, so details are shared across them.
+    ``layout_hash`` identifies the ids and coordinates themselves, for caches of positions that must
+    not outlive them even when a layout is rebuilt under the same version.
+    """
+
+    def __init__(
+        self,
+        version: int,
+        ids: array,
+        latitudes: array,
+        longitudes: array,
+        prices: array,
+        details_loader: Optional[Callable[["StationSnapshot"], Sequence[DetailRow]]] = None,
+        details: Optional[Sequence[DetailRow]] = None,
+        details_version: Optional[int] = None,
+    ):
+        self.version = version
+        self.details_version = version if details_version is None else details_version
+        self.ids = ids
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.prices = prices
+        self._details_loader = details_loader
+        self._details = details
+        self._grid_index: Optional[StationGridIndex] = None
+        self._positions: Optional[Dict[int, int]] = None
+        self._layout_hash: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_rows(cls, version: int, rows: Iterable[Dict[str, Any]]) -> "StationSnapshot":
+        ids = array("q")
+        latitudes = array("d")
+        longitudes = array("d")
+        prices = array("d")
+        details: List[DetailRow] = []
+        for row in rows:
+            ids.append(row["id"])
+            latitudes.append(row["latitude"])
+            longitudes.append(row["longitude"])
+            prices.append(float(row["retail_price"]))
+            details.append(tuple(row.get(field) for field in DETAIL_FIELDS))
+        return cls(version, ids, latitudes, longitudes, prices, details=details)
+
+    def to_bytes(self) -> bytes:
+        header = _HEADER.pack(_MAGIC, len(self.ids), self.details_version)
+        return header + pack_columns([self.ids, self.latitudes, self.longitudes, self.prices])
+
+    @classmethod
+    def from_bytes(
+        cls,
+        version: int,
+        blob: bytes,
+        details_loader: Optional[Callable[["StationSnapshot"], Sequence[DetailRow]]] = None,
+    ) -> "StationSnapshot":
+        if len(blob) < _HEADER.size:
+            raise ValueError("Not a station snapshot blob.")
+        magic, count, details_version = _HEADER.unpack_from(blob)
+        if magic != _MAGIC:
+            raise ValueError("Not a station snapshot blob.")
+        columns, _ = unpack_columns(memoryview(blob)[_HEADER.size :], "qddd", count)
+        return cls(version, *columns, details_loader=details_loader, details_version=details_version)
+
+    def details(self) -> Sequence[DetailRow]:
+        if self._details is None:
+            self._details = self._details_loader(self) if self._details_loader else []
+        return self._details
+
+    def station_data(self, position: int) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"id": self.ids[position]}
+        details = self.details()
+        if position < len(details):
+            data.update(zip(DETAIL_FIELDS, details[position]))
+        data["retail_price"] = self.prices[position]
+        data["latitude"] = self.latitudes[position]
+        data["longitude"] = self.longitudes[position]
+        return data
+
+    def grid_index(self, cell_degrees: float = 0.25) -> StationGridIndex:
+        if self._grid_index is None or self._grid_index.cell_degrees != cell_degrees:
+            self._grid_index = StationGridIndex(self.latitudes, self.longitudes, cell_degrees=cell_degrees)
+        return self._grid_index
+
+    @property
+    def layout_hash(self) -> str:
+        if self._layout_hash is None:
+            digest = hashlib.blake2b(digest_size=16)
+            for column in (self.ids, self.latitudes, self.longitudes):
+                digest.update(pack_columns([column]))
+            self._layout_hash = digest.hexdigest()
+        return self._layout_hash
+
+    def position_of(self, station_id: int) -> Optional[int]:
+        if self._positions is None:
+            self._positions = {station_id: position for position, station_id in enumerate(self.ids)}
+        return self._positions.get(station_id)
+
+    def with_prices(self, version: int, prices: Dict[int, float]) -> "StationSnapshot":
+        """Copy of this snapshot at ``version`` with some prices replaced.
+
+        Ids, coordinates, details and the grid index are shared with the original; ids that are not
+        in the snapshot (stations without coordinates) are ignored.
+        """
+        patched_prices = array("d", self.prices)
+        for station_id, price in prices.items():
+            position = self.position_of(station_id)
+            if position is not None:
+                patched_prices[position] = price
+        patched = StationSnapshot(
+            version,
+            self.ids,
+            self.latitudes,
+            self.longitudes,
+            patched_prices,
+            details_loader=self._details_loader,
+            details=self._details,
+            details_version=self.details_version,
+        )
+        patched._grid_index = self._grid_index
+        patched._positions = self._positions
+        patched._layout_hash = self._layout_hash
+        return patched
@@ -0,0 +1,133 @@
+import math
+from collections import defaultdict
+from typing import Dict, Iterator, List, Sequence, Set, Tuple
+
+# Slightly below the true ~69.09 miles per degree so degree buffers err on the wide side.
+MILES_PER_DEGREE = 69.0
+
+# Size of the cells stored in FuelStation.grid_cell. Changing it means recomputing that column.
+STATION_CELL_DEGREES = 0.25
+
+Cell = Tuple[int, int]
+
+
+def degree_buffers(lat: float, buffer_miles: float) -> Tuple[float, float]:
+    lat_buffer = buffer_miles / MILES_PER_DEGREE
+    # Use the latitude farthest from the equator inside the buffer, where longitude degrees are shortest.
+    extreme_lat = min(abs(lat) + lat_buffer, 89.9)
+    lon_buffer = buffer_miles / (MILES_PER_DEGREE * max(math.cos(math.radians(extreme_lat)), 0.01))
+    return lat_buffer, lon_buffer
+
+
+def haversine_miles(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    lat1, lon1 = a
+    lat2, lon2 = b
+    rad = math.radians
+    dlat = rad(lat2 - lat1)
+    dlon = rad(lon2 - lon1)
+    lat1 = rad(lat1)
+    lat2 = rad(lat2)
+    h = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * 3958.7613 * math.asin(math.sqrt(h))
+
+
+def cell_key(row: int, column: int, cell_degrees: float) -> int:
+    """Integer key of a cell counted from (-90, -180); columns wrap around the antimeridian."""
+    columns = round(360 / cell_degrees)
+    return row * columns + column % columns
+
+
+def grid_cell_key(lat: float, lon: float, cell_degrees: float) -> int:
+    return cell_key(math.floor((lat + 90) / cell_degrees), math.floor((lon + 180) / cell_degrees), cell_degrees)
+
+
+def station_cell(lat: float, lon: float) -> int:
+    """Key of the ``STATION_CELL_DEGREES`` cell containing the point, as stored on FuelStation."""
+    return grid_cell_key(lat, lon, STATION_CELL_DEGREES)
+
+
+def corridor_cells(
+    points: Sequence[Sequence[float]], radius_miles: float, cell_degrees: float = STATION_CELL_DEGREES
+) -> Set[int]:
+    """Keys of every cell within ``radius_miles`` of the polyline through ``points`` (lat, lon, ...)."""
+    cells: Set[int] = set()
+    for start, end in zip(points, points[1:] or points):
+        lat_buffer, lon_buffer = degree_buffers(max(abs(start[0]), abs(end[0])), radius_miles)
+        min_row = math.floor((min(start[0], end[0]) - lat_buffer + 90) / cell_degrees)
+        max_row = math.floor((max(start[0], end[0]) + lat_buffer + 90) / cell_degrees)
+        min_col = math.floor((min(start[1], end[1]) - lon_buffer + 180) / cell_degrees)
+        max_col = math.floor((max(start[1], end[1]) + lon_buffer + 180) / cell_degrees)
+        for row in range(min_row, max_row + 1):
+            cells.update(cell_key(row, column, cell_degrees) for column in range(min_col, max_col + 1))
+    return cells
+
+
+def segment_cells(start: Tuple[float, float], end: Tuple[float, float], cell_degrees: float) -> List[int]:
+    """Keys of the cells the straight lat/lon segment passes through, walked row by row."""
+    if start[0] > end[0]:
+        start, end = end, start
+    y0, x0 = (start[0] + 90) / cell_degrees, (start[1] + 180) / cell_degrees
+    y1, x1 = (end[0] + 90) / cell_degrees, (end[1] + 180) / cell_degrees
+    row, column = math.floor(y0), math.floor(x0)
+    if row == math.floor(y1) and column == math.floor(x1):
+        # Route segments are usually much shorter than a cell.
+        return [cell_key(row, column, cell_degrees)]
+    cells = []
+    for row in range(math.floor(y0), math.floor(y1) + 1):
+        if y1 == y0:
+            low_x, high_x = x0, x1
+        else:
+            # Where the segment enters and leaves this row.
+            low_x = x0 + (x1 - x0) * (max(y0, row) - y0) / (y1 - y0)
+            high_x = x0 + (x1 - x0) * (min(y1, row + 1) - y0) / (y1 - y0)
+        if low_x > high_x:
+            low_x, high_x = high_x, low_x
+        cells.extend(cell_key(row, column, cell_degrees) for column in range(math.floor(low_x), math.floor(high_x) + 1))
+    return cells
+
+
+class StationGridIndex:
+    """Buckets station positions into fixed-size lat/lon cells for radius and box lookups."""
+
+    def __init__(self, latitudes: Sequence[float], longitudes: Sequence[float], cell_degrees: float = 0.25):
+        if cell_degrees <= 0:
+            raise ValueError("cell_degrees must be positive.")
+        self.cell_degrees = cell_degrees
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self._cells: Dict[Cell, List[int]] = defaultdict(list)
+        for position, (lat, lon) in enumerate(zip(latitudes, longitudes)):
+            self._cells[self.cell_for(lat, lon)].append(position)
+
+    def __len__(self) -> int:
+        return len(self.latitudes)
+
+    def cell_for(self, lat: float, lon: float) -> Cell:
+        return math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees)
+
+    def query_box(self, min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> Iterator[int]:
+        min_row, min_col = self.cell_for(min_lat, min_lon)
+        max_row, max_col = self.cell_for(max_lat, max_lon)
+        cells = self._cells
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                bucket = cells.get((row, col))
+                if bucket:
+                    yield from bucket
+
+    def query_radius(self, lat: float, lon: float, radius_miles: float) -> Iterator[int]:
+        """Yield positions of stations that may lie within ``radius_miles``; callers apply the exact check."""
+        lat_buffer, lon_buffer = degree_buffers(lat, radius_miles)
+        return self.query_box(lat - lat_buffer, lat + lat_buffer, lon - lon_buffer, lon + lon_buffer)
+
+    def query_segment(
+        self, start: Tuple[float, float], end: Tuple[float, float], radius_miles: float
+    ) -> Iterator[int]:
+        """Yield positions of stations inside the segment's bounding box grown by ``radius_miles``."""
+        lat_buffer, lon_buffer = degree_buffers(max(abs(start[0]), abs(end[0])), radius_miles)
+        return self.query_box(
+            min(start[0], end[0]) - lat_buffer,
+            max(start[0], end[0]) + lat_buffer,
+            min(start[1], end[1]) - lon_buffer,
+            max(start[1], end[1]) + lon_buffer,
+        )
@@ -1,14 +1,121 @@
-import csv
-from decimal import Decimal
-from io import TextIOWrapper
-from typing import List
+from typing import Any, Dict, List, Optional
 
-from celery import shared_task
+from celery import chord, shared_task
+from django.conf import settings
+from django.core.cache import cache
 from django.core.files.storage import default_storage
+from django.db.models import F
 from django.utils import timezone
 
-from .models import FuelStation, FuelStationUploadJob
-from .services import geocode_location, invalidate_station_cache
+from . import metrics
+from .corridors import refresh_station_corridors
+from .importer import (
+    GeocodingStage,
+    ImportStats,
+    iter_csv_range,
+    iter_station_batches,
+    plan_byte_ranges,
+    refresh_station_prices,
+    upsert_station_batch,
+)
+from .models import FuelStation, FuelStationUploadJob, RoutePlanJob
+from .services import (
+    RoutePlannerError,
+    compute_route_plan,
+    geocode_location,
+    invalidate_station_cache,
+    patch_station_prices,
+)
+
+COUNT_FIELDS = {
+    "processed": "processed_rows",
+    "created": "created_count",
+    "updated": "updated_count",
+    "geocoded": "geocoded_count",
+    "failed": "failed_count",
+    "price_changed": "price_changed_count",
+}
+
+
+def _add_progress(job_id: int, delta: Dict[str, int]) -> None:
+    # Chunks run on separate workers, so progress is accumulated with atomic increments.
+    updates = {column: F(column) + delta[name] for name, column in COUNT_FIELDS.items() if delta[name]}
+    if updates:
+        FuelStationUploadJob.objects.filter(pk=job_id).update(**updates, updated_at=timezone.now())
+
+
+def _import_range(
+    job: FuelStationUploadJob,
+    start: int,
+    end: int,
+    stats: ImportStats,
+    shared_rate: bool = False,
+) -> None:
+    reported = dict.fromkeys(COUNT_FIELDS, 0)
+    price_refresh = job.mode == FuelStationUploadJob.MODE_PRICE_REFRESH
+    with (
+        default_storage.open(job.file_path, "rb") as file_obj,
+        GeocodingStage(geocode_location, stats, shared_rate=shared_rate) as geocoding,
+    ):
+        header = file_obj.readline()
+        for batch in iter_station_batches(iter_csv_range(file_obj, header, start, end), stats):
+            # Known stations only get their price written on a price refresh; new ones still go through
+            # the full path.
+            new = refresh_station_prices(batch, stats) if price_refresh else batch
+            if new:
+                upsert_station_batch(new, stats)
+            # Every station still without coordinates is queued, so a refresh also repairs earlier misses.
+            geocoding.submit_missing(batch)
+            geocoding.flush()
+
+            current = {name: getattr(stats, name) for name in COUNT_FIELDS}
+            _add_progress(job.id, {name: current[name] - reported[name] for name in COUNT_FIELDS})
+            reported = current
+
+    _add_progress(job.id, {name: getattr(stats, name) - reported[name] for name in COUNT_FIELDS})
+
+
+def _fail_job(job_id: int, errors: List[str]) -> None:
+    FuelStationUploadJob.objects.filter(pk=job_id).update(
+        error_log="\n".join(errors),
+        status=FuelStationUploadJob.STATUS_FAILED,
+        finished_at=timezone.now(),
+        updated_at=timezone.now(),
+    )
+
+
+def _publish_station_layout(job: FuelStationUploadJob) -> None:
+    try:
+        if getattr(settings, "ROUTE_CORRIDOR_TABLE_ENABLED", False):
+            # Created and newly geocoded stations were all saved during the job.
+            changed = FuelStation.objects.filter(updated_at__gte=job.started_at) if job.started_at else None
+            refresh_station_corridors(None if changed is None else changed.values_list("id", flat=True))
+    finally:
+        # After the refresh, so workers reloading the corridor table for the new layout see it.
+        invalidate_station_cache()
+
+
+def _publish_station_changes(job: FuelStationUploadJob, stats: ImportStats) -> None:
+    if job.mode != FuelStationUploadJob.MODE_PRICE_REFRESH or stats.created or stats.geocoded:
+        _publish_station_layout(job)
+        return
+    if not stats.price_changed:
+        return
+    # Only prices moved, so the station layout (and its grid index) can be kept.
+    changed = FuelStation.objects.filter(updated_at__gte=job.started_at, latitude__isnull=False)
+    patch_station_prices({station_id: float(price) for station_id, price in changed.values_list("id", "retail_price")})
+
+
+def _record_import_metrics(job: FuelStationUploadJob, stats: ImportStats, status: str, elapsed: float = 0.0) -> None:
+    for name in COUNT_FIELDS:
+        if getattr(stats, name):
+            metrics.inc("route_planner_import_rows_total", getattr(stats, name), mode=job.mode, result=name)
+    metrics.inc("route_planner_import_jobs_total", mode=job.mode, status=status)
+    if elapsed > 0:
+        metrics.inc("route_planner_import_seconds_total", elapsed, mode=job.mode)
+        metrics.set_gauge("route_planner_import_rows_per_second", stats.processed / elapsed, mode=job.mode)
+    # Imports are rare; publish now rather than waiting for the worker's next flush.
+    metrics.flush()
 
 
 @shared_task
@@ -18,113 +125,126 @@ def process_fuel_station_csv(job_id: int) -> None:
     job.started_at = timezone.now()
     job.save(update_fields=["status", "started_at", "updated_at"])
 
-    error_messages: List[str] = []
-    created = 0
-    updated = 0
-    geocoded = 0
-    failed = 0
-    processed = 0
-
     try:
+        size = default_storage.size(job.file_path)
+        chunk_bytes = getattr(settings, "FUEL_STATION_IMPORT_CHUNK_BYTES", 4 * 1024 * 1024)
         with default_storage.open(job.file_path, "rb") as file_obj:
-            wrapper = TextIOWrapper(file_obj, encoding="utf-8")
-            reader = csv.DictReader(wrapper)
-            total_rows = sum(1 for _ in reader)
-
-        job.total_rows = total_rows
+            header, ranges = plan_byte_ranges(file_obj, size, chunk_bytes)
+            # Planning moved the file position, so sample from the first row.
+            file_obj.seek(len(header))
+            sample = file_obj.read(64 * 1024) if ranges else b""
+        # Rows are only counted as they are parsed; estimate the total from the average line length.
+        average_line = len(sample) / max(sample.count(b"\n"), 1) if sample else 1
+        job.total_rows = round((size - len(header)) / average_line) if ranges else 0
         job.save(update_fields=["total_rows", "updated_at"])
+    except Exception as exc:
+        _fail_job(job_id, [f"Job failed: {exc}"])
+        _record_import_metrics(job, ImportStats(), FuelStationUploadJob.STATUS_FAILED)
+        raise
+
+    if len(ranges) <= 1:
+        result = import_fuel_station_csv_chunk(job_id, 0, *(ranges[0] if ranges else (0, 0)), 1)
+        finalize_fuel_station_upload([result], job_id)
+        return
+
+    # A chunk that dies outright (lost worker, time limit) fails the chord instead of returning a result.
+    finalize = finalize_fuel_station_upload.s(job_id).on_error(fail_fuel_station_upload.s(job_id))
+    chord(
+        import_fuel_station_csv_chunk.s(job_id, index, start, end, len(ranges))
+        for index, (start, end) in enumerate(ranges)
+    )(finalize)
 
-        with default_storage.open(job.file_path, "rb") as file_obj:
-            wrapper = TextIOWrapper(file_obj, encoding="utf-8")
-            reader = csv.DictReader(wrapper)
-
-            for index, row in enumerate(reader, start=1):
-                try:
-                    opis_id = int(row["OPIS Truckstop ID"].strip())
-                    truckstop_name = row["Truckstop Name"].strip()
-                    address = row["Address"].strip()
-                    city = row["City"].strip()
-                    state = row["State"].strip()
-                    rack_id = int(row["Rack ID"].strip())
-                    retail_price = Decimal(row["Retail Price"].strip())
-
-                    defaults = {"retail_price": retail_price}
-                    station, was_created = FuelStation.objects.update_or_create(
-                        opis_id=opis_id,
-                        truckstop_name=truckstop_name,
-                        address=address,
-                        city=city,
-                        state=state,
-                        rack_id=rack_id,
-                        defaults=defaults,
-                    )
-                    if was_created:
-                        created += 1
-                    else:
-                        updated += 1
-
-                    if station.latitude is None or station.longitude is None:
-                        query = f"{address}, {city}, {state}"
-                        try:
-                            result = geocode_location(query)
-                        except Exception as exc:
-                            failed += 1
-                            error_messages.append(f"Row {index}: geocoding failed: {exc}")
-                        else:
-                            station.latitude = result.latitude
-                            station.longitude = result.longitude
-                            station.save(update_fields=["latitude", "longitude"])
-                            geocoded += 1
-
-                except Exception as exc:
-                    failed += 1
-                    error_messages.append(f"Row {index}: {exc}")
-
-                processed += 1
-                if processed % 100 == 0:
-                    job.processed_rows = processed
-                    job.created_count = created
-                    job.updated_count = updated
-                    job.geocoded_count = geocoded
-                    job.failed_count = failed
-                    job.save(
-                        update_fields=[
-                            "processed_rows",
-                            "created_count",
-                            "updated_count",
-                            "geocoded_count",
-                            "failed_count",
-                            "updated_at",
-                        ]
-                    )
-
-        job.processed_rows = processed
-        job.created_count = created
-        job.updated_count = updated
-        job.geocoded_count = geocoded
-        job.failed_count = failed
-        job.error_log = "\n".join(error_messages)
-        job.status = FuelStationUploadJob.STATUS_COMPLETED
-        job.finished_at = timezone.now()
-        job.save(
-            update_fields=[
-                "processed_rows",
-                "created_count",
-                "updated_count",
-                "geocoded_count",
-                "failed_count",
-                "error_log",
-                "status",
-                "finished_at",
-                "updated_at",
-            ]
-        )
-        invalidate_station_cache()
 
+@shared_task
+def import_fuel_station_csv_chunk(job_id: int, index: int, start: int, end: int, chunk_count: int) -> Dict[str, Any]:
+    job = FuelStationUploadJob.objects.get(pk=job_id)
+    stats = ImportStats(row_label=f"Chunk {index + 1} row" if chunk_count > 1 else "Row")
+    try:
+        # The geocoding rate limit is global; chunks draw from one bucket in Redis wherever they run.
+        _import_range(job, start, end, stats, shared_rate=True)
     except Exception as exc:
-        error_messages.append(f"Job failed: {exc}")
-        job.error_log = "\n".join(error_messages)
-        job.status = FuelStationUploadJob.STATUS_FAILED
-        job.finished_at = timezone.now()
-        job.save(update_fields=["error_log", "status", "finished_at", "updated_at"])
+        stats.errors.append(f"Chunk {index + 1} failed: {exc}")
+        return {**stats.as_dict(), "fatal": True}
+    return stats.as_dict()
+
+
+@shared_task
+def fail_fuel_station_upload(request: Any, exc: Exception, traceback: Any, job_id: int) -> None:
+    """Errback of the chunk chord: marks the job failed and publishes what the other chunks committed."""
+    job = FuelStationUploadJob.objects.get(pk=job_id)
+    _fail_job(job_id, [f"Job failed: {exc}"])
+    _record_import_metrics(job, ImportStats(), FuelStationUploadJob.STATUS_FAILED)
+    _publish_station_layout(job)
+
+
+@shared_task
+def finalize_fuel_station_upload(results: List[Dict[str, Any]], job_id: int) -> None:
+    job = FuelStationUploadJob.objects.get(pk=job_id)
+    stats = ImportStats()
+    for result in results:
+        stats.merge(result)
+
+    if any(result.get("fatal") for result in results):
+        _fail_job(job_id, stats.errors)
+        _record_import_metrics(job, stats, FuelStationUploadJob.STATUS_FAILED)
+        # Rows from the chunks that did succeed are already committed.
+        _publish_station_layout(job)
+        return
+
+    finished_at = timezone.now()
+    elapsed = (finished_at - job.started_at).total_seconds() if job.started_at else 0
+    for name, column in COUNT_FIELDS.items():
+        setattr(job, column, getattr(stats, name))
+    job.total_rows = stats.processed
+    job.rows_per_second = round(stats.processed / elapsed, 1) if elapsed > 0 else 0.0
+    job.error_log = "\n".join(stats.errors)
+    job.status = FuelStationUploadJob.STATUS_COMPLETED
+    job.finished_at = finished_at
+    job.save(
+        update_fields=[
+            "total_rows",
+            *COUNT_FIELDS.values(),
+            "rows_per_second",
+            "error_log",
+            "status",
+            "finished_at",
+            "updated_at",
+        ]
+    )
+    _publish_station_changes(job, stats)
+    _record_import_metrics(job, stats, FuelStationUploadJob.STATUS_COMPLETED, elapsed)
+
+
+def route_plan_job_done_key(job_id: Any) -> str:
+    return f"route_plan_job:{job_id}:done"
+
+
+def finish_route_plan_job(
+    job: RoutePlanJob, status: str, result: Optional[Dict[str, Any]] = None, error: str = ""
+) -> None:
+    job.status = status
+    job.result = result
+    job.error = error
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "result", "error", "finished_at", "updated_at"])
+    # Long-polling status requests watch this key instead of querying the job row.
+    cache.set(route_plan_job_done_key(job.id), True, timeout=getattr(settings, "ROUTE_PLAN_JOB_MAX_WAIT_SECONDS", 25))
+
+
+@shared_task
+def compute_route_plan_job(job_id: str) -> None:
+    job = RoutePlanJob.objects.get(pk=job_id)
+    job.status = RoutePlanJob.STATUS_RUNNING
+    job.started_at = timezone.now()
+    job.save(update_fields=["status", "started_at", "updated_at"])
+
+    try:
+        with metrics.timer("route_planner_route_plan_seconds", endpoint="job"):
+            result = compute_route_plan(**job.request)
+    except RoutePlannerError as exc:
+        finish_route_plan_job(job, RoutePlanJob.STATUS_FAILED, error=str(exc))
+    except Exception:
+        finish_route_plan_job(job, RoutePlanJob.STATUS_FAILED, error="Route planning failed.")
         raise
+    else:
+        finish_route_plan_job(job, RoutePlanJob.STATUS_COMPLETED, result=result)
@@ -0,0 +1,89 @@
+import gzip
+import json
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+Responder = Callable[[str], Tuple[int, Dict]]
+
+
+def geocoding_responder(path: str) -> Tuple[int, Dict]:
+    query = urllib.parse.unquote(path.rsplit("/", 1)[-1].split(".json", 1)[0])
+    # Deterministic fake coordinates derived from the query text.
+    seed = sum(ord(char) for char in query)
+    return 200, {
+        "features": [
+            {
+                "center": [-100.0 + (seed % 1000) / 100, 30.0 + (seed % 700) / 100],
+                "place_name": query,
+                "context": [{"id": "country.1", "short_code": "us"}],
+            }
+        ]
+    }
+
+
+class StubMapboxServer:
+    """Local HTTP server standing in for the Mapbox APIs in tests."""
+
+    def __init__(self, responder: Responder = geocoding_responder, delay: float = 0.0, compress: bool = False):
+        self.responder = responder
+        self.delay = delay
+        self.compress = compress
+        self.paths: List[str] = []
+        self.connections = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "StubMapboxServer":
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.paths.append(self.path)
+                    stub._in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub._in_flight)
+                try:
+                    if stub.delay:
+                        time.sleep(stub.delay)
+                    status, payload = stub.responder(urllib.parse.urlsplit(self.path).path)
+                    body = json.dumps(payload).encode("utf-8")
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    if stub.compress and "gzip" in self.headers.get("Accept-Encoding", ""):
+                        body = gzip.compress(body)
+                        self.send_header("Content-Encoding", "gzip")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with stub._lock:
+                        stub._in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,7 +1,17 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+
 import pytest
+from asgiref.sync import async_to_sync
 from rest_framework.test import APIClient
 
-from route_planner.services import RoutePlannerError
+from core.asgi import application
+
+from route_planner import instrumentation, tasks
+from route_planner.services import LanePlan, RoutePlannerError
 
 
 @pytest.mark.django_db
@@ -56,3 +66,191 @@ def test_route_plan_validation_error():
 
     assert response.status_code == 400
     assert "end_location" in response.data
+
+
+@pytest.mark.django_db
+def test_async_route_plan_endpoint(monkeypatch):
+    seen = {}
+
+    async def fake_acompute(**kwargs):
+        seen.update(kwargs)
+        if kwargs["end_location"] == "Nowhere":
+            raise RoutePlannerError("No route found")
+        return {"fueling": {"total_cost": 12.5}}
+
+    monkeypatch.setattr("route_planner.views.acompute_route_plan", fake_acompute)
+    client = APIClient()
+
+    response = client.post(
+        "/api/v1/route-plan/async/",
+        {"start_location": "Austin, TX", "end_location": "Dallas, TX", "planner": "optimal"},
+        format="json",
+    )
+    assert response.status_code == 200
+    assert response.json() == {"fueling": {"total_cost": 12.5}}
+    assert seen["planner"] == "optimal" and seen["mpg"] == 10.0
+
+    response = client.post(
+        "/api/v1/route-plan/async/", {"start_location": "A", "end_location": "Nowhere"}, format="json"
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "No route found"
+
+    response = client.post("/api/v1/route-plan/async/", {"start_location": ""}, format="json")
+    assert response.status_code == 400
+    assert "end_location" in response.json()
+
+
+@pytest.mark.django_db
+def test_batch_route_plan_streams_ndjson(monkeypatch):
+    seen = []
+
+    def fake_batch(lanes):
+        seen.extend(lanes)
+        yield LanePlan(1, detail="No route found")
+        yield LanePlan(0, plan={"fueling": {"total_cost": 12.5}})
+
+    monkeypatch.setattr("route_planner.views.plan_route_batch", fake_batch)
+    client = APIClient()
+    response = client.post(
+        "/api/v1/route-plan/batch/",
+        {
+            "lanes": [
+                {"start_location": "Austin, TX", "end_location": "Dallas, TX"},
+                {"start_location": "A", "end_location": "B"},
+            ]
+        },
+        format="json",
+    )
+
+    assert response.status_code == 200
+    assert response["Content-Type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+    assert lines == [{"index": 1, "detail": "No route found"}, {"index": 0, "plan": {"fueling": {"total_cost": 12.5}}}]
+    assert seen[0]["mpg"] == 10.0
+
+    response = client.post("/api/v1/route-plan/batch/", {"lanes": []}, format="json")
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_batch_route_plan_streams_each_lane_under_asgi(monkeypatch, settings):
+    settings.ALLOWED_HOSTS = ["testserver"]
+    first_sent = threading.Event()
+
+    def fake_batch(lanes):
+        yield LanePlan(0, detail="first")
+        # Only finishes in time if the first line already reached the client, which buffering prevents.
+        yield LanePlan(1, detail="streamed" if first_sent.wait(timeout=5) else "buffered")
+
+    monkeypatch.setattr("route_planner.views.plan_route_batch", fake_batch)
+    body = json.dumps({"lanes": [{"start_location": "A", "end_location": "B"}] * 2}).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/api/v1/route-plan/batch/",
+        "query_string": b"",
+        "headers": [
+            (b"host", b"testserver"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+    requests = [{"type": "http.request", "body": body, "more_body": False}]
+    chunks = []
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        # The client stays connected until the response is complete.
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            chunks.append(json.loads(message["body"]))
+            first_sent.set()
+
+    async_to_sync(application)(scope, receive, send)
+
+    assert chunks == [{"index": 0, "detail": "first"}, {"index": 1, "detail": "streamed"}]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_route_plan_job_is_queued_and_long_polled(monkeypatch):
+    queued = []
+    monkeypatch.setattr("route_planner.views.is_route_plan_cached", lambda _data: False)
+    monkeypatch.setattr(
+        "route_planner.views.compute_route_plan_job.apply_async", lambda args, queue: queued.append((args, queue))
+    )
+    monkeypatch.setattr("route_planner.tasks.compute_route_plan", lambda **_kwargs: {"fueling": {"total_cost": 12.5}})
+    client = APIClient()
+
+    response = client.post(
+        "/api/v1/route-plan/jobs/", {"start_location": "Austin, TX", "end_location": "Dallas, TX"}, format="json"
+    )
+    assert response.status_code == 202
+    job_id = response.data["job_id"]
+    assert response.data["status"] == "pending"
+    assert queued == [([job_id], "celery")]
+
+    response = client.get(f"/api/v1/route-plan/jobs/{job_id}/")
+    assert response.json()["status"] == "pending"
+
+    worker = threading.Timer(0.2, lambda: tasks.compute_route_plan_job(job_id))
+    worker.start()
+    started = time.perf_counter()
+    response = client.get(f"/api/v1/route-plan/jobs/{job_id}/?wait=5")
+    worker.join()
+
+    assert time.perf_counter() - started < 2
+    assert response.json()["status"] == "completed"
+    assert response.json()["result"] == {"fueling": {"total_cost": 12.5}}
+    assert client.get(f"/api/v1/route-plan/jobs/{uuid.uuid4()}/").status_code == 404
+
+
+@pytest.mark.django_db
+def test_route_plan_job_answers_cached_plans_immediately(monkeypatch):
+    monkeypatch.setattr("route_planner.views.is_route_plan_cached", lambda _data: True)
+    monkeypatch.setattr("route_planner.views.compute_route_plan", lambda **_kwargs: {"fueling": {"total_cost": 3.0}})
+    client = APIClient()
+
+    response = client.post("/api/v1/route-plan/jobs/", {"start_location": "A", "end_location": "B"}, format="json")
+
+    assert response.status_code == 200
+    assert response.data["status"] == "completed"
+    assert response.data["result"] == {"fueling": {"total_cost": 3.0}}
+
+
+@pytest.mark.django_db
+def test_route_plan_reports_server_timing_and_logs_slow_requests(monkeypatch, settings, caplog):
+    def fake_compute(**_kwargs):
+        with instrumentation.stage("geocode"):
+            instrumentation.mark("geocode_cache", "miss")
+        with instrumentation.stage("plan"):
+            time.sleep(0.01)
+        instrumentation.mark("plan_cache", "miss")
+        return {"fueling": {"total_cost": 0}}
+
+    monkeypatch.setattr("route_planner.views.compute_route_plan", fake_compute)
+    client = APIClient()
+    payload = {"start_location": "Austin, TX", "end_location": "Dallas, TX"}
+
+    settings.ROUTE_TIMING_ENABLED = False
+    assert "Server-Timing" not in client.post("/api/v1/route-plan/", payload, format="json")
+
+    settings.ROUTE_TIMING_ENABLED = True
+    settings.ROUTE_SLOW_REQUEST_MS = 0
+    with caplog.at_level("WARNING", logger="route_planner.instrumentation"):
+        response = client.post("/api/v1/route-plan/", payload, format="json")
+
+    header = response["Server-Timing"]
+    assert "geocode;dur=" in header and 'plan_cache;desc="miss"' in header and "total;dur=" in header
+    record = json.loads(caplog.records[-1].getMessage())
+    assert record["event"] == "slow_request"
+    assert record["stages_ms"]["plan"] >= 10
+    assert record["cache"] == {"geocode_cache": "miss", "plan_cache": "miss"}
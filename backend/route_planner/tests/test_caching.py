@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+
+from route_planner import caching
+from route_planner.caching import LocalLRUCache, TieredCache
+
+
+def test_local_lru_evicts_least_recently_used():
+    local = LocalLRUCache(max_entries=2)
+    local.set("a", 1, timeout=60)
+    local.set("b", 2, timeout=60)
+    assert local.get("a") == 1
+    local.set("c", 3, timeout=60)
+
+    assert local.get("b") is None
+    assert local.get("a") == 1
+    assert local.get("c") == 3
+
+
+def test_local_lru_expires_entries(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(caching.time, "monotonic", lambda: now[0])
+    local = LocalLRUCache()
+    local.set("a", 1, timeout=5)
+
+    assert local.get("a") == 1
+    now[0] += 5
+    assert local.get("a", "missing") == "missing"
+    assert len(local) == 0
+
+
+def test_tiered_cache_serves_repeat_reads_locally():
+    tiered = TieredCache()
+    cache.delete("tiered:test")
+    tiered.set("tiered:test", {"value": 1}, timeout=60)
+
+    cache.delete("tiered:test")
+    assert tiered.get("tiered:test") == {"value": 1}
+
+    tiered.delete("tiered:test")
+    assert tiered.get("tiered:test") is None
+
+
+def test_station_generation_bump_is_visible_immediately_in_process():
+    caching.reset_local_caches()
+    before = caching.station_generation()
+
+    after = caching.bump_station_generation()
+
+    assert after == before + 1
+    assert caching.station_generation() == after
+
+
+def test_get_or_compute_runs_concurrent_misses_once():
+    caching.reset_local_caches()
+    cache.delete("single_flight:test")
+    calls = []
+    results = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"plan": 1}
+
+    threads = [
+        threading.Thread(target=lambda: results.append(caching.get_or_compute("single_flight:test", compute, 60)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"plan": 1}] * 5
+
+
+def test_get_or_compute_serves_stale_while_another_worker_refreshes(monkeypatch):
+    caching.reset_local_caches()
+    cache.delete("single_flight:stale")
+    caching.get_or_compute("single_flight:stale", lambda: "old", timeout=60, stale_timeout=600)
+    now = time.time()
+    monkeypatch.setattr(caching.time, "time", lambda: now + 120)
+
+    token = caching.single_flight.acquire("single_flight:stale")
+    assert caching.get_or_compute("single_flight:stale", lambda: "new", timeout=60, stale_timeout=600) == "old"
+
+    caching.single_flight.release("single_flight:stale", token)
+    assert caching.get_or_compute("single_flight:stale", lambda: "new", timeout=60, stale_timeout=600) == "new"
+    assert caching.get_or_compute("single_flight:stale", lambda: "newer", timeout=60, stale_timeout=600) == "new"
+
+
+def test_aget_or_compute_coalesces_coroutines():
+    caching.reset_local_caches()
+    cache.delete("single_flight:async")
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.2)
+        return 42
+
+    async def run():
+        return await asyncio.gather(*(caching.aget_or_compute("single_flight:async", compute, 60) for _ in range(4)))
+
+    assert async_to_sync(run)() == [42] * 4
+    assert len(calls) == 1
@@ -0,0 +1,60 @@
+import json
+import random
+from io import StringIO
+
+import pytest
+from django.core.management import CommandError, call_command
+
+from route_planner.management.commands.benchmark_route_planner import (
+    CORRIDORS,
+    encode_polyline6,
+    seed_corridor_stations,
+    synthetic_route,
+)
+from route_planner.services import decode_polyline6, haversine_miles
+
+
+def test_synthetic_route_round_trips_through_polyline6():
+    points = synthetic_route((32.7767, -96.7970), (32.7555, -97.3308), random.Random(0))
+
+    decoded = decode_polyline6(encode_polyline6(points))
+
+    assert len(decoded) == len(points)
+    assert max(abs(a - c) + abs(b - d) for (a, b), (c, d) in zip(points, decoded)) < 1e-5
+
+
+def test_seed_corridor_stations_puts_stations_along_every_corridor():
+    rows = [{"latitude": 0.0, "longitude": 0.0} for _ in range(500)]
+
+    seed_corridor_stations(rows, random.Random(0))
+
+    for start, end in CORRIDORS.values():
+        length = haversine_miles(start, end)
+        near = [
+            row
+            for row in rows
+            if haversine_miles(start, (row["latitude"], row["longitude"]))
+            + haversine_miles((row["latitude"], row["longitude"]), end)
+            < length + 5.0
+        ]
+        assert len(near) >= 5
+
+
+def test_benchmark_route_planner_saves_and_checks_baseline(tmp_path):
+    baseline = tmp_path / "baseline.json"
+    args = ["--scales", "0.05", "--routes", "metro", "--repeat", "1", "--baseline", str(baseline)]
+
+    stdout = StringIO()
+    call_command("benchmark_route_planner", *args, "--save-baseline", stdout=stdout)
+    assert "metro: 31 miles" in stdout.getvalue()
+    assert " 0 stations" not in stdout.getvalue()
+    assert "no feasible fuel plan" not in stdout.getvalue()
+    results = json.loads(baseline.read_text())["results"]
+    assert "x0.05/metro/compute_cold" in results
+    assert results["x0.05/metro/decode"]["peak_kib"] > 0
+
+    for result in results.values():
+        result["median_ms"] = 1e-6
+    baseline.write_text(json.dumps({"meta": {}, "results": results}))
+    with pytest.raises(CommandError, match="slower than the baseline"):
+        call_command("benchmark_route_planner", *args, "--no-memory", "--min-delta-ms", "0", stdout=StringIO())
@@ -0,0 +1,122 @@
+import random
+
+import pytest
+from django.core.cache import cache
+
+from route_planner import corridors, services
+from route_planner.caching import reset_local_caches
+from route_planner.models import FuelStation, StationCorridorCell
+from route_planner.snapshot import StationSnapshot
+
+
+def _rows(count, seed=3):
+    rng = random.Random(seed)
+    return [
+        {
+            "id": i,
+            "latitude": 33.0 + rng.random() * 3,
+            "longitude": -99.0 + rng.random() * 4,
+            "retail_price": round(3 + rng.random(), 3),
+        }
+        for i in range(count)
+    ]
+
+
+def _markers():
+    return services.build_route_markers(
+        services.simplify_route_points([(33.2 + i * 0.01, -98.8 + i * 0.013 + (i % 9) * 0.002) for i in range(260)])
+    )
+
+
+def test_corridor_table_matches_grid_index():
+    snapshot = StationSnapshot.from_rows(1, _rows(1500))
+    table = corridors.CorridorTable.from_snapshot(snapshot, 0.1, 10.0)
+    grid = snapshot.grid_index()
+    markers = _markers()
+
+    def in_range(nearest, distance):
+        # The matchers also report stations beyond the distance; callers drop those.
+        return {position: match for position, match in nearest.items() if match[0] <= distance}
+
+    for distance in (2.0, 10.0):
+        for matcher in (services._match_stations_to_segments, services._match_stations_to_markers):
+            expected = in_range(matcher(grid, markers, distance), distance)
+            assert expected
+            assert in_range(matcher(table, markers, distance), distance) == expected
+
+
+def _create_stations(rows):
+    for row in rows:
+        FuelStation.objects.create(
+            opis_id=row["id"],
+            truckstop_name=f"Stop {row['id']}",
+            address="x",
+            city="y",
+            state="TX",
+            rack_id=1,
+            retail_price=row["retail_price"],
+            latitude=row["latitude"],
+            longitude=row["longitude"],
+        )
+
+
+def _stored_cells():
+    return {cell.cell: bytes(cell.station_ids) for cell in StationCorridorCell.objects.all()}
+
+
+@pytest.mark.django_db
+def test_incremental_refresh_matches_full_rebuild():
+    rows = _rows(120)
+    _create_stations(rows[:100])
+    assert corridors.refresh_station_corridors([]) > 0
+
+    before = set(FuelStation.objects.values_list("id", flat=True))
+    _create_stations(rows[100:])
+    added = FuelStation.objects.exclude(id__in=before).values_list("id", flat=True)
+    corridors.refresh_station_corridors(added)
+    incremental = _stored_cells()
+
+    corridors.refresh_station_corridors()
+    assert incremental == _stored_cells()
+
+
+@pytest.mark.django_db
+def test_stations_on_route_reads_stored_corridor_table(settings, monkeypatch):
+    cache.clear()
+    reset_local_caches()
+    _create_stations(_rows(300))
+    route = services.RouteResult(200.0, 7200.0, "table", "polyline6")
+    route.markers = _markers()
+    expected = services.stations_on_route(route, 8.0)
+
+    settings.ROUTE_GEOMETRY_ENGINE = "python"
+    settings.ROUTE_CORRIDOR_TABLE_ENABLED = True
+    monkeypatch.setattr(corridors, "_table", None)
+    assert corridors.corridor_table(services.get_station_snapshot()) is None
+    corridors.refresh_station_corridors()
+    services.invalidate_station_cache()
+    # The stations did not move, so drop the cached matches to match again through the table.
+    cache.delete_many(list(cache.iter_keys(f"{services.ROUTE_MATCH_KEY_PREFIX}:*")))
+    reset_local_caches()
+
+    matched = []
+    original = services._match_stations_to_segments
+    monkeypatch.setattr(
+        services, "_match_stations_to_segments", lambda index, *args: matched.append(index) or original(index, *args)
+    )
+    assert services.stations_on_route(route, 8.0) == expected
+    assert isinstance(matched[0], corridors.CorridorTable)
+
+
+@pytest.mark.django_db
+def test_corridor_table_is_not_loaded_for_the_numpy_engine(settings, monkeypatch, django_assert_num_queries):
+    pytest.importorskip("numpy")
+    _create_stations(_rows(50))
+    corridors.refresh_station_corridors()
+    settings.ROUTE_CORRIDOR_TABLE_ENABLED = True
+    settings.ROUTE_GEOMETRY_ENGINE = "numpy"
+    monkeypatch.setattr(corridors, "_table", None)
+    snapshot = StationSnapshot.from_rows(1, [])
+
+    with django_assert_num_queries(0):
+        assert corridors.corridor_table(snapshot) is None
@@ -0,0 +1,102 @@
+import random
+
+import pytest
+
+from route_planner import services
+from route_planner.snapshot import StationSnapshot
+
+pytest.importorskip("numpy")
+
+
+def _random_route(seed, count=2000):
+    rng = random.Random(seed)
+    lat, lon = 34.0, -118.0
+    points = []
+    for _ in range(count):
+        lat += rng.uniform(-0.002, 0.006)
+        lon += rng.uniform(0.0, 0.01)
+        points.append((round(lat, 6), round(lon, 6)))
+    return points
+
+
+def _random_stations(seed, route, count=600):
+    rng = random.Random(seed)
+    stations = []
+    for station_id in range(count):
+        lat, lon = route[rng.randrange(len(route))]
+        stations.append(
+            {
+                "id": station_id,
+                "latitude": lat + rng.uniform(-0.3, 0.3),
+                "longitude": lon + rng.uniform(-0.3, 0.3),
+                "retail_price": round(rng.uniform(2.8, 4.5), 3),
+            }
+        )
+    return stations
+
+
+def _encode_polyline6(points):
+    encoded = []
+    previous = (0, 0)
+    for point in points:
+        current = (round(point[0] * 1e6), round(point[1] * 1e6))
+        for value in (current[0] - previous[0], current[1] - previous[1]):
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                encoded.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            encoded.append(chr(value + 63))
+        previous = current
+    return "".join(encoded)
+
+
+def _run_both(settings, func, *args, **kwargs):
+    settings.ROUTE_GEOMETRY_ENGINE = "python"
+    scalar = func(*args, **kwargs)
+    settings.ROUTE_GEOMETRY_ENGINE = "numpy"
+    vectorized = func(*args, **kwargs)
+    return scalar, vectorized
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_simplify_route_points_engines_agree(settings, seed):
+    route = _random_route(seed)
+    for min_miles in (0.25, 1.0, 5.0):
+        scalar, vectorized = _run_both(settings, services.simplify_route_points, route, min_miles=min_miles)
+        assert scalar == vectorized
+
+
+def test_decode_polyline6_engines_agree(settings):
+    route = _random_route(7)
+    scalar, vectorized = _run_both(settings, services.decode_polyline6, _encode_polyline6(route))
+
+    assert scalar == vectorized == route
+    for engine in ("python", "numpy"):
+        settings.ROUTE_GEOMETRY_ENGINE = engine
+        with pytest.raises(ValueError):
+            services.decode_polyline6("_izlhA~rlgdF_")
+
+
+def test_build_route_markers_engines_agree(settings):
+    route = services.simplify_route_points(_random_route(4))
+    scalar, vectorized = _run_both(settings, services.build_route_markers, route)
+
+    assert len(scalar) == len(vectorized)
+    for (lat_a, lon_a, miles_a), (lat_b, lon_b, miles_b) in zip(scalar, vectorized):
+        assert (lat_a, lon_a) == (lat_b, lon_b)
+        assert miles_a == pytest.approx(miles_b, rel=1e-9)
+
+
+@pytest.mark.parametrize("mode", ["vertex", "projection"])
+@pytest.mark.parametrize("seed", [5, 6])
+def test_find_stations_on_route_engines_agree(settings, monkeypatch, seed, mode):
+    route = _random_route(seed)
+    snapshot = StationSnapshot.from_rows(1, _random_stations(seed, route))
+    monkeypatch.setattr("route_planner.services.get_station_snapshot", lambda: snapshot)
+
+    scalar, vectorized = _run_both(settings, services.find_stations_on_route, route, max_distance_miles=10.0, mode=mode)
+
+    assert [s.station_data["id"] for s in scalar] == [s.station_data["id"] for s in vectorized]
+    for a, b in zip(scalar, vectorized):
+        assert a.mile_marker == pytest.approx(b.mile_marker, rel=1e-9)
+        assert a.distance_to_route == pytest.approx(b.distance_to_route, rel=1e-9, abs=1e-9)
@@ -0,0 +1,49 @@
+import pytest
+
+from route_planner.http_client import HTTPStatusError, PooledHTTPClient
+from route_planner.tests.stubs import StubMapboxServer
+
+
+def test_client_reuses_keep_alive_connection_and_decodes_gzip():
+    client = PooledHTTPClient()
+    with StubMapboxServer(compress=True) as server:
+        results = [client.get_json(f"{server.url}/geocoding/Austin%20TX.json?limit=1") for _ in range(5)]
+    client.close()
+
+    assert server.connections == 1
+    assert len(server.paths) == 5
+    assert all(result["features"][0]["place_name"] == "Austin TX" for result in results)
+
+
+def test_client_retries_throttled_and_failed_responses(settings):
+    settings.MAPBOX_HTTP_BACKOFF_SECONDS = 0
+    settings.MAPBOX_HTTP_MAX_RETRIES = 2
+    statuses = [429, 503, 200, 500, 500, 500]
+
+    def responder(_path):
+        return statuses.pop(0), {"ok": True}
+
+    client = PooledHTTPClient()
+    with StubMapboxServer(responder=responder) as server:
+        assert client.get_json(f"{server.url}/directions") == {"ok": True}
+        with pytest.raises(HTTPStatusError) as excinfo:
+            client.get_json(f"{server.url}/directions")
+    client.close()
+
+    assert excinfo.value.status == 500
+    assert len(server.paths) == 6
+    assert statuses == []
+
+
+def test_client_reconnects_when_idle_connection_was_closed():
+    client = PooledHTTPClient()
+    with StubMapboxServer() as server:
+        client.get_json(f"{server.url}/geocoding/a.json")
+        # Simulate the server timing out the idle keep-alive connection.
+        for pool in client._pools.values():
+            for connection in list(pool.queue):
+                connection.sock.shutdown(2)
+        assert client.get_json(f"{server.url}/geocoding/b.json")["features"][0]["place_name"] == "b"
+    client.close()
+
+    assert server.connections == 2
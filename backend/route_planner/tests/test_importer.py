@@ -0,0 +1,111 @@
+import pytest
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from route_planner.caching import reset_local_caches
+from route_planner.importer import SharedTokenBucket, TokenBucket, normalize_address
+from route_planner.models import FuelStation, FuelStationUploadJob, GeocodedAddress
+from route_planner.spatial import station_cell
+from route_planner.tasks import process_fuel_station_csv
+
+from .stubs import StubMapboxServer
+
+
+def test_token_bucket_throttles_to_rate():
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    bucket = TokenBucket(rate_per_second=2.0, capacity=2, clock=lambda: now[0], sleep=sleep)
+    for _ in range(6):
+        bucket.acquire()
+
+    # Two tokens are available up front; the remaining four arrive at 2 per second.
+    assert now[0] == pytest.approx(2.0)
+    assert all(seconds > 0 for seconds in sleeps)
+
+
+def test_shared_token_bucket_is_shared_across_buckets():
+    cache.clear()
+    now = [100.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    # Two chunks on different workers, each with its own bucket object.
+    buckets = [SharedTokenBucket(2.0, key="test:rate", clock=lambda: now[0], sleep=sleep) for _ in range(2)]
+    for _ in range(3):
+        for bucket in buckets:
+            bucket.acquire()
+
+    # Six tokens at 2 per second between them: two in each of three windows.
+    assert now[0] == pytest.approx(102.0)
+    assert sleeps == [pytest.approx(1.0), pytest.approx(1.0)]
+
+
+@pytest.mark.django_db
+def test_import_geocodes_concurrently_against_stub_server(tmp_path, settings):
+    cache.clear()
+    reset_local_caches()
+    settings.MEDIA_ROOT = tmp_path
+    settings.FUEL_STATION_IMPORT_BATCH_SIZE = 3
+    settings.FUEL_STATION_GEOCODE_CONCURRENCY = 4
+    settings.FUEL_STATION_GEOCODE_RATE_PER_SECOND = 0
+
+    rows = "".join(f"{i},Stop {i},{i} Main St,Testville,TX,{i},3.{i}0\n" for i in range(1, 9))
+    csv_content = "OPIS Truckstop ID,Truckstop Name,Address,City,State,Rack ID,Retail Price\n" + rows
+    saved_path = default_storage.save("uploads/concurrent.csv", ContentFile(csv_content.encode("utf-8")))
+    job = FuelStationUploadJob.objects.create(file_path=saved_path, original_filename="concurrent.csv")
+
+    with StubMapboxServer(delay=0.05) as server:
+        settings.MAPBOX_GEOCODING_URL = f"{server.url}/geocoding/v5/mapbox.places"
+        process_fuel_station_csv(job.id)
+
+    job.refresh_from_db()
+    assert job.status == FuelStationUploadJob.STATUS_COMPLETED
+    assert job.geocoded_count == 8
+    assert job.failed_count == 0
+    assert len(server.paths) == 8
+    assert 1 < server.max_in_flight <= 4
+    assert FuelStation.objects.filter(latitude__isnull=True).count() == 0
+
+
+def test_normalize_address_ignores_case_and_punctuation():
+    assert normalize_address("I-44, Exit 4", "Joplin", "MO") == normalize_address("i-44 EXIT 4.", "JOPLIN", "mo")
+
+
+@pytest.mark.django_db
+def test_import_geocodes_each_address_once_and_reuses_store(tmp_path, settings):
+    cache.clear()
+    reset_local_caches()
+    settings.MEDIA_ROOT = tmp_path
+    settings.FUEL_STATION_GEOCODE_RATE_PER_SECOND = 0
+    GeocodedAddress.objects.create(normalized_address="9 DEPOT RD TESTVILLE TX", latitude=29.0, longitude=-96.0)
+
+    csv_content = (
+        "OPIS Truckstop ID,Truckstop Name,Address,City,State,Rack ID,Retail Price\n"
+        "1243,PILOT #1243,\"I-40, Exit 7\",Amarillo,TX,1,3.10\n"
+        "1243,PILOT TRAVEL CENTER #1243,I-40 EXIT 7,Amarillo,TX,2,3.20\n"
+        "77,Depot,9 Depot Rd.,Testville,TX,3,3.30\n"
+    )
+    saved_path = default_storage.save("uploads/dedupe.csv", ContentFile(csv_content.encode("utf-8")))
+    job = FuelStationUploadJob.objects.create(file_path=saved_path, original_filename="dedupe.csv")
+
+    with StubMapboxServer() as server:
+        settings.MAPBOX_GEOCODING_URL = f"{server.url}/geocoding/v5/mapbox.places"
+        process_fuel_station_csv(job.id)
+
+    job.refresh_from_db()
+    assert job.geocoded_count == 3
+    assert len(server.paths) == 1
+    assert GeocodedAddress.objects.filter(normalized_address="I-40 EXIT 7 AMARILLO TX").exists()
+    assert FuelStation.objects.get(opis_id=77).latitude == 29.0
+    assert FuelStation.objects.get(opis_id=77).grid_cell == station_cell(29.0, -96.0)
+    pilots = FuelStation.objects.filter(opis_id=1243)
+    assert {(s.latitude, s.longitude) for s in pilots} == {(pilots[0].latitude, pilots[0].longitude)}
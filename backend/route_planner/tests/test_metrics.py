@@ -0,0 +1,76 @@
+import pytest
+from celery.signals import task_postrun
+from django.core.signals import request_finished
+from rest_framework.test import APIClient
+
+from route_planner import metrics
+from route_planner.metrics import MetricsBuffer
+
+
+def test_metrics_from_separate_processes_are_summed(settings):
+    settings.METRICS_FLUSH_SECONDS = 3600
+    metrics.reset()
+    web, worker = MetricsBuffer(), MetricsBuffer()
+
+    web.increment('route_planner_cache_requests_total{layer="geocode",result="hit"}')
+    worker.increment('route_planner_cache_requests_total{layer="geocode",result="hit"}', 2)
+    web.observe("route_planner_mapbox_request_seconds", {"endpoint": "geocode"}, 0.2)
+    worker.observe("route_planner_mapbox_request_seconds", {"endpoint": "geocode"}, 3.0)
+    worker.set_gauge("route_planner_station_count", 8151)
+    assert "geocode" not in metrics.render()
+
+    web.flush()
+    worker.flush()
+    lines = metrics.render().splitlines()
+
+    assert 'route_planner_cache_requests_total{layer="geocode",result="hit"} 3' in lines
+    assert "route_planner_station_count 8151" in lines
+    buckets = [line for line in lines if line.startswith("route_planner_mapbox_request_seconds_bucket")]
+    assert len(buckets) == len(metrics.LATENCY_BUCKETS) + 1
+    assert buckets[0] == 'route_planner_mapbox_request_seconds_bucket{endpoint="geocode",le="0.005"} 0'
+    assert 'route_planner_mapbox_request_seconds_bucket{endpoint="geocode",le="0.25"} 1' in buckets
+    assert 'route_planner_mapbox_request_seconds_bucket{endpoint="geocode",le="5.0"} 2' in buckets
+    assert buckets[-1] == 'route_planner_mapbox_request_seconds_bucket{endpoint="geocode",le="+Inf"} 2'
+    assert 'route_planner_mapbox_request_seconds_count{endpoint="geocode"} 2' in lines
+    assert "# TYPE route_planner_route_plan_seconds histogram" in lines
+
+
+@pytest.mark.django_db
+def test_metrics_are_flushed_by_interval_after_requests_and_always_after_tasks(settings):
+    settings.METRICS_FLUSH_SECONDS = 3600
+    metrics.reset()
+    sample = 'route_planner_import_jobs_total{mode="full",status="completed"}'
+
+    def stored():
+        # Read Redis directly; render() would flush the buffer itself.
+        return float(metrics._redis().hget(metrics.METRICS_KEY, sample) or 0)
+
+    metrics.inc("route_planner_import_jobs_total", mode="full", status="completed")
+    request_finished.send(sender=None)
+    assert stored() == 0
+
+    settings.METRICS_FLUSH_SECONDS = 0
+    request_finished.send(sender=None)
+    assert stored() == 1
+
+    # Pool processes leave with os._exit, so the buffer must be empty once a task is done.
+    settings.METRICS_FLUSH_SECONDS = 3600
+    metrics.inc("route_planner_import_jobs_total", mode="full", status="completed")
+    task_postrun.send(sender=None)
+    assert stored() == 2
+
+
+@pytest.mark.django_db
+def test_metrics_endpoint_requires_configured_token(settings):
+    metrics.reset()
+    metrics.inc("route_planner_import_jobs_total", mode="full", status="completed")
+    client = APIClient()
+
+    response = client.get("/api/v1/metrics/")
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert 'route_planner_import_jobs_total{mode="full",status="completed"} 1' in response.content.decode()
+
+    settings.METRICS_TOKEN = "secret"
+    assert client.get("/api/v1/metrics/").status_code == 403
+    assert client.get("/api/v1/metrics/", HTTP_AUTHORIZATION="Bearer secret").status_code == 200
@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+from route_planner.services import (
+    RoutePlannerError,
+    StationOnRoute,
+    plan_fuel_stops,
+    plan_fuel_stops_optimal,
+)
+
+
+def _start(price=4.0):
+    return StationOnRoute(None, price, 0.0, 0.0, 0.0, 0.0, virtual=True)
+
+
+def _station(opis_id, price, mile, detour_miles=0.0):
+    return StationOnRoute({"opis_id": opis_id}, price, mile, detour_miles / 2, 0.0, 0.0)
+
+
+@pytest.mark.parametrize("engine", ["python", "numpy"])
+def test_optimal_matches_greedy_without_detours(settings, engine):
+    if engine == "numpy":
+        pytest.importorskip("numpy")
+    settings.ROUTE_GEOMETRY_ENGINE = engine
+    rng = random.Random(7)
+    for _ in range(200):
+        total_miles = rng.uniform(200.0, 1500.0)
+        stations = [
+            _station(i, round(rng.uniform(2.9, 4.2), 3), mile)
+            for i, mile in enumerate(
+                sorted(rng.uniform(1.0, total_miles - 1) for _ in range(rng.randint(10, 80)))
+            )
+        ]
+        mpg = rng.choice([6.0, 8.0, 10.0])
+        max_range = rng.choice([300.0, 500.0])
+        try:
+            _, greedy_cost, greedy_gallons = plan_fuel_stops(stations, total_miles, mpg, max_range, _start())
+        except RoutePlannerError:
+            continue
+        _, optimal_cost, optimal_gallons = plan_fuel_stops_optimal(stations, total_miles, mpg, max_range, _start())
+
+        # Greedy is exact when detours are free, and the solver re-buys exact gallons after the tank
+        # levels pick the stops, so discretization never leaves it behind.
+        assert optimal_cost == pytest.approx(greedy_cost, abs=0.01)
+        assert optimal_gallons == pytest.approx(greedy_gallons, abs=0.01)
+
+
+def test_optimal_skips_cheap_station_with_long_detour():
+    stations = [_station(1, 3.0, 100.0, detour_miles=60.0), _station(2, 3.2, 120.0)]
+
+    stops, cost, gallons = plan_fuel_stops_optimal(stations, 300.0, 10.0, 500.0, _start(4.0))
+    greedy_stops, *_ = plan_fuel_stops(stations, 300.0, 10.0, 500.0, _start(4.0))
+
+    assert [stop["station"]["opis_id"] for stop in greedy_stops if stop["station"]] == [1]
+    assert [stop["station"]["opis_id"] for stop in stops if stop["station"]] == [2]
+    assert gallons == pytest.approx(30.0)
+    assert cost == pytest.approx(12 * 4.0 + 18 * 3.2)
+
+
+def test_optimal_respects_stop_limit_and_minimum_purchase():
+    stations = [_station(i, 3.0 + (i % 2) * 0.4, 90.0 * i) for i in range(1, 11)]
+
+    stops, _, _ = plan_fuel_stops_optimal(
+        stations, 1000.0, 10.0, 400.0, _start(), max_stops=3, min_purchase_gallons=25.0
+    )
+
+    en_route = [stop for stop in stops if not stop["virtual"]]
+    assert len(en_route) <= 3
+    assert all(stop["gallons"] >= 25.0 for stop in en_route)
+
+    with pytest.raises(RoutePlannerError):
+        plan_fuel_stops_optimal(stations, 1000.0, 10.0, 400.0, _start(), max_stops=1)
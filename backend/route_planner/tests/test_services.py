@@ -1,18 +1,41 @@
+import random
+import threading
+
 import pytest
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
 
+from route_planner import services
+from route_planner.caching import is_cached, reset_local_caches
+from route_planner.models import FuelStation
 from route_planner.services import (
+    GeocodeResult,
+    RouteResult,
     StationOnRoute,
+    build_route_markers,
     choose_start_price,
+    find_stations_on_route,
     haversine_miles,
+    next_cheaper_within_range,
     plan_fuel_stops,
     simplify_route_points,
 )
+from route_planner.snapshot import StationSnapshot
 
 
 def test_haversine_zero_distance():
     assert haversine_miles((0.0, 0.0), (0.0, 0.0)) == 0.0
 
 
+def test_route_result_decodes_coordinates_lazily(monkeypatch):
+    route = RouteResult(10.0, 60.0, "_izlhA~rlgdF_{geC~ywl@_kwzCn`{nI", "polyline6")
+    assert "coordinates" not in vars(route)
+
+    assert route.coordinates == [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    monkeypatch.setattr("route_planner.services.decode_polyline6", lambda _polyline: pytest.fail("decoded twice"))
+    assert len(route.coordinates) == 3
+
+
 def test_simplify_route_points_removes_close_points():
     points = [(0.0, 0.0), (0.02, 0.0), (0.3, 0.0)]
     simplified = simplify_route_points(points, min_miles=10.0)
@@ -95,3 +118,310 @@ def test_plan_fuel_stops_basic(total_miles, expected_cost):
     assert total_cost == expected_cost
     assert total_gallons == 25.0
     assert len(stops) == 3
+
+
+def test_find_stations_on_route_matches_full_scan(monkeypatch):
+    route = [(32.0 + i * 0.01, -97.0 + i * 0.015) for i in range(300)]
+    stations = [
+        {
+            "id": i,
+            "latitude": 32.0 + (i % 40) * 0.08,
+            "longitude": -97.0 + (i // 40) * 0.12,
+            "retail_price": 3.0 + (i % 7) / 10,
+        }
+        for i in range(400)
+    ]
+    snapshot = StationSnapshot.from_rows(1, stations)
+    monkeypatch.setattr("route_planner.services.get_station_snapshot", lambda: snapshot)
+
+    matched = find_stations_on_route(route, max_distance_miles=10.0, mode="vertex")
+
+    markers = build_route_markers(simplify_route_points(route))
+    expected = []
+    for station in stations:
+        distances = [haversine_miles((station["latitude"], station["longitude"]), (m[0], m[1])) for m in markers]
+        best = min(range(len(markers)), key=lambda i: distances[i])
+        if distances[best] <= 10.0:
+            expected.append((station["id"], markers[best][2], distances[best]))
+    expected.sort(key=lambda item: item[1])
+
+    assert [(s.station_data["id"], s.mile_marker, s.distance_to_route) for s in matched] == expected
+
+
+def test_find_stations_on_route_projection_interpolates_along_segment(monkeypatch):
+    route = [(35.0, -100.0), (35.0, -99.0)]
+    snapshot = StationSnapshot.from_rows(1, [{"id": 1, "latitude": 35.02, "longitude": -99.5, "retail_price": 3.0}])
+    monkeypatch.setattr("route_planner.services.get_station_snapshot", lambda: snapshot)
+
+    vertex = find_stations_on_route(route, max_distance_miles=40.0, mode="vertex")
+    projected = find_stations_on_route(route, max_distance_miles=40.0, mode="projection")
+
+    segment_miles = haversine_miles(route[0], route[1])
+    assert vertex[0].mile_marker == 0.0
+    assert vertex[0].distance_to_route > 25.0
+    assert projected[0].mile_marker == pytest.approx(segment_miles / 2, abs=0.1)
+    assert projected[0].distance_to_route == pytest.approx(haversine_miles((35.02, -99.5), (35.0, -99.5)), abs=0.01)
+
+
+def _scan_next_cheaper(stops, max_range_miles):
+    # The original quadratic forward scan from plan_fuel_stops, kept as the reference.
+    result = []
+    for index, stop in enumerate(stops):
+        max_reach = stop.mile_marker + max_range_miles
+        found = None
+        for later_index in range(index + 1, len(stops)):
+            if stops[later_index].mile_marker > max_reach:
+                break
+            if stops[later_index].price < stop.price:
+                found = later_index
+                break
+        result.append(found)
+    return result
+
+
+def test_next_cheaper_within_range_matches_forward_scan():
+    rng = random.Random(1234)
+    for _ in range(300):
+        total_miles = rng.uniform(50.0, 3000.0)
+        # Coarse prices give plenty of ties; markers may overshoot the route distance a little.
+        markers = sorted(rng.uniform(0.0, total_miles * 1.02) for _ in range(rng.randint(0, 120)))
+        stops = [StationOnRoute(None, rng.choice([3.0, 3.1, 3.2, 3.5]), 0.0, 0.0, 0.0, 0.0, virtual=True)]
+        stops += [StationOnRoute({}, rng.choice([2.9, 3.0, 3.1, 3.2, 3.5]), m, 0.0, 0.0, 0.0) for m in markers]
+        stops.append(StationOnRoute(None, 0.0, total_miles, 0.0, 0.0, 0.0, virtual=True))
+        max_range_miles = rng.choice([25.0, 100.0, 500.0, 5000.0])
+
+        assert next_cheaper_within_range(stops, max_range_miles) == _scan_next_cheaper(stops, max_range_miles)
+
+
+def test_acompute_route_plan_overlaps_lookups_and_matches_sync(monkeypatch):
+    cache.clear()
+    reset_local_caches()
+    route = [(30.0, -97.0 + i * 0.05) for i in range(60)]
+    snapshot = StationSnapshot.from_rows(
+        1, [{"id": i, "latitude": 30.01, "longitude": -97.0 + i * 0.5, "retail_price": 3.0 + i / 10} for i in range(6)]
+    )
+
+    # Each pair of calls only gets past its barrier if both run at the same time.
+    geocodes, lookups = threading.Barrier(2, timeout=5), threading.Barrier(2, timeout=5)
+
+    def together(barrier, result):
+        calls = []
+
+        def call(*_args):
+            # Only the first load waits, like a snapshot that is then held in process.
+            if not calls:
+                calls.append(1)
+                barrier.wait()
+            return result
+
+        return call
+
+    def located(query):
+        return GeocodeResult(latitude=30.0, longitude=-97.0 if query == "A" else -94.05, place_name=query, is_us=True)
+
+    def geocode(query):
+        geocodes.wait()
+        return located(query)
+
+    monkeypatch.setattr(services, "geocode_location", geocode)
+    monkeypatch.setattr(services, "get_route", together(lookups, RouteResult(180.0, 9000.0, "poly", "polyline6")))
+    monkeypatch.setattr(services, "get_station_snapshot", together(lookups, snapshot))
+    monkeypatch.setattr(RouteResult, "coordinates", route)
+    options = {"max_range_miles": 500, "mpg": 10.0, "max_station_distance_miles": 5.0}
+
+    result = async_to_sync(services.acompute_route_plan)("A", "B", **options)
+
+    monkeypatch.setattr(services, "geocode_location", located)
+    cache.clear()
+    reset_local_caches()
+    assert services.compute_route_plan("A", "B", **options) == result
+
+
+def test_acompute_route_plan_does_not_store_plans_from_an_older_snapshot(monkeypatch):
+    cache.clear()
+    reset_local_caches()
+    rows = [{"id": i, "latitude": 30.01, "longitude": -97.0 + i * 0.5, "retail_price": 3.0 + i / 10} for i in range(6)]
+    # Another worker holds the rebuild lock for generation 2, so this process still plans on version 1.
+    snapshot = StationSnapshot.from_rows(1, rows)
+    monkeypatch.setattr(services, "station_generation", lambda: 2)
+    monkeypatch.setattr(services, "get_station_snapshot", lambda: snapshot)
+    monkeypatch.setattr(
+        services,
+        "geocode_location",
+        lambda query: GeocodeResult(
+            latitude=30.0, longitude=-97.0 if query == "A" else -94.05, place_name=query, is_us=True
+        ),
+    )
+    monkeypatch.setattr(services, "get_route", lambda *_args: RouteResult(180.0, 9000.0, "poly", "polyline6"))
+    monkeypatch.setattr(RouteResult, "coordinates", [(30.0, -97.0 + i * 0.05) for i in range(60)])
+    options = {"max_range_miles": 500, "mpg": 10.0, "max_station_distance_miles": 5.0}
+    lane = {"start_location": "A", "end_location": "B", **options}
+    key = services._route_plan_key("A", "B", services._plan_options(lane), 2)
+
+    async_to_sync(services.acompute_route_plan)("A", "B", **options)
+    assert not is_cached(key)
+
+    snapshot = StationSnapshot.from_rows(2, rows)
+    async_to_sync(services.acompute_route_plan)("A", "B", **options)
+    assert is_cached(key)
+
+
+def test_get_route_reuses_cached_directions_for_nearby_endpoints(monkeypatch):
+    cache.clear()
+    reset_local_caches()
+    calls = []
+
+    def fake_fetch(url, timeout=None):
+        calls.append(url)
+        return {"routes": [{"geometry": "_izlhA~rlgdF_{geC~ywl@_kwzCn`{nI", "distance": 160934.4, "duration": 5400}]}
+
+    monkeypatch.setattr(services, "_fetch_json", fake_fetch)
+
+    first = services.get_route((32.77671, -96.79701), (30.26722, -97.74306))
+    reset_local_caches()
+    second = services.get_route((32.77668, -96.79698), (30.26719, -97.74301))
+
+    assert len(calls) == 1
+    assert "coordinates" not in vars(second)
+    assert second.markers == first.markers
+    assert (second.distance_miles, second.duration_seconds, second.geometry) == (100.0, 5400.0, first.geometry)
+
+    services.get_route((32.78, -96.79701), (30.26722, -97.74306))
+    assert len(calls) == 2
+
+
+def test_stations_on_route_caches_matches_per_station_layout(monkeypatch):
+    cache.clear()
+    reset_local_caches()
+    route = RouteResult(60.0, 3600.0, "route-a", "polyline6")
+    route.markers = services.build_route_markers([(35.0, -100.0), (35.0, -99.5), (35.0, -99.0)])
+    rows = [
+        {"id": i, "latitude": 35.0 + (i % 2) * 0.02, "longitude": -99.9 + i * 0.2, "retail_price": 3.0}
+        for i in range(5)
+    ]
+    snapshot = StationSnapshot.from_rows(4, rows)
+    monkeypatch.setattr(services, "get_station_snapshot", lambda: snapshot)
+    expected = services.match_stations_to_route(route.markers, 5.0)
+    matches = []
+    original = services._route_matches
+    monkeypatch.setattr(services, "_route_matches", lambda *args: matches.append(1) or original(*args))
+
+    first = services.stations_on_route(route, 5.0)
+    again = services.stations_on_route(route, 5.0)
+    assert len(matches) == 1
+    assert again == first == expected
+    assert len(first) == 5
+
+    # A price-only refresh keeps the layout, so the cached matches are reused with the new prices.
+    snapshot = snapshot.with_prices(5, {2: 2.5})
+    repriced = services.stations_on_route(route, 5.0)
+    assert len(matches) == 1
+    assert [s.price for s in repriced] == [2.5 if s.station_data["id"] == 2 else 3.0 for s in first]
+
+    services.stations_on_route(route, 2.0)
+    snapshot = StationSnapshot.from_rows(6, rows)
+    services.stations_on_route(route, 5.0)
+    assert len(matches) == 2
+
+    # A layout rebuilt from changed stations misses, even under the same version.
+    snapshot = StationSnapshot.from_rows(6, rows[1:])
+    assert len(services.stations_on_route(route, 5.0)) == 4
+    assert len(matches) == 3
+
+
+def test_plan_route_batch_dedupes_lookups_and_reports_lane_errors(monkeypatch):
+    cache.clear()
+    reset_local_caches()
+    snapshot = StationSnapshot.from_rows(
+        1, [{"id": i, "latitude": 30.01, "longitude": -97.0 + i * 0.5, "retail_price": 3.0 + i / 10} for i in range(6)]
+    )
+    geocoded = []
+    routed = []
+
+    def geocode(query):
+        geocoded.append(query)
+        if query == "Nowhere":
+            raise services.RoutePlannerError("No geocoding result found.")
+        return GeocodeResult(latitude=30.0, longitude=-97.0 if query == "A" else -94.05, place_name=query, is_us=True)
+
+    def route(start, end):
+        routed.append((start, end))
+        return RouteResult(180.0, 9000.0, "poly", "polyline6")
+
+    monkeypatch.setattr(services, "geocode_location", geocode)
+    monkeypatch.setattr(services, "get_route", route)
+    monkeypatch.setattr(services, "get_station_snapshot", lambda: snapshot)
+    monkeypatch.setattr(RouteResult, "coordinates", [(30.0, -97.0 + i * 0.05) for i in range(60)])
+    options = {"max_range_miles": 500, "mpg": 10.0, "max_station_distance_miles": 5.0}
+    lanes = [
+        {"start_location": "A", "end_location": "B", **options},
+        {"start_location": "a ", "end_location": "B", **options, "planner": "optimal"},
+        {"start_location": "A", "end_location": "Nowhere", **options},
+    ]
+
+    results = {lane.index: lane for lane in services.plan_route_batch(lanes)}
+
+    assert sorted(geocoded) == ["A", "B", "Nowhere"]
+    assert len(routed) == 1
+    assert results[2].plan is None and results[2].detail == "No geocoding result found."
+    assert results[0].plan == services.compute_route_plan("A", "B", **options)
+    assert results[1].plan["fueling"]["planner"] == "optimal"
+
+    # Planned lanes are cached, so a repeat batch makes no further lookups.
+    again = list(services.plan_route_batch(lanes[:2]))
+    assert [lane.index for lane in again] == [0, 1]
+    assert len(routed) == 1
+
+
+def test_plan_route_batch_reports_unexpected_lane_errors(monkeypatch, caplog):
+    cache.clear()
+    reset_local_caches()
+
+    def geocode(query):
+        if query == "Broken":
+            raise KeyError("features")
+        raise services.RoutePlannerError("No geocoding result found.")
+
+    monkeypatch.setattr(services, "geocode_location", geocode)
+    monkeypatch.setattr(services, "get_station_snapshot", lambda: StationSnapshot.from_rows(1, []))
+    options = {"max_range_miles": 500, "mpg": 10.0, "max_station_distance_miles": 5.0}
+    lanes = [
+        {"start_location": "Broken", "end_location": "B", **options},
+        {"start_location": "A", "end_location": "B", **options},
+    ]
+
+    results = {lane.index: lane.detail for lane in services.plan_route_batch(lanes)}
+
+    # The bug is logged, not sent to the client, and the other lanes are still answered.
+    assert results == {0: "Route planning failed.", 1: "No geocoding result found."}
+    assert "KeyError" in caplog.text
+
+
+@pytest.mark.django_db
+def test_corridor_station_source_matches_full_snapshot(settings):
+    cache.clear()
+    reset_local_caches()
+    rng = random.Random(7)
+    for i in range(300):
+        FuelStation.objects.create(
+            opis_id=i,
+            truckstop_name=f"Stop {i}",
+            address="x",
+            city="y",
+            state="TX",
+            rack_id=1,
+            retail_price=f"{3 + rng.random():.3f}",
+            latitude=31.0 + rng.random() * 4,
+            longitude=-100.0 + rng.random() * 6,
+        )
+    route = RouteResult(400.0, 14400.0, "corridor", "polyline6")
+    route.markers = services.build_route_markers([(32.0, -99.5), (33.0, -97.5), (34.2, -95.0)])
+
+    full = services.stations_on_route(route, 10.0)
+    settings.ROUTE_STATION_SOURCE = services.STATION_SOURCE_CORRIDOR
+    corridor = services.stations_on_route(route, 10.0)
+
+    assert full
+    assert corridor == full
+    assert services.match_stations_to_route(route.markers, 10.0) == full
+    assert len(services.corridor_snapshot(route.markers, 10.0)) < FuelStation.objects.count()
@@ -0,0 +1,224 @@
+import pytest
+from django.core.cache import cache
+
+from route_planner import services
+from route_planner.caching import STATION_GENERATION_KEY, reset_local_caches
+from route_planner.models import FuelStation
+from route_planner.snapshot import StationSnapshot
+
+
+def _rows():
+    return [
+        {
+            "id": 7,
+            "opis_id": 100,
+            "truckstop_name": "Stop A",
+            "address": "1 Main St",
+            "city": "Austin",
+            "state": "TX",
+            "rack_id": 5,
+            "retail_price": 3.259,
+            "latitude": 30.25,
+            "longitude": -97.75,
+        },
+        {
+            "id": 9,
+            "opis_id": 101,
+            "truckstop_name": "Stop B",
+            "address": "2 Main St",
+            "city": "Dallas",
+            "state": "TX",
+            "rack_id": 6,
+            "retail_price": 3.109,
+            "latitude": 32.78,
+            "longitude": -96.8,
+        },
+    ]
+
+
+def test_snapshot_round_trips_through_bytes_with_lazy_details():
+    original = StationSnapshot.from_rows(3, _rows())
+    loads = []
+
+    def loader(snapshot):
+        loads.append(snapshot.version)
+        return original.details()
+
+    restored = StationSnapshot.from_bytes(3, original.to_bytes(), details_loader=loader)
+
+    assert list(restored.ids) == [7, 9]
+    assert list(restored.prices) == [3.259, 3.109]
+    assert loads == []
+    assert restored.station_data(1)["truckstop_name"] == "Stop B"
+    assert restored.station_data(0)["city"] == "Austin"
+    assert loads == [3]
+
+
+def test_snapshot_rejects_foreign_blob():
+    with pytest.raises(ValueError):
+        StationSnapshot.from_bytes(1, b"nope" + bytes(4))
+
+
+def test_layout_hash_follows_stations_not_versions():
+    original = StationSnapshot.from_rows(3, _rows())
+    restored = StationSnapshot.from_bytes(3, original.to_bytes())
+    # Rebuilt from a live database under the same version, with one station gone.
+    rebuilt = StationSnapshot.from_rows(3, _rows()[1:])
+
+    assert restored.layout_hash == original.layout_hash
+    assert original.with_prices(4, {7: 2.5}).layout_hash == original.layout_hash
+    assert rebuilt.layout_hash != original.layout_hash
+
+
+@pytest.mark.django_db
+def test_get_station_snapshot_reloads_only_when_version_changes(monkeypatch):
+    cache.clear()
+    reset_local_caches()
+    monkeypatch.setattr(services, "_station_snapshot", None)
+    FuelStation.objects.create(
+        opis_id=1,
+        truckstop_name="A",
+        address="x",
+        city="y",
+        state="TX",
+        rack_id=1,
+        retail_price="3.100",
+        latitude=30.0,
+        longitude=-97.0,
+    )
+
+    first = services.get_station_snapshot()
+    assert services.get_station_snapshot() is first
+    assert list(first.prices) == [3.1]
+
+    FuelStation.objects.update(retail_price="2.900")
+    services.invalidate_station_cache()
+    second = services.get_station_snapshot()
+
+    assert second is not first
+    assert second.version == first.version + 1
+    assert list(second.prices) == [2.9]
+    assert second.station_data(0)["truckstop_name"] == "A"
+
+
+@pytest.mark.django_db
+def test_patch_station_prices_keeps_layout_and_grid_index(monkeypatch):
+    cache.clear()
+    reset_local_caches()
+    monkeypatch.setattr(services, "_station_snapshot", None)
+    station = FuelStation.objects.create(
+        opis_id=1,
+        truckstop_name="A",
+        address="x",
+        city="y",
+        state="TX",
+        rack_id=1,
+        retail_price="3.100",
+        latitude=30.0,
+        longitude=-97.0,
+    )
+
+    first = services.get_station_snapshot()
+    index = first.grid_index()
+    services.patch_station_prices({station.id: 2.75, 999: 1.0})
+    patched = services.get_station_snapshot()
+
+    assert patched.version == first.version + 1
+    assert patched.details_version == first.version
+    assert list(patched.prices) == [2.75]
+    assert list(first.prices) == [3.1]
+    assert patched.grid_index() is index
+
+    # Another worker still on the old snapshot applies the published patch instead of reloading.
+    monkeypatch.setattr(services, "_station_snapshot", first)
+    reset_local_caches()
+    other = services.get_station_snapshot()
+    assert list(other.prices) == [2.75]
+    assert other.grid_index() is index
+
+    # A cold worker loads the patched blob and still finds the shared details.
+    monkeypatch.setattr(services, "_station_snapshot", None)
+    cold = services.get_station_snapshot()
+    assert list(cold.prices) == [2.75]
+    assert cold.station_data(0)["truckstop_name"] == "A"
+
+
+@pytest.mark.django_db
+def test_patch_station_prices_builds_on_the_latest_generation(monkeypatch, settings):
+    cache.clear()
+    reset_local_caches()
+    monkeypatch.setattr(services, "_station_snapshot", None)
+    settings.ROUTE_PLANNER_GENERATION_CHECK_SECONDS = 60
+    fields = {"address": "x", "city": "y", "state": "TX", "rack_id": 1, "latitude": 30.0, "longitude": -97.0}
+    first = FuelStation.objects.create(opis_id=1, truckstop_name="A", retail_price="3.100", **fields)
+    services.get_station_snapshot()
+
+    # Another worker adds a station and invalidates; this process still holds the old generation.
+    second = FuelStation.objects.create(opis_id=2, truckstop_name="B", retail_price="3.200", **fields)
+    cache.incr(STATION_GENERATION_KEY)
+    services.patch_station_prices({first.id: 2.75})
+    reset_local_caches()
+    assert sorted(services.get_station_snapshot().ids) == [first.id, second.id]
+
+    # With the latest snapshot published, the patch is applied on top of it.
+    services.patch_station_prices({second.id: 2.5})
+    reset_local_caches()
+    patched = services.get_station_snapshot()
+    assert sorted(zip(patched.ids, patched.prices)) == [(first.id, 3.1), (second.id, 2.5)]
+
+
+@pytest.mark.django_db
+def test_get_station_snapshot_serves_previous_stations_while_rebuild_is_locked(monkeypatch):
+    cache.clear()
+    reset_local_caches()
+    monkeypatch.setattr(services, "_station_snapshot", None)
+    FuelStation.objects.create(
+        opis_id=1,
+        truckstop_name="A",
+        address="x",
+        city="y",
+        state="TX",
+        rack_id=1,
+        retail_price="3.100",
+        latitude=30.0,
+        longitude=-97.0,
+    )
+    first = services.get_station_snapshot()
+
+    services.invalidate_station_cache()
+    version = first.version + 1
+    token = services.single_flight.acquire(services._snapshot_key(version))
+    assert services.get_station_snapshot() is first
+
+    services.single_flight.release(services._snapshot_key(version), token)
+    assert services.get_station_snapshot().version == version
+
+
+@pytest.mark.django_db
+def test_route_plan_key_follows_the_snapshot_in_use_during_a_rebuild(monkeypatch):
+    cache.clear()
+    reset_local_caches()
+    monkeypatch.setattr(services, "_station_snapshot", None)
+    FuelStation.objects.create(
+        opis_id=1,
+        truckstop_name="A",
+        address="x",
+        city="y",
+        state="TX",
+        rack_id=1,
+        retail_price="3.100",
+        latitude=30.0,
+        longitude=-97.0,
+    )
+    options = services._plan_options({"max_range_miles": 500, "mpg": 10.0, "max_station_distance_miles": 10.0})
+    before = services._route_plan_key("Austin, TX", "Dallas, TX", options)
+    first = services.get_station_snapshot()
+
+    services.invalidate_station_cache()
+    version = first.version + 1
+    token = services.single_flight.acquire(services._snapshot_key(version))
+    # Plans built on the previous stations while the rebuild runs keep the previous key.
+    assert services._route_plan_key("Austin, TX", "Dallas, TX", options) == before
+
+    services.single_flight.release(services._snapshot_key(version), token)
+    assert services._route_plan_key("Austin, TX", "Dallas, TX", options) != before
@@ -0,0 +1,74 @@
+import pytest
+
+from route_planner.services import haversine_miles
+from route_planner.spatial import (
+    StationGridIndex,
+    corridor_cells,
+    grid_cell_key,
+    segment_cells,
+    station_cell,
+)
+
+
+def _station(station_id, lat, lon):
+    return {"id": station_id, "latitude": lat, "longitude": lon, "retail_price": 3.0}
+
+
+def test_grid_index_radius_query_covers_all_nearby_stations():
+    stations = [
+        _station(1, 32.7767, -96.7970),
+        _station(2, 32.80, -96.70),
+        _station(3, 33.00, -97.00),
+        _station(4, 40.0, -100.0),
+    ]
+    index = StationGridIndex([s["latitude"] for s in stations], [s["longitude"] for s in stations], cell_degrees=0.1)
+
+    found = {stations[position]["id"] for position in index.query_radius(32.7767, -96.7970, 20.0)}
+    center = (32.7767, -96.7970)
+    expected = {s["id"] for s in stations if haversine_miles(center, (s["latitude"], s["longitude"])) <= 20}
+
+    assert expected <= found
+    assert 4 not in found
+
+
+def test_grid_index_rejects_non_positive_cell_size():
+    with pytest.raises(ValueError):
+        StationGridIndex([], [], cell_degrees=0)
+
+
+def test_station_cell_keys_are_unique_per_cell_and_wrap_the_antimeridian():
+    assert station_cell(32.01, -96.99) == station_cell(32.24, -96.76)
+    assert station_cell(32.01, -96.99) != station_cell(32.26, -96.99)
+    assert station_cell(32.01, -96.99) != station_cell(32.01, -96.74)
+    assert station_cell(10.0, 180.0) == station_cell(10.0, -180.0)
+
+
+def test_corridor_cells_cover_every_point_within_radius_of_the_route():
+    route = [(35.0, -100.0), (35.6, -99.1), (36.4, -98.9)]
+    nearby = [(35.0 + i * 0.017, -100.3 + j * 0.023) for i in range(90) for j in range(70)]
+    cells = corridor_cells(route, 15.0)
+
+    for point in nearby:
+        distance = min(_segment_miles(point, start, end) for start, end in zip(route, route[1:]))
+        if distance <= 15.0:
+            assert station_cell(*point) in cells
+    assert station_cell(40.0, -90.0) not in cells
+
+
+def _segment_miles(point, start, end, steps=200):
+    return min(
+        haversine_miles(point, (start[0] + (end[0] - start[0]) * k / steps, start[1] + (end[1] - start[1]) * k / steps))
+        for k in range(steps + 1)
+    )
+
+
+def test_segment_cells_include_every_cell_the_segment_crosses():
+    start, end = (35.03, -100.02), (35.41, -99.37)
+    cells = segment_cells(start, end, 0.1)
+
+    for step in range(1001):
+        t = step / 1000
+        point = (start[0] + t * (end[0] - start[0]), start[1] + t * (end[1] - start[1]))
+        assert grid_cell_key(*point, 0.1) in cells
+    assert segment_cells(end, start, 0.1) == cells
+    assert segment_cells((35.01, -99.99), (35.02, -99.98), 0.1) == [grid_cell_key(35.01, -99.99, 0.1)]
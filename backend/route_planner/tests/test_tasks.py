@@ -1,15 +1,28 @@
+from array import array
+from decimal import Decimal
+
 import pytest
+from django.core.cache import cache
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 
-from route_planner.models import FuelStation, FuelStationUploadJob
-from route_planner.services import GeocodeResult
+from core.celery import app as celery_app
+from route_planner import tasks
+from route_planner.models import (
+    FuelStation,
+    FuelStationUploadJob,
+    RoutePlanJob,
+    StationCorridorCell,
+)
+from route_planner.services import GeocodeResult, RoutePlannerError
+from route_planner.spatial import grid_cell_key
 from route_planner.tasks import process_fuel_station_csv
 
 
 @pytest.mark.django_db
 def test_process_fuel_station_csv_creates_stations(tmp_path, monkeypatch, settings):
     settings.MEDIA_ROOT = tmp_path
+    settings.ROUTE_CORRIDOR_TABLE_ENABLED = True
 
     csv_content = (
         "OPIS Truckstop ID,Truckstop Name,Address,City,State,Rack ID,Retail Price\n"
@@ -33,3 +46,252 @@ def test_process_fuel_station_csv_creates_stations(tmp_path, monkeypatch, settin
     assert job.failed_count == 0
     assert FuelStation.objects.count() == 2
     assert FuelStation.objects.filter(latitude__isnull=False, longitude__isnull=False).count() == 2
+    # The corridor table was built around the new stations.
+    station_ids = set(FuelStation.objects.values_list("id", flat=True))
+    corridor = StationCorridorCell.objects.get(cell=grid_cell_key(30.0, -97.0, settings.ROUTE_CORRIDOR_CELL_DEGREES))
+    assert set(array("q", bytes(corridor.station_ids))) == station_ids
+
+
+@pytest.mark.django_db
+def test_process_fuel_station_csv_batches_and_dedupes(tmp_path, monkeypatch, settings):
+    settings.MEDIA_ROOT = tmp_path
+    settings.FUEL_STATION_IMPORT_BATCH_SIZE = 2
+    FuelStation.objects.create(
+        opis_id=1,
+        truckstop_name="Stop One",
+        address="123 Main St",
+        city="Testville",
+        state="TX",
+        rack_id=10,
+        retail_price="3.10",
+        latitude=30.0,
+        longitude=-97.0,
+    )
+
+    csv_content = (
+        "OPIS Truckstop ID,Truckstop Name,Address,City,State,Rack ID,Retail Price\n"
+        "1,Stop One,123 Main St,Testville,TX,10,3.50\n"
+        "2,Stop Two,456 Main St,Testville,TX,11,3.60\n"
+        "2,Stop Two,456 Main St,Testville,TX,11,3.65\n"
+        "x,Broken,1 Nowhere,Testville,TX,12,3.00\n"
+        "3,Stop Three,789 Main St,Testville,TX,12,3.70\n"
+    )
+    saved_path = default_storage.save("uploads/batch.csv", ContentFile(csv_content.encode("utf-8")))
+    job = FuelStationUploadJob.objects.create(file_path=saved_path, original_filename="batch.csv")
+
+    queries = []
+
+    def fake_geocode(query: str):
+        queries.append(query)
+        return GeocodeResult(latitude=31.0, longitude=-98.0, place_name="Test", is_us=True)
+
+    monkeypatch.setattr("route_planner.tasks.geocode_location", fake_geocode)
+
+    process_fuel_station_csv(job.id)
+
+    job.refresh_from_db()
+    assert job.status == FuelStationUploadJob.STATUS_COMPLETED
+    assert job.total_rows == job.processed_rows == 5
+    assert (job.created_count, job.updated_count, job.failed_count) == (2, 2, 1)
+    assert job.rows_per_second > 0
+    assert sorted(queries) == ["456 Main St, Testville, TX", "789 Main St, Testville, TX"]
+    assert FuelStation.objects.get(opis_id=1).retail_price == Decimal("3.50")
+    assert FuelStation.objects.get(opis_id=2).retail_price == Decimal("3.65")
+
+
+@pytest.mark.django_db
+def test_process_fuel_station_csv_fans_out_chunks(tmp_path, monkeypatch, settings):
+    settings.MEDIA_ROOT = tmp_path
+    settings.FUEL_STATION_IMPORT_CHUNK_BYTES = 120
+    settings.FUEL_STATION_IMPORT_BATCH_SIZE = 2
+    monkeypatch.setattr(celery_app.conf, "task_always_eager", True)
+
+    rows = "".join(f"{i},Stop {i},{i} Main St,Testville,TX,{i},3.{i:02d}\n" for i in range(1, 13))
+    rows += "bad,Broken,1 Nowhere,Testville,TX,99,3.00\n"
+    csv_content = "OPIS Truckstop ID,Truckstop Name,Address,City,State,Rack ID,Retail Price\n" + rows
+    saved_path = default_storage.save("uploads/chunked.csv", ContentFile(csv_content.encode("utf-8")))
+    job = FuelStationUploadJob.objects.create(file_path=saved_path, original_filename="chunked.csv")
+
+    chunks = []
+    original_chunk = tasks.import_fuel_station_csv_chunk.run
+
+    def counting_chunk(*args):
+        chunks.append(args[1])
+        return original_chunk(*args)
+
+    invalidations = []
+    monkeypatch.setattr(tasks.import_fuel_station_csv_chunk, "run", counting_chunk)
+    monkeypatch.setattr("route_planner.tasks.invalidate_station_cache", lambda: invalidations.append(1))
+    monkeypatch.setattr(
+        "route_planner.tasks.geocode_location",
+        lambda _query: GeocodeResult(latitude=30.0, longitude=-97.0, place_name="Test", is_us=True),
+    )
+
+    process_fuel_station_csv(job.id)
+
+    job.refresh_from_db()
+    assert len(chunks) > 1
+    assert invalidations == [1]
+    assert job.status == FuelStationUploadJob.STATUS_COMPLETED
+    assert (job.total_rows, job.created_count, job.geocoded_count, job.failed_count) == (13, 12, 12, 1)
+    assert "Chunk" in job.error_log
+    assert FuelStation.objects.count() == 12
+
+
+@pytest.mark.django_db
+def test_process_fuel_station_csv_estimates_rows_from_the_start_of_the_file(tmp_path, monkeypatch, settings):
+    settings.MEDIA_ROOT = tmp_path
+    settings.FUEL_STATION_IMPORT_CHUNK_BYTES = 200
+
+    # Long names up front and short ones at the end, so a sample from the wrong place misestimates.
+    rows = "".join(f"{i},Stop {i} {'X' * 60},{i} Main St,Testville,TX,{i},3.00\n" for i in range(1, 9))
+    rows += "".join(f"{i},S,{i} Main St,Testville,TX,{i},3.00\n" for i in range(9, 21))
+    csv_content = "OPIS Truckstop ID,Truckstop Name,Address,City,State,Rack ID,Retail Price\n" + rows
+    saved_path = default_storage.save("uploads/estimate.csv", ContentFile(csv_content.encode("utf-8")))
+    job = FuelStationUploadJob.objects.create(file_path=saved_path, original_filename="estimate.csv")
+    chunks = []
+    monkeypatch.setattr(tasks, "chord", lambda header: chunks.extend(header) or (lambda body: None))
+
+    process_fuel_station_csv(job.id)
+
+    job.refresh_from_db()
+    assert len(chunks) > 2
+    assert job.total_rows == 20
+
+
+@pytest.mark.django_db
+def test_chunk_chord_failure_fails_the_job(tmp_path, monkeypatch, settings):
+    settings.MEDIA_ROOT = tmp_path
+    settings.FUEL_STATION_IMPORT_CHUNK_BYTES = 120
+
+    rows = "".join(f"{i},Stop {i},{i} Main St,Testville,TX,{i},3.{i:02d}\n" for i in range(1, 13))
+    csv_content = "OPIS Truckstop ID,Truckstop Name,Address,City,State,Rack ID,Retail Price\n" + rows
+    saved_path = default_storage.save("uploads/lost.csv", ContentFile(csv_content.encode("utf-8")))
+    job = FuelStationUploadJob.objects.create(file_path=saved_path, original_filename="lost.csv")
+
+    bodies = []
+    monkeypatch.setattr(tasks, "chord", lambda header: bodies.append)
+    invalidations = []
+    monkeypatch.setattr("route_planner.tasks.invalidate_station_cache", lambda: invalidations.append(1))
+
+    process_fuel_station_csv(job.id)
+    job.refresh_from_db()
+    assert job.status == FuelStationUploadJob.STATUS_RUNNING
+
+    # The chord calls the body's errbacks when a chunk dies without returning.
+    (errback,) = bodies[0].options["link_error"]
+    assert errback["task"] == tasks.fail_fuel_station_upload.name
+    tasks.fail_fuel_station_upload(None, RuntimeError("Worker exited prematurely"), None, *errback["args"])
+
+    job.refresh_from_db()
+    assert job.status == FuelStationUploadJob.STATUS_FAILED
+    assert "Worker exited prematurely" in job.error_log
+    assert job.finished_at is not None
+    assert invalidations == [1]
+
+
+@pytest.mark.django_db
+def test_price_refresh_only_writes_changed_prices(tmp_path, monkeypatch, settings):
+    settings.MEDIA_ROOT = tmp_path
+    for opis_id, price in ((1, "3.500"), (2, "3.600")):
+        FuelStation.objects.create(
+            opis_id=opis_id,
+            truckstop_name=f"Stop {opis_id}",
+            address=f"{opis_id} Main St",
+            city="Testville",
+            state="TX",
+            rack_id=10,
+            retail_price=price,
+            latitude=30.0,
+            longitude=-97.0,
+        )
+    untouched = FuelStation.objects.get(opis_id=1).updated_at
+
+    csv_content = (
+        "OPIS Truckstop ID,Truckstop Name,Address,City,State,Rack ID,Retail Price\n"
+        "1,Stop 1,1 Main St,Testville,TX,10,3.50\n"
+        "2,Stop 2,2 Main St,Testville,TX,10,3.45\n"
+    )
+    saved_path = default_storage.save("uploads/prices.csv", ContentFile(csv_content.encode("utf-8")))
+    job = FuelStationUploadJob.objects.create(
+        file_path=saved_path, original_filename="prices.csv", mode=FuelStationUploadJob.MODE_PRICE_REFRESH
+    )
+
+    patches = []
+    invalidations = []
+    monkeypatch.setattr("route_planner.tasks.patch_station_prices", patches.append)
+    monkeypatch.setattr("route_planner.tasks.invalidate_station_cache", lambda: invalidations.append(1))
+    monkeypatch.setattr("route_planner.tasks.geocode_location", lambda _query: pytest.fail("unexpected geocode"))
+
+    process_fuel_station_csv(job.id)
+
+    job.refresh_from_db()
+    changed = FuelStation.objects.get(opis_id=2)
+    assert job.status == FuelStationUploadJob.STATUS_COMPLETED
+    assert (job.created_count, job.updated_count, job.price_changed_count) == (0, 2, 1)
+    assert changed.retail_price == Decimal("3.450")
+    assert FuelStation.objects.get(opis_id=1).updated_at == untouched
+    assert patches == [{changed.id: 3.45}]
+    assert invalidations == []
+
+
+@pytest.mark.django_db
+def test_price_refresh_geocodes_known_stations_without_coordinates(tmp_path, monkeypatch, settings):
+    settings.MEDIA_ROOT = tmp_path
+    missing = FuelStation.objects.create(
+        opis_id=1,
+        truckstop_name="Stop 1",
+        address="1 Main St",
+        city="Testville",
+        state="TX",
+        rack_id=10,
+        retail_price="3.500",
+    )
+    csv_content = (
+        "OPIS Truckstop ID,Truckstop Name,Address,City,State,Rack ID,Retail Price\n"
+        "1,Stop 1,1 Main St,Testville,TX,10,3.50\n"
+    )
+    saved_path = default_storage.save("uploads/repair.csv", ContentFile(csv_content.encode("utf-8")))
+    job = FuelStationUploadJob.objects.create(
+        file_path=saved_path, original_filename="repair.csv", mode=FuelStationUploadJob.MODE_PRICE_REFRESH
+    )
+    invalidations = []
+    monkeypatch.setattr("route_planner.tasks.invalidate_station_cache", lambda: invalidations.append(1))
+    monkeypatch.setattr(
+        "route_planner.tasks.geocode_location",
+        lambda _query: GeocodeResult(latitude=30.0, longitude=-97.0, place_name="Test", is_us=True),
+    )
+
+    process_fuel_station_csv(job.id)
+
+    job.refresh_from_db()
+    repaired = FuelStation.objects.get(pk=missing.pk)
+    assert (job.updated_count, job.geocoded_count) == (1, 1)
+    assert (repaired.latitude, repaired.longitude) == (30.0, -97.0)
+    assert repaired.updated_at > missing.updated_at
+    # A newly located station changes the layout, so the snapshot is rebuilt rather than patched.
+    assert invalidations == [1]
+
+
+@pytest.mark.django_db
+def test_compute_route_plan_job_records_result_or_error(monkeypatch):
+    def fake_compute(**kwargs):
+        if kwargs["end_location"] == "Nowhere":
+            raise RoutePlannerError("No route found.")
+        return {"fueling": {"total_cost": 12.5}}
+
+    monkeypatch.setattr(tasks, "compute_route_plan", fake_compute)
+    done = RoutePlanJob.objects.create(request={"start_location": "A", "end_location": "B"})
+    failed = RoutePlanJob.objects.create(request={"start_location": "A", "end_location": "Nowhere"})
+
+    tasks.compute_route_plan_job(str(done.id))
+    tasks.compute_route_plan_job(str(failed.id))
+
+    done.refresh_from_db()
+    failed.refresh_from_db()
+    assert done.status == RoutePlanJob.STATUS_COMPLETED
+    assert done.result == {"fueling": {"total_cost": 12.5}}
+    assert done.started_at and done.finished_at
+    assert failed.status == RoutePlanJob.STATUS_FAILED
+    assert failed.error == "No route found."
+    assert cache.get(tasks.route_plan_job_done_key(done.id)) is True
@@ -1,7 +1,19 @@
 from django.urls import path
 
-from .views import RoutePlanView
+from .views import (
+    RoutePlanBatchView,
+    RoutePlanJobView,
+    RoutePlanView,
+    metrics_view,
+    route_plan_async,
+    route_plan_job_status,
+)
 
 urlpatterns = [
     path("route-plan/", RoutePlanView.as_view(), name="route-plan"),
+    path("route-plan/async/", route_plan_async, name="route-plan-async"),
+    path("route-plan/batch/", RoutePlanBatchView.as_view(), name="route-plan-batch"),
+    path("route-plan/jobs/", RoutePlanJobView.as_view(), name="route-plan-jobs"),
+    path("route-plan/jobs/<uuid:job_id>/", route_plan_job_status, name="route-plan-job-status"),
+    path("metrics/", metrics_view, name="metrics"),
 ]
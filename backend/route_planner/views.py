@@ -1,9 +1,31 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .serializers import RoutePlanRequestSerializer
-from .services import RoutePlannerError, compute_route_plan
+from . import instrumentation, metrics
+from .models import RoutePlanJob
+from .serializers import RoutePlanBatchRequestSerializer, RoutePlanRequestSerializer
+from .services import (
+    RoutePlannerError,
+    acompute_route_plan,
+    compute_route_plan,
+    is_route_plan_cached,
+    plan_route_batch,
+)
+from .tasks import compute_route_plan_job, route_plan_job_done_key
 
 
 class RoutePlanView(APIView):
@@ -14,9 +36,146 @@ class RoutePlanView(APIView):
         serializer = RoutePlanRequestSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
+        with instrumentation.collect() as timings, metrics.timer("route_planner_route_plan_seconds", endpoint="sync"):
+            try:
+                result = compute_route_plan(**serializer.validated_data)
+            except RoutePlannerError as exc:
+                response = Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+            else:
+                response = Response(result, status=status.HTTP_200_OK)
+            return instrumentation.finish(timings, response, request.path)
+
+
+class RoutePlanBatchView(APIView):
+    """Plans many lanes in one request and streams one JSON line per lane as it finishes.
+
+    Lines carry the lane's position in the request as ``index`` plus either ``plan`` or ``detail``.
+    Under ASGI the lines come from an async iterator, since Django would otherwise drain a sync one
+    completely before sending anything.
+    """
+
+    authentication_classes: list = []
+    permission_classes: list = []
+
+    def post(self, request, *args, **kwargs):
+        serializer = RoutePlanBatchRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        lanes = serializer.validated_data["lanes"]
+
+        def line(lane) -> str:
+            if lane.plan is not None:
+                return json.dumps({"index": lane.index, "plan": lane.plan}) + "\n"
+            return json.dumps({"index": lane.index, "detail": lane.detail}) + "\n"
+
+        def lines():
+            for lane in plan_route_batch(lanes):
+                yield line(lane)
+
+        async def alines():
+            # The batch keeps running on the request's sync thread, one lane per hop.
+            batch = plan_route_batch(lanes)
+            next_lane = sync_to_async(next)
+            while (lane := await next_lane(batch, None)) is not None:
+                yield line(lane)
+
+        content = alines() if isinstance(request._request, ASGIRequest) else lines()
+        return StreamingHttpResponse(content, content_type="application/x-ndjson")
+
+
+@csrf_exempt
+@require_POST
+async def route_plan_async(request):
+    # Same contract as RoutePlanView, without holding a worker thread while Mapbox responds.
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({"detail": "Request body must be JSON."}, status=status.HTTP_400_BAD_REQUEST)
+
+    serializer = RoutePlanRequestSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    with instrumentation.collect() as timings, metrics.timer("route_planner_route_plan_seconds", endpoint="async"):
         try:
-            result = compute_route_plan(**serializer.validated_data)
+            result = await acompute_route_plan(**serializer.validated_data)
         except RoutePlannerError as exc:
-            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+            response = JsonResponse({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            response = JsonResponse(result, status=status.HTTP_200_OK)
+        return instrumentation.finish(timings, response, request.path)
+
+
+def _job_payload(job: RoutePlanJob) -> dict:
+    payload = {
+        "job_id": str(job.id),
+        "status": job.status,
+        "created_at": job.created_at.isoformat(),
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if job.status == RoutePlanJob.STATUS_COMPLETED:
+        payload["result"] = job.result
+    elif job.status == RoutePlanJob.STATUS_FAILED:
+        payload["detail"] = job.error
+    return payload
+
+
+class RoutePlanJobView(APIView):
+    """Queues a route plan for a Celery worker and answers with a job id to poll.
+
+    Plans that are already cached are returned as a completed job straight away.
+    """
+
+    authentication_classes: list = []
+    permission_classes: list = []
+
+    def post(self, request, *args, **kwargs):
+        serializer = RoutePlanRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        if is_route_plan_cached(data):
+            try:
+                result = compute_route_plan(**data)
+            except RoutePlannerError as exc:
+                return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+            job = RoutePlanJob.objects.create(
+                request=data, status=RoutePlanJob.STATUS_COMPLETED, result=result, finished_at=timezone.now()
+            )
+            return Response(_job_payload(job), status=status.HTTP_200_OK)
+
+        job = RoutePlanJob.objects.create(request=data)
+        queue = getattr(settings, "ROUTE_PLAN_JOB_QUEUE", "celery")
+        transaction.on_commit(lambda: compute_route_plan_job.apply_async(args=[str(job.id)], queue=queue))
+        return Response(_job_payload(job), status=status.HTTP_202_ACCEPTED)
+
+
+@require_GET
+async def route_plan_job_status(request, job_id):
+    # ?wait=<seconds> long-polls until the job finishes. Served over ASGI (as the image does), the wait
+    # runs on the event loop; under WSGI it would hold a worker for its whole length.
+    try:
+        wait = float(request.GET.get("wait", 0))
+    except ValueError:
+        return JsonResponse({"detail": "wait must be a number of seconds."}, status=status.HTTP_400_BAD_REQUEST)
+    wait = min(max(wait, 0.0), getattr(settings, "ROUTE_PLAN_JOB_MAX_WAIT_SECONDS", 25))
+
+    job = await RoutePlanJob.objects.filter(pk=job_id).afirst()
+    if job is None:
+        return JsonResponse({"detail": "Job not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    deadline = time.monotonic() + wait
+    poll = getattr(settings, "ROUTE_PLAN_JOB_POLL_SECONDS", 0.25)
+    while not job.is_finished and time.monotonic() < deadline:
+        await asyncio.sleep(min(poll, max(deadline - time.monotonic(), 0)))
+        if await cache.aget(route_plan_job_done_key(job.id)) or time.monotonic() >= deadline:
+            await job.arefresh_from_db()
+
+    return JsonResponse(_job_payload(job), status=status.HTTP_200_OK)
+
 
-        return Response(result, status=status.HTTP_200_OK)
+@require_GET
+def metrics_view(request):
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return JsonResponse({"detail": "Invalid metrics token."}, status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
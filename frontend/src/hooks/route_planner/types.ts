@@ -4,6 +4,10 @@ export interface RoutePlanRequest {
   max_range_miles?: number;
   mpg?: number;
   max_station_distance_miles?: number;
+  planner?: "greedy" | "optimal";
+  stop_penalty?: number;
+  max_stops?: number | null;
+  min_purchase_gallons?: number;
 }
 
 export interface LocationInfo {
@@ -38,11 +42,13 @@ export interface FuelStop {
   longitude: number;
   virtual: boolean;
   station: FuelStation | null;
+  detour_miles?: number;
 }
 
 export interface FuelingInfo {
   max_range_miles: number;
   mpg: number;
+  planner?: "greedy" | "optimal";
   total_cost: number;
   total_gallons: number;
   fuel_stops: FuelStop[];